@@ -0,0 +1,82 @@
+"""
+命令列批次回測 - 執行規格檔中的回測與最佳化，輸出欄式結果檔
+
+用法:
+    python -m app.cli specs.yaml -o results/
+    python -m app.cli specs.json -o results/ --processes 4 --data-dir data/
+
+規格檔 (YAML 或 JSON):
+    defaults:                  # 套用到每個規格的共同欄位 (可省略)
+      start_date: 2018-01-01
+      end_date: 2024-01-01
+    backtests:                 # BacktestRequest 欄位，matrix 展開為所有組合
+      - strategy_type: MA_CROSS
+        matrix:
+          stock_symbol: [0050.TW, 2330.TW]
+          short_period: [5, 10, 20]
+    optimizations:             # OptimizeRequest 欄位
+      - strategy_type: RSI
+        stock_symbol: 2330.TW
+        param1_range: [5, 30]
+
+輸出 (預設 Parquet，--format arrow 為 Arrow IPC，--format csv 為 CSV):
+    summaries      每個回測一列：請求、績效摘要與錯誤訊息
+    equity         權益曲線長表 (run, date, equity)
+    optimizations  每個最佳化一列：最佳參數與績效
+    grid           參數網格熱力圖長表 (run, param1, param2, value)
+
+--data-dir 由本地 <股票代碼>.csv / .parquet 讀取行情，不連線 yfinance。
+"""
+
+import argparse
+import sys
+import time
+
+from dotenv import load_dotenv
+
+load_dotenv()
+
+from app.services.spec_runner import (
+    OUTPUT_FORMATS,
+    load_specs,
+    resolve_format,
+    run_specs,
+    write_tables,
+)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="命令列批次回測")
+    parser.add_argument("spec", help="規格檔 (.yaml / .yml / .json)")
+    parser.add_argument("-o", "--output", default="results", help="輸出目錄")
+    parser.add_argument("--processes", type=int, default=1, help="執行行程數")
+    parser.add_argument("--data-dir", help="本地行情資料目錄 (預設使用 yfinance)")
+    parser.add_argument(
+        "--format", choices=OUTPUT_FORMATS, default="parquet", help="輸出格式"
+    )
+    args = parser.parse_args()
+
+    try:
+        fmt = resolve_format(args.format)
+        backtests, optimizations = load_specs(args.spec)
+    except (OSError, ValueError) as e:
+        sys.exit(f"錯誤: {e}")
+
+    started = time.monotonic()
+    tables = run_specs(backtests, optimizations, args.processes, args.data_dir)
+    for path in write_tables(tables, args.output, fmt):
+        print(f"已寫入 {path}")
+
+    failed = sum(
+        df["error"].notna().sum()
+        for name, df in tables.items()
+        if name in ("summaries", "optimizations") and not df.empty
+    )
+    print(
+        f"{len(backtests)} 個回測、{len(optimizations)} 個最佳化，"
+        f"{failed} 個失敗，耗時 {time.monotonic() - started:.1f} 秒"
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,133 @@
+"""
+協作式取消與運算預算
+
+長時間的運算 (參數網格、walk-forward、Monte Carlo、多股票引擎) 在批次之間檢查
+CancellationToken：客戶端中斷連線、超過牆鐘時間或 K 棒評估次數
+(參數組合/路徑數 x 交易日數) 超過預算時停止。可切分的運算回傳目前為止的
+最佳部分結果並標記 truncated=True，無法切分的運算則拋出 OperationCancelled。
+"""
+
+import asyncio
+import os
+import threading
+import time
+from typing import Any, Callable, Optional
+
+from fastapi import Request
+from starlette.concurrency import run_in_threadpool
+
+
+def _env_limit(name: str, cast):
+    value = os.getenv(name)
+    return cast(value) if value else None
+
+
+# 伺服器端上限 (未設定則不限制)；請求只能設定更嚴格的預算
+COMPUTE_MAX_SECONDS: Optional[float] = _env_limit("COMPUTE_MAX_SECONDS", float)
+COMPUTE_MAX_BAR_EVALUATIONS: Optional[int] = _env_limit(
+    "COMPUTE_MAX_BAR_EVALUATIONS", int
+)
+# 檢查客戶端是否已中斷連線的間隔 (秒)
+DISCONNECT_POLL_SECONDS = 0.5
+
+
+class OperationCancelled(ValueError):
+    """
+    無法回傳部分結果的運算被取消或超過預算
+
+    繼承 ValueError：路由回傳 400，背景工作視為不可重試的失敗。
+    """
+
+
+def _tighter(a, b):
+    if a is None:
+        return b
+    if b is None:
+        return a
+    return min(a, b)
+
+
+class CancellationToken:
+    """取消旗標 (可由其他執行緒設定) 與牆鐘時間 / K 棒評估預算"""
+
+    def __init__(
+        self,
+        max_seconds: Optional[float] = None,
+        max_bar_evaluations: Optional[int] = None,
+    ):
+        self.max_seconds = max_seconds
+        self.max_bar_evaluations = max_bar_evaluations
+        self.started = time.monotonic()
+        self.bar_evaluations = 0
+        self._cancelled = threading.Event()
+
+    @classmethod
+    def for_request(cls, request: Any = None) -> "CancellationToken":
+        """依請求的 max_seconds / max_bar_evaluations 與伺服器上限建立"""
+        return cls(
+            _tighter(getattr(request, "max_seconds", None), COMPUTE_MAX_SECONDS),
+            _tighter(
+                getattr(request, "max_bar_evaluations", None),
+                COMPUTE_MAX_BAR_EVALUATIONS,
+            ),
+        )
+
+    def cancel(self) -> None:
+        self._cancelled.set()
+
+    @property
+    def cancelled(self) -> bool:
+        return self._cancelled.is_set()
+
+    def charge(self, bars: int) -> None:
+        """記錄已評估的 K 棒數"""
+        self.bar_evaluations += int(bars)
+
+    def budget_exhausted(self) -> bool:
+        if (
+            self.max_seconds is not None
+            and time.monotonic() - self.started >= self.max_seconds
+        ):
+            return True
+        return (
+            self.max_bar_evaluations is not None
+            and self.bar_evaluations >= self.max_bar_evaluations
+        )
+
+    def should_stop(self) -> bool:
+        return self.cancelled or self.budget_exhausted()
+
+    def check(self) -> None:
+        """不可切分的運算使用：已取消或超過預算時拋出 OperationCancelled"""
+        if self.cancelled:
+            raise OperationCancelled("運算已取消")
+        if self.budget_exhausted():
+            raise OperationCancelled("運算超過時間或 K 棒評估預算")
+
+    def batch_limit(self, size: int, bars_per_item: int) -> int:
+        """依剩餘的 K 棒預算縮小下一批的數量 (至少 1)"""
+        if self.max_bar_evaluations is None:
+            return size
+        remaining = self.max_bar_evaluations - self.bar_evaluations
+        return max(1, min(size, remaining // max(bars_per_item, 1)))
+
+
+async def run_cancellable(
+    request: Request, token: CancellationToken, func: Callable, *args, **kwargs
+):
+    """
+    在執行緒中執行同步運算，期間客戶端中斷連線即取消 token
+
+    運算本身需在批次之間檢查 token 才會提前結束。
+    """
+    task = asyncio.ensure_future(run_in_threadpool(func, *args, **kwargs))
+    try:
+        while True:
+            done, _ = await asyncio.wait({task}, timeout=DISCONNECT_POLL_SECONDS)
+            if done:
+                return task.result()
+            if not token.cancelled and await request.is_disconnected():
+                token.cancel()
+    finally:
+        if not task.done():
+            token.cancel()
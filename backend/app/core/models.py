@@ -49,11 +49,60 @@ class BacktestRecord(Base):
     avg_loss = Column(Float, nullable=False)
     total_cost = Column(Float, default=0.0)
 
+    # 延伸風險指標 (可供歷史紀錄排序)
+    sortino_ratio = Column(Float, default=0.0, index=True)
+    calmar_ratio = Column(Float, default=0.0, index=True)
+    ulcer_index = Column(Float, default=0.0)
+    max_drawdown_duration = Column(Integer, default=0)
+    time_under_water = Column(Float, default=0.0)
+    volatility = Column(Float, default=0.0)
+    skewness = Column(Float, default=0.0)
+    tail_ratio = Column(Float, default=0.0)
+
+    # 基準比較 (未指定基準時為 NULL)
+    benchmark_symbol = Column(String(50), nullable=True)
+    benchmark_return = Column(Float, nullable=True)
+    alpha = Column(Float, nullable=True)
+    beta = Column(Float, nullable=True)
+    tracking_error = Column(Float, nullable=True)
+    information_ratio = Column(Float, nullable=True)
+
     price_data = Column(JSON, nullable=False)
     equity_data = Column(JSON, nullable=False)
     trades = Column(JSON, nullable=False)
     params = Column(JSON, nullable=False)
+    # 完整的 BacktestRequest (供每日更新重新執行；舊紀錄為 NULL)
+    request = Column(JSON, nullable=True)
+    # 回測迴圈的檢查點狀態 (EngineCheckpoint.state())，每日更新時由此接續
+    checkpoint = Column(JSON, nullable=True)
 
     created_at = Column(DateTime, default=datetime.utcnow)
+    refreshed_at = Column(DateTime, nullable=True)  # 最近一次每日更新的時間
 
     user = relationship("User", back_populates="backtests")
+
+
+class Job(Base):
+    """背景工作佇列 (多個 worker 行程共用，以條件式 UPDATE 領取工作)"""
+
+    __tablename__ = "jobs"
+
+    id = Column(Integer, primary_key=True, index=True)
+    user_id = Column(
+        Integer, ForeignKey("users.id", ondelete="CASCADE"), nullable=False, index=True
+    )
+    kind = Column(String(50), nullable=False)
+    status = Column(String(20), nullable=False, default="QUEUED", index=True)
+    payload = Column(JSON, nullable=False)
+    result = Column(JSON, nullable=True)
+    error = Column(Text, nullable=True)
+    progress = Column(Float, default=0.0)
+
+    attempts = Column(Integer, default=0)  # 已被領取的次數 (worker 中斷後重新排入佇列)
+    max_attempts = Column(Integer, default=3)
+    worker_id = Column(String(100), nullable=True)
+    heartbeat_at = Column(DateTime, nullable=True)
+
+    created_at = Column(DateTime, default=datetime.utcnow, index=True)
+    started_at = Column(DateTime, nullable=True)
+    finished_at = Column(DateTime, nullable=True)
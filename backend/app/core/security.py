@@ -2,7 +2,7 @@ import os
 from datetime import datetime, timedelta
 from typing import Optional
 
-from fastapi import Depends, HTTPException, status, Request
+from fastapi import Depends, HTTPException, status, Request, WebSocket
 from fastapi.security import HTTPBearer
 from jose import JWTError, jwt
 from sqlalchemy.orm import Session
@@ -98,3 +98,20 @@ async def get_current_user_optional(
 
     user_id = int(user_id_str)
     return db.query(User).filter(User.id == user_id).first()
+
+
+def get_websocket_user(websocket: WebSocket, db: Session) -> Optional[User]:
+    """
+    WebSocket 連線的使用者
+
+    瀏覽器的 WebSocket 無法自訂 header，除了 cookie 外也接受 token 查詢參數。
+    """
+    token = get_token_from_request(websocket) or websocket.query_params.get("token")
+    if not token:
+        return None
+
+    payload = decode_access_token(token)
+    if payload is None or payload.get("sub") is None:
+        return None
+
+    return db.query(User).filter(User.id == int(payload["sub"])).first()
@@ -15,6 +15,9 @@ class StrategyType(str, Enum):
     BOLLINGER = "BOLLINGER"
     DCA = "DCA"  # 定期定額
     SMA_BREAKOUT = "SMA_BREAKOUT"  # SMA 突破策略
+    MOMENTUM_ROTATION = "MOMENTUM_ROTATION"  # 橫截面動能輪動
+    PAIRS_TRADING = "PAIRS_TRADING"  # 配對交易 (價差均值回歸)
+    EXPRESSION = "EXPRESSION"  # 自訂運算式策略
 
 
 class InvestmentInterval(str, Enum):
@@ -22,11 +25,46 @@ class InvestmentInterval(str, Enum):
     YEARLY = "YEARLY"  # 每年投入
 
 
+class Timeframe(str, Enum):
+    MINUTE = "MINUTE"  # 分 K (本地資料檔，串流模式執行)
+    HOURLY = "HOURLY"  # 小時 K (本地資料檔，串流模式執行)
+    DAILY = "DAILY"  # 日 K
+    WEEKLY = "WEEKLY"  # 週 K (由日 K 重採樣，日期為該週最後一個交易日)
+    MONTHLY = "MONTHLY"  # 月 K (由日 K 重採樣，日期為該月最後一個交易日)
+
+
+class RebalanceMode(str, Enum):
+    NONE = "NONE"  # 不再平衡，只依比例投入
+    MONTHLY = "MONTHLY"  # 每月第一個交易日再平衡
+    QUARTERLY = "QUARTERLY"  # 每季第一個交易日再平衡
+    YEARLY = "YEARLY"  # 每年第一個交易日再平衡
+    THRESHOLD = "THRESHOLD"  # 任一股票權重偏離超過門檻時再平衡
+
+
+class MomentumMetric(str, Enum):
+    TOTAL_RETURN = "TOTAL_RETURN"  # 回看期間報酬率
+    RISK_ADJUSTED = "RISK_ADJUSTED"  # 報酬率 / 回看期間波動度
+    RSI = "RSI"  # RSI 數值
+    SMA_DISTANCE = "SMA_DISTANCE"  # 收盤價相對 SMA 的乖離
+
+
 class OptimizeTarget(str, Enum):
     SHARPE = "SHARPE"  # 夏普比率 (風險調整後回報)
     ROI = "ROI"  # 總報酬率 (Total Return)
 
 
+class BenchmarkMode(str, Enum):
+    NONE = "NONE"
+    BUY_AND_HOLD = "BUY_AND_HOLD"  # 同一檔股票 (stock_symbol) 買入持有
+    SYMBOL = "SYMBOL"  # 指定 benchmark_symbol (例如大盤指數 ^GSPC)
+
+
+class PortfolioAllocationRule(str, Enum):
+    FIXED_RATIO = "FIXED_RATIO"  # 依 allocation_ratio 分配獨立資金
+    EQUAL_WEIGHT = "EQUAL_WEIGHT"  # 每檔股票平分資金
+    SHARED_CASH = "SHARED_CASH"  # 共用資金池，同日多檔買入訊號平分現金
+
+
 class StockAllocation(BaseModel):
     """股票配置（用於多股票DCA）"""
 
@@ -50,6 +88,10 @@ class BacktestRequest(BaseModel):
     end_date: str
     initial_capital: float = Field(default=1000000, ge=0)  # 最低為 0
     strategy_type: StrategyType = StrategyType.MA_CROSS
+    # K 棒週期 (僅單一股票策略)；指標週期以此週期的 K 棒數計算，
+    # 例如 WEEKLY + sma_period=40 為 40 週均線。MINUTE / HOURLY 以串流模式執行
+    # (見 services/streaming_engine.py)
+    timeframe: Timeframe = Timeframe.DAILY
 
     # MA Cross 參數
     short_period: int = 5
@@ -75,8 +117,15 @@ class BacktestRequest(BaseModel):
     dca_month: int = 1  # 每年第幾月買入 (1-12)，僅用於年度投入
     dca_interval: InvestmentInterval = InvestmentInterval.MONTHLY  # 投入週期
 
-    # 多股票 DCA 參數
+    # 多股票參數 (DCA 或技術分析策略皆可使用)
     stock_allocations: Optional[List[StockAllocation]] = None  # 多股票配置
+    allocation_rule: PortfolioAllocationRule = (
+        PortfolioAllocationRule.FIXED_RATIO
+    )  # 技術分析策略的跨股票資金分配規則
+    rebalance_mode: RebalanceMode = RebalanceMode.NONE  # 多股票 DCA 再平衡模式
+    rebalance_threshold: float = Field(
+        default=0.05, gt=0, le=1
+    )  # THRESHOLD 模式的權重偏離門檻 (0.05 = 5 個百分點)
 
     @field_validator("stock_allocations")
     @classmethod
@@ -92,9 +141,49 @@ class BacktestRequest(BaseModel):
     # 進階交易設定
     sell_ratio: float = 1.0  # 賣出比例 (0.1 ~ 1.0)，預設 1.0 (全賣)
 
+    # 出場規則 (DCA 以外的策略)，觸價時全部賣出
+    stop_loss: Optional[float] = Field(default=None, gt=0, lt=1)  # 0.1 = 跌破成本 10%
+    take_profit: Optional[float] = Field(default=None, gt=0)  # 0.2 = 高於成本 20%
+    trailing_stop: Optional[float] = Field(default=None, gt=0, lt=1)  # 自最高價回落比例
+    stop_intrabar: bool = True  # True 時以盤中 High/Low 判斷觸價，否則以收盤價
+
     # SMA Breakout 參數
     sma_period: int = 200  # SMA 週期
 
+    # Momentum Rotation 參數
+    universe: Optional[List[str]] = None  # 候選股票池 (未提供時使用 stock_allocations)
+    momentum_metric: MomentumMetric = MomentumMetric.TOTAL_RETURN
+    momentum_lookback: int = Field(default=126, ge=2)  # 回看交易日數
+    momentum_top_n: int = Field(default=3, ge=1)  # 持有排名前 N 檔
+    rotation_frequency: RebalanceMode = RebalanceMode.MONTHLY  # 換股頻率
+
+    # Pairs Trading 參數 (stock_symbol 為 Y 腿，pair_symbol 為 X 腿)
+    pair_symbol: Optional[str] = None
+    pairs_lookback: int = Field(default=60, ge=5)  # 滾動回歸與 z-score 視窗
+    pairs_entry_z: float = Field(default=2.0, gt=0)  # |z| 超過此值進場
+    pairs_exit_z: float = Field(default=0.5, ge=0)  # |z| 低於此值出場
+
+    # Expression 策略 (例如 "crossover(sma(close, 20), sma(close, 50))")
+    buy_expression: Optional[str] = None
+    sell_expression: Optional[str] = None
+    expression_params: Dict[str, float] = Field(
+        default_factory=dict
+    )  # 運算式中的具名參數
+
+    # 基準比較
+    benchmark_mode: BenchmarkMode = BenchmarkMode.NONE
+    benchmark_symbol: Optional[str] = None  # SYMBOL 模式使用
+
+    # 滾動指標視窗長度 (交易日)，例如 [126, 252] 為 6 與 12 個月；未提供則不計算
+    rolling_windows: Optional[List[int]] = None
+
+    @field_validator("rolling_windows")
+    @classmethod
+    def validate_rolling_windows(cls, v):
+        if v is not None and any(w < 2 for w in v):
+            raise ValueError("rolling_windows must be at least 2 bars")
+        return v
+
 
 class TradeRecord(BaseModel):
     """單筆交易紀錄"""
@@ -111,6 +200,7 @@ class TradeRecord(BaseModel):
     pnl: Optional[float] = None  # 對於 DCA：未實現報酬率(%)；對於其他策略：實現損益金額
     pnl_amount: Optional[float] = None  # 未實現損益金額（僅供參考）
     stock_symbol: Optional[str] = None  # 股票代碼（多股票DCA時使用）
+    exit_reason: Optional[str] = None  # 停損/停利出場原因 (STOP_LOSS 等)
 
 
 class BacktestSummary(BaseModel):
@@ -128,6 +218,24 @@ class BacktestSummary(BaseModel):
     avg_loss: float
     total_cost: Optional[float] = 0.0  # 總投入成本 (特別是 DCA)
 
+    # 延伸風險指標
+    sortino_ratio: float = 0.0
+    calmar_ratio: float = 0.0  # 年化報酬 / |最大回撤|
+    ulcer_index: float = 0.0  # 回撤百分比的均方根
+    max_drawdown_duration: int = 0  # 最長水下期間 (交易日)
+    time_under_water: float = 0.0  # 低於前高的交易日比例 (%)
+    volatility: float = 0.0  # 年化波動度 (%)
+    skewness: float = 0.0  # 日報酬偏態
+    tail_ratio: float = 0.0  # 第 95 / 第 5 百分位日報酬 (絕對值)
+
+    # 基準比較 (未指定基準時為 None)
+    benchmark_symbol: Optional[str] = None
+    benchmark_return: Optional[float] = None  # 基準買入持有報酬率 (%)
+    alpha: Optional[float] = None  # 年化 Jensen's alpha (%)
+    beta: Optional[float] = None
+    tracking_error: Optional[float] = None  # 年化追蹤誤差 (%)
+    information_ratio: Optional[float] = None
+
 
 class PriceData(BaseModel):
     """價格資料"""
@@ -142,11 +250,23 @@ class PriceData(BaseModel):
     )
 
 
+class RollingSeries(BaseModel):
+    """單一視窗長度的滾動指標 (從 dates[start] 開始，省略暖機期)"""
+
+    window: int  # 視窗長度 (交易日)
+    start: int  # 第一筆數值對應的日期索引
+    sharpe: List[Optional[float]]
+    volatility: List[Optional[float]]  # 年化波動度 (%)
+    drawdown: List[Optional[float]]  # 相對視窗內高點的回撤 (%)
+
+
 class EquityData(BaseModel):
     """權益曲線資料"""
 
     dates: List[str]
     equity: List[float]
+    rolling: Optional[List[RollingSeries]] = None  # 滾動指標 (依請求的視窗長度)
+    relative: Optional[List[float]] = None  # 相對基準的權益比值 (起點為 1)
 
 
 class BacktestResult(BaseModel):
@@ -168,6 +288,30 @@ class BacktestResult(BaseModel):
     params: Dict[str, Any]
 
 
+class BatchBacktestRequest(BaseModel):
+    """批次回測請求：同一股票與起訖日的請求共用行情資料與指標"""
+
+    requests: List[BacktestRequest] = Field(min_length=1, max_length=500)
+    save: bool = True  # 是否將成功的結果存入回測歷史
+
+
+class BatchBacktestItem(BaseModel):
+    """批次中單一請求的結果 (完整結果可以 backtest_id 查詢)"""
+
+    index: int  # 對應 requests 中的位置
+    strategy_name: str
+    stock_symbol: str
+    backtest_id: Optional[int] = None
+    summary: Optional[BacktestSummary] = None
+    error: Optional[str] = None
+
+
+class BatchBacktestResponse(BaseModel):
+    results: List[BatchBacktestItem]
+    succeeded: int
+    failed: int
+
+
 class BacktestHistoryItem(BaseModel):
     """歷史紀錄列表項目 (簡化版)"""
 
@@ -178,6 +322,34 @@ class BacktestHistoryItem(BaseModel):
     return_pct: float
     win_rate: float
     status: str  # success / warning / danger
+    sharpe_ratio: float = 0.0
+    max_drawdown: float = 0.0
+    sortino_ratio: float = 0.0
+    calmar_ratio: float = 0.0
+    ulcer_index: float = 0.0
+    max_drawdown_duration: int = 0
+    volatility: float = 0.0
+
+
+class HistorySortField(str, Enum):
+    """歷史紀錄可排序的欄位 (對應 BacktestRecord 欄位名稱)"""
+
+    CREATED_AT = "created_at"
+    TOTAL_RETURN = "total_return"
+    ANNUALIZED_RETURN = "annualized_return"
+    SHARPE_RATIO = "sharpe_ratio"
+    MAX_DRAWDOWN = "max_drawdown"
+    WIN_RATE = "win_rate"
+    SORTINO_RATIO = "sortino_ratio"
+    CALMAR_RATIO = "calmar_ratio"
+    ULCER_INDEX = "ulcer_index"
+    MAX_DRAWDOWN_DURATION = "max_drawdown_duration"
+    TIME_UNDER_WATER = "time_under_water"
+    VOLATILITY = "volatility"
+    SKEWNESS = "skewness"
+    TAIL_RATIO = "tail_ratio"
+    ALPHA = "alpha"
+    INFORMATION_RATIO = "information_ratio"
 
 
 class OptimizeRequest(BaseModel):
@@ -187,6 +359,7 @@ class OptimizeRequest(BaseModel):
     stock_symbol: str
     start_date: str
     end_date: str
+    timeframe: Timeframe = Timeframe.DAILY  # 同 BacktestRequest.timeframe
     param1_range: Optional[List[int]] = None  # [min, max]
     param1_step: Optional[int] = None
     param2_range: Optional[List[int]] = None
@@ -202,6 +375,21 @@ class OptimizeRequest(BaseModel):
     dca_month: Optional[int] = 1
     optimization_target: Optional[OptimizeTarget] = OptimizeTarget.SHARPE
 
+    # Expression 策略：運算式中的 p1 / p2 為網格參數
+    buy_expression: Optional[str] = None
+    sell_expression: Optional[str] = None
+    expression_params: Dict[str, float] = Field(default_factory=dict)
+
+    # 出場規則 (同 BacktestRequest)，套用於所有參數組合
+    stop_loss: Optional[float] = Field(default=None, gt=0, lt=1)
+    take_profit: Optional[float] = Field(default=None, gt=0)
+    trailing_stop: Optional[float] = Field(default=None, gt=0, lt=1)
+    stop_intrabar: bool = True
+
+    # 運算預算：超過時停止並回傳目前為止的最佳部分結果 (truncated=True)
+    max_seconds: Optional[float] = Field(default=None, gt=0)
+    max_bar_evaluations: Optional[int] = Field(default=None, gt=0)  # 組合數 x 交易日數
+
 
 class OptimizeResult(BaseModel):
     """最佳化結果"""
@@ -217,6 +405,210 @@ class OptimizeResult(BaseModel):
     # Allocation Result
     best_allocation: Optional[Dict[str, float]] = None  # {symbol: ratio}
 
+    truncated: bool = False  # 因取消或超過預算而只完成部分組合
+
+
+class WalkForwardRequest(BaseModel):
+    """Walk-forward 最佳化請求：訓練窗挑參數、緊接的測試窗做樣本外驗證"""
+
+    strategy_type: StrategyType
+    stock_symbol: str
+    start_date: str
+    end_date: str
+    param1_range: List[int]  # [min, max]
+    param1_step: int = Field(default=1, ge=1)
+    param2_range: Optional[List[int]] = None  # 單一參數策略可省略
+    param2_step: int = Field(default=1, ge=1)
+    initial_capital: float = Field(default=1000000, gt=0)
+    train_bars: int = Field(default=504, ge=20)  # 訓練窗長度 (交易日)
+    test_bars: int = Field(default=126, ge=5)  # 測試窗長度 (交易日)，也是每次前進的步長
+    anchored: bool = False  # True 時訓練窗起點固定在資料開頭 (擴張視窗)
+    optimization_target: OptimizeTarget = OptimizeTarget.SHARPE
+
+    # Expression 策略：運算式中的 p1 / p2 為網格參數
+    buy_expression: Optional[str] = None
+    sell_expression: Optional[str] = None
+    expression_params: Dict[str, float] = Field(default_factory=dict)
+
+    # 出場規則 (同 BacktestRequest)
+    stop_loss: Optional[float] = Field(default=None, gt=0, lt=1)
+    take_profit: Optional[float] = Field(default=None, gt=0)
+    trailing_stop: Optional[float] = Field(default=None, gt=0, lt=1)
+    stop_intrabar: bool = True
+
+    # 運算預算：超過時停止並回傳目前為止的最佳部分結果 (truncated=True)
+    max_seconds: Optional[float] = Field(default=None, gt=0)
+    max_bar_evaluations: Optional[int] = Field(default=None, gt=0)  # 組合數 x 訓練日數
+
+
+class WalkForwardFold(BaseModel):
+    """單一 fold 的訓練/測試區間與選出的參數"""
+
+    train_start: str
+    train_end: str
+    test_start: str
+    test_end: str
+    best_param1: int
+    best_param2: Optional[int] = None
+    train_return: float
+    train_sharpe: float
+    test_return: float
+    test_sharpe: float
+
+
+class WalkForwardResult(BaseModel):
+    """Walk-forward 結果：串接各 fold 測試窗的樣本外權益曲線"""
+
+    strategy_type: str
+    stock_symbol: str
+    folds: List[WalkForwardFold]
+    equity_data: EquityData  # 樣本外權益 (各 fold 報酬連乘)
+    summary: BacktestSummary  # 樣本外績效
+    truncated: bool = False  # 因取消或超過預算而只完成前面幾個 fold
+
+
+class ScreenRankMetric(str, Enum):
+    SHARPE = "SHARPE"
+    TOTAL_RETURN = "TOTAL_RETURN"
+    ANNUALIZED_RETURN = "ANNUALIZED_RETURN"
+    MAX_DRAWDOWN = "MAX_DRAWDOWN"  # 回撤越小 (越接近 0) 排名越前
+    SORTINO = "SORTINO"
+    CALMAR = "CALMAR"
+    ULCER_INDEX = "ULCER_INDEX"  # 越小排名越前
+
+
+class ScreenRequest(BaseModel):
+    """全市場篩選請求：同一組參數套用到多檔股票"""
+
+    symbols: List[str] = Field(min_length=1, max_length=1000)
+    template: BacktestRequest  # 策略參數樣板，stock_symbol 會被逐一替換
+    rank_by: ScreenRankMetric = ScreenRankMetric.SHARPE
+    top_k: int = Field(default=5, ge=0, le=50)  # 只保存排名前 k 檔的完整結果
+
+
+class ScreenResultItem(BaseModel):
+    """篩選結果 (精簡摘要)"""
+
+    rank: int
+    stock_symbol: str
+    total_return: float
+    annualized_return: float
+    sharpe_ratio: float
+    max_drawdown: float
+    win_rate: float
+    total_trades: int
+    backtest_id: Optional[int] = None  # 已保存完整結果時的紀錄 ID
+
+
+class ScreenFailure(BaseModel):
+    stock_symbol: str
+    error: str
+
+
+class ScreenResponse(BaseModel):
+    """篩選回應"""
+
+    rank_by: str
+    results: List[ScreenResultItem]
+    failures: List[ScreenFailure] = []
+
+
+class DcaSweepRequest(BaseModel):
+    """DCA 起始日掃描請求：以每個投入日作為起點，計算不同持有期間的報酬"""
+
+    stock_symbol: str
+    start_date: str  # 掃描範圍 (最早起點)
+    end_date: str
+    dca_amount: float = Field(default=10000, gt=0)
+    dca_day: int = 1
+    dca_month: int = 1
+    dca_interval: InvestmentInterval = InvestmentInterval.MONTHLY
+    # 持有期間 (以投入次數計：月投入為月數、年投入為年數)；未提供則持有至資料結束
+    horizons: Optional[List[int]] = None
+    all_horizons: bool = False  # True 時掃描 1 ~ 全部投入次數的所有持有期間
+
+    @field_validator("horizons")
+    @classmethod
+    def validate_horizons(cls, v):
+        if v is not None and any(h < 1 for h in v):
+            raise ValueError("horizons must be at least 1 contribution")
+        return v
+
+
+class DcaSweepHorizonStats(BaseModel):
+    """單一持有期間在所有起點上的報酬統計 (%)"""
+
+    horizon: int
+    count: int
+    best: float
+    worst: float
+    median: float
+    positive_ratio: float  # 報酬為正的起點比例 (%)
+
+
+class DcaSweepResult(BaseModel):
+    """DCA 起始日 x 持有期間報酬曲面"""
+
+    stock_symbol: str
+    dca_interval: str
+    start_dates: List[str]  # 列：每個起始投入日
+    horizons: List[int]  # 欄：持有期間 (投入次數)，0 表示持有至資料結束
+    returns: List[List[Optional[float]]]  # 總報酬率 (%)，超出資料範圍為 None
+    stats: List[DcaSweepHorizonStats]
+
+
+class RobustnessMethod(str, Enum):
+    BOOTSTRAP = "BOOTSTRAP"  # 日報酬區塊重抽 (保留短期自相關與波動叢聚)
+    GBM = "GBM"  # 以歷史報酬估計漂移與波動度的幾何布朗運動
+
+
+class RobustnessRequest(BaseModel):
+    """Monte Carlo 穩健性分析請求：同一組策略參數套用在大量模擬價格路徑"""
+
+    template: BacktestRequest
+    method: RobustnessMethod = RobustnessMethod.BOOTSTRAP
+    n_paths: int = Field(default=1000, ge=10, le=10000)
+    block_size: int = Field(default=20, ge=1)  # BOOTSTRAP 區塊長度 (交易日)
+    seed: Optional[int] = None  # 固定亂數種子以重現結果
+    # 離線使用：直接提供收盤價序列 (自 start_date 起的交易日)，不經由行情資料
+    prices: Optional[List[float]] = None
+
+    # 運算預算：超過時停止並回傳目前為止的最佳部分結果 (truncated=True)
+    max_seconds: Optional[float] = Field(default=None, gt=0)
+    max_bar_evaluations: Optional[int] = Field(default=None, gt=0)  # 路徑數 x 交易日數
+
+
+class MetricDistribution(BaseModel):
+    """單一指標在所有模擬路徑上的分佈"""
+
+    mean: float
+    std: float
+    min: float
+    max: float
+    p5: float
+    p25: float
+    p50: float
+    p75: float
+    p95: float
+    histogram: List[int]
+    bin_edges: List[float]
+
+
+class RobustnessResult(BaseModel):
+    """Monte Carlo 穩健性分析結果"""
+
+    method: str
+    n_paths: int
+    n_days: int
+    original: Dict[
+        str, float
+    ]  # 實際價格路徑的 total_return / sharpe_ratio / max_drawdown
+    total_return: MetricDistribution
+    sharpe_ratio: MetricDistribution
+    max_drawdown: MetricDistribution
+    prob_loss: float  # 總報酬為負的路徑比例 (%)
+    truncated: bool = False  # 因取消或超過預算而只模擬部分路徑 (n_paths 為實際路徑數)
+
 
 class CompareRequest(BaseModel):
     """策略比較請求"""
@@ -250,3 +642,41 @@ class DashboardResponse(BaseModel):
 
     stats: DashboardStats
     recent_backtests: List[DashboardRecentItem]
+
+
+class JobKind(str, Enum):
+    BACKTEST = "backtest"  # payload 為 BacktestRequest，結果存入回測歷史
+    OPTIMIZE = "optimize"  # OptimizeRequest
+    WALK_FORWARD = "walk_forward"  # WalkForwardRequest
+    ROBUSTNESS = "robustness"  # RobustnessRequest
+    DCA_SWEEP = "dca_sweep"  # DcaSweepRequest
+
+
+class JobStatus(str, Enum):
+    QUEUED = "QUEUED"
+    RUNNING = "RUNNING"
+    SUCCEEDED = "SUCCEEDED"
+    FAILED = "FAILED"
+
+
+class JobSubmitRequest(BaseModel):
+    """提交背景工作"""
+
+    kind: JobKind
+    payload: Dict[str, Any]  # 對應 kind 的請求內容
+    max_attempts: int = Field(default=3, ge=1, le=10)  # worker 中斷時最多重試次數
+
+
+class JobInfo(BaseModel):
+    """背景工作狀態"""
+
+    id: int
+    kind: JobKind
+    status: JobStatus
+    progress: float  # 0 ~ 1
+    attempts: int
+    max_attempts: int
+    error: Optional[str] = None
+    created_at: str
+    started_at: Optional[str] = None
+    finished_at: Optional[str] = None
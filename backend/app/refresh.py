@@ -0,0 +1,51 @@
+"""
+回測紀錄每日更新 - 將已保存的開放式回測延長到最新交易日
+
+用法:
+    python -m app.refresh                        # 延長到今天
+    python -m app.refresh --end-date 2024-06-30  # 指定結束日
+    python -m app.refresh --symbol 0050.TW --symbol 2330.TW
+
+適合以 cron 於收盤後每日執行；單機部署也可設定 RECORD_REFRESH_AT=HH:MM 由 API 行程排程。
+"""
+
+import argparse
+import time
+
+from dotenv import load_dotenv
+
+load_dotenv()
+
+from app.core.database import init_db
+from app.services.record_refresh import refresh_records
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="回測紀錄每日更新")
+    parser.add_argument("--end-date", help="新的結束日 YYYY-MM-DD (預設今天)")
+    parser.add_argument(
+        "--symbol",
+        action="append",
+        dest="symbols",
+        help="只更新指定股票的紀錄 (可重複指定)",
+    )
+    args = parser.parse_args()
+
+    init_db()
+    started = time.monotonic()
+    summary = refresh_records(
+        args.end_date,
+        args.symbols,
+        progress=lambda symbol, done, total: print(f"[{done}/{total}] {symbol}"),
+    )
+    for record_id, error in summary.errors.items():
+        print(f"紀錄 {record_id} 更新失敗: {error}")
+    print(
+        f"更新至 {summary.end_date}: {summary.refreshed} 筆成功、{summary.failed} 筆失敗、"
+        f"{summary.skipped} 筆略過 (未保存請求)，共 {summary.symbols} 檔股票，"
+        f"耗時 {time.monotonic() - started:.1f} 秒"
+    )
+
+
+if __name__ == "__main__":
+    main()
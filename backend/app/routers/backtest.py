@@ -1,96 +1,64 @@
-from fastapi import APIRouter, HTTPException, Depends
-from typing import List
+from fastapi import APIRouter, HTTPException, Depends, Query, Request
+from typing import List, Optional
 from sqlalchemy.orm import Session
 
+from app.core.cancellation import CancellationToken, run_cancellable
 from app.core.database import get_db
 from app.core.models import User, BacktestRecord
 from app.core.security import get_current_user
 from app.models.backtest import (
     BacktestRequest,
     BacktestResult,
+    BatchBacktestItem,
+    BatchBacktestRequest,
+    BatchBacktestResponse,
     BacktestHistoryItem,
-    BacktestSummary,
-    PriceData,
-    EquityData,
-    TradeRecord,
+    HistorySortField,
     DashboardStats,
     DashboardRecentItem,
     DashboardResponse,
+    ScreenRequest,
+    ScreenResponse,
+    RollingSeries,
+    RobustnessRequest,
+    RobustnessResult,
+    DcaSweepRequest,
+    DcaSweepResult,
+)
+from app.services.backtest_engine import BacktestEngine
+from app.services.batch_backtest import run_backtest_batch
+from app.services.result_cache import cached_backtest
+from app.services.screening import run_screen, run_top_backtests
+from app.services.metrics import build_rolling_series
+from app.services.robustness import run_robustness
+from app.services.dca_sweep import run_dca_sweep
+from app.services.timeframes import periods_per_year
+from app.services.records import (
+    db_record_to_result,
+    equity_timeframe,
+    next_backtest_id,
+    result_to_record,
+    save_results,
 )
-from app.services.backtest_engine import run_full_backtest, BacktestEngine
 
 router = APIRouter(prefix="/api/backtest", tags=["Backtest"])
 
 
-def db_record_to_result(record: BacktestRecord) -> BacktestResult:
-    return BacktestResult(
-        id=record.id,
-        strategy_name=record.strategy_name,
-        stock_symbol=record.stock_symbol,
-        strategy_type=record.strategy_type,
-        start_date=record.start_date,
-        end_date=record.end_date,
-        initial_capital=record.initial_capital,
-        final_capital=record.final_capital,
-        created_at=record.created_at.isoformat() if record.created_at else "",
-        summary=BacktestSummary(
-            total_return=record.total_return,
-            annualized_return=record.annualized_return,
-            sharpe_ratio=record.sharpe_ratio,
-            max_drawdown=record.max_drawdown,
-            win_rate=record.win_rate,
-            total_trades=record.total_trades,
-            profit_trades=record.profit_trades,
-            loss_trades=record.loss_trades,
-            avg_profit=record.avg_profit,
-            avg_loss=record.avg_loss,
-            total_cost=record.total_cost,
-        ),
-        price_data=PriceData(**record.price_data),
-        equity_data=EquityData(**record.equity_data),
-        trades=[TradeRecord(**t) for t in record.trades],
-        params=record.params,
-    )
-
-
 @router.post("/run", response_model=BacktestResult)
 async def run_backtest(
     request: BacktestRequest,
+    http_request: Request,
     db: Session = Depends(get_db),
     current_user: User = Depends(get_current_user),
 ):
+    token = CancellationToken.for_request(request)
     try:
-        max_id = db.query(BacktestRecord.id).order_by(BacktestRecord.id.desc()).first()
-        next_id = (max_id[0] + 1) if max_id else 1
-
-        result = run_full_backtest(request, next_id)
-
-        record = BacktestRecord(
-            user_id=current_user.id,
-            strategy_name=result.strategy_name,
-            stock_symbol=result.stock_symbol,
-            strategy_type=result.strategy_type,
-            start_date=result.start_date,
-            end_date=result.end_date,
-            initial_capital=result.initial_capital,
-            final_capital=result.final_capital,
-            total_return=result.summary.total_return,
-            annualized_return=result.summary.annualized_return,
-            sharpe_ratio=result.summary.sharpe_ratio,
-            max_drawdown=result.summary.max_drawdown,
-            win_rate=result.summary.win_rate,
-            total_trades=result.summary.total_trades,
-            profit_trades=result.summary.profit_trades,
-            loss_trades=result.summary.loss_trades,
-            avg_profit=result.summary.avg_profit,
-            avg_loss=result.summary.avg_loss,
-            total_cost=result.summary.total_cost or 0.0,
-            price_data=result.price_data.model_dump(),
-            equity_data=result.equity_data.model_dump(),
-            trades=[t.model_dump() for t in result.trades],
-            params=result.params,
+        result = await run_cancellable(
+            http_request, token, cached_backtest, request, next_backtest_id(db), token
         )
 
+        record = result_to_record(result, current_user.id, request)
+
         db.add(record)
         db.commit()
         db.refresh(record)
@@ -103,6 +71,125 @@ async def run_backtest(
         raise HTTPException(status_code=500, detail=f"回測執行失敗: {str(e)}")
 
 
+@router.post("/batch", response_model=BatchBacktestResponse)
+async def run_backtest_batch_endpoint(
+    request: BatchBacktestRequest,
+    http_request: Request,
+    db: Session = Depends(get_db),
+    current_user: User = Depends(get_current_user),
+):
+    """
+    批次回測：同一股票與起訖日的技術分析策略共用資料與指標並以批次核心一次模擬，
+    成功的結果在同一個交易中寫入回測歷史；單一請求失敗只記錄在該筆的 error
+    """
+    token = CancellationToken.for_request()
+    try:
+        outcomes = await run_cancellable(
+            http_request, token, run_backtest_batch, request.requests, token
+        )
+
+        succeeded = [i for i, (result, _) in enumerate(outcomes) if result is not None]
+        ids = {}
+        if request.save and succeeded:
+            saved = save_results(
+                db,
+                [outcomes[i][0] for i in succeeded],
+                current_user.id,
+                [request.requests[i] for i in succeeded],
+            )
+            ids = dict(zip(succeeded, saved))
+
+        results = [
+            BatchBacktestItem(
+                index=i,
+                strategy_name=item.strategy_name,
+                stock_symbol=item.stock_symbol,
+                backtest_id=ids.get(i),
+                summary=result.summary if result is not None else None,
+                error=error,
+            )
+            for i, (item, (result, error)) in enumerate(zip(request.requests, outcomes))
+        ]
+        return BatchBacktestResponse(
+            results=results,
+            succeeded=len(succeeded),
+            failed=len(outcomes) - len(succeeded),
+        )
+
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"批次回測執行失敗: {str(e)}")
+
+
+@router.post("/screen", response_model=ScreenResponse)
+async def screen_universe(
+    request: ScreenRequest,
+    http_request: Request,
+    db: Session = Depends(get_db),
+    current_user: User = Depends(get_current_user),
+):
+    token = CancellationToken.for_request()
+    try:
+        response = await run_cancellable(
+            http_request, token, run_screen, request, token
+        )
+
+        # 只保存排名前 top_k 檔的完整回測結果
+        outcomes = await run_cancellable(
+            http_request, token, run_top_backtests, request, response, token
+        )
+        saved = []
+        for item, stock_request, result in outcomes:
+            record = result_to_record(result, current_user.id, stock_request)
+            db.add(record)
+            saved.append((item, record))
+
+        if saved:
+            db.commit()
+            for item, record in saved:
+                item.backtest_id = record.id
+
+        return response
+
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"篩選執行失敗: {str(e)}")
+
+
+@router.post("/robustness", response_model=RobustnessResult)
+async def robustness_analysis(
+    request: RobustnessRequest,
+    http_request: Request,
+    current_user: User = Depends(get_current_user),
+):
+    token = CancellationToken.for_request(request)
+    try:
+        return await run_cancellable(
+            http_request, token, run_robustness, request, token
+        )
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"穩健性分析失敗: {str(e)}")
+
+
+@router.post("/dca-sweep", response_model=DcaSweepResult)
+async def dca_start_date_sweep(
+    request: DcaSweepRequest,
+    http_request: Request,
+    current_user: User = Depends(get_current_user),
+):
+    token = CancellationToken.for_request()
+    try:
+        return await run_cancellable(http_request, token, run_dca_sweep, request, token)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"DCA 起始日掃描失敗: {str(e)}")
+
+
 @router.get("/dashboard", response_model=DashboardResponse)
 async def get_dashboard(
     db: Session = Depends(get_db),
@@ -168,13 +255,16 @@ async def get_dashboard(
 
 @router.get("/history", response_model=List[BacktestHistoryItem])
 async def get_history(
+    sort_by: HistorySortField = HistorySortField.CREATED_AT,
+    descending: bool = True,
     db: Session = Depends(get_db),
     current_user: User = Depends(get_current_user),
 ):
+    sort_column = getattr(BacktestRecord, sort_by.value)
     records = (
         db.query(BacktestRecord)
         .filter(BacktestRecord.user_id == current_user.id)
-        .order_by(BacktestRecord.created_at.desc())
+        .order_by(sort_column.desc() if descending else sort_column.asc())
         .all()
     )
 
@@ -196,6 +286,13 @@ async def get_history(
                 return_pct=record.total_return,
                 win_rate=record.win_rate,
                 status=status,
+                sharpe_ratio=record.sharpe_ratio,
+                max_drawdown=record.max_drawdown,
+                sortino_ratio=record.sortino_ratio or 0.0,
+                calmar_ratio=record.calmar_ratio or 0.0,
+                ulcer_index=record.ulcer_index or 0.0,
+                max_drawdown_duration=record.max_drawdown_duration or 0,
+                volatility=record.volatility or 0.0,
             )
         )
 
@@ -222,6 +319,36 @@ async def get_backtest_result(
     return db_record_to_result(record)
 
 
+@router.get("/result/{backtest_id}/rolling", response_model=List[RollingSeries])
+async def get_rolling_analytics(
+    backtest_id: int,
+    windows: Optional[List[int]] = Query(default=None),
+    db: Session = Depends(get_db),
+    current_user: User = Depends(get_current_user),
+):
+    """
+    以已儲存的權益曲線計算任意視窗長度的滾動指標 (不需重跑回測)
+
+    視窗長度以 K 棒數計，依紀錄的 K 棒週期年化；未指定時為半年與一年。
+    """
+    record = (
+        db.query(BacktestRecord)
+        .filter(
+            BacktestRecord.id == backtest_id, BacktestRecord.user_id == current_user.id
+        )
+        .first()
+    )
+
+    if not record:
+        raise HTTPException(status_code=404, detail="找不到該回測紀錄")
+    bars_per_year = periods_per_year(equity_timeframe(record))
+    windows = windows or [bars_per_year // 2, bars_per_year]
+    if any(w < 2 for w in windows):
+        raise HTTPException(status_code=400, detail="視窗長度至少為 2 根 K 棒")
+
+    return build_rolling_series(record.equity_data["equity"], windows, bars_per_year)
+
+
 @router.delete("/history/{backtest_id}")
 async def delete_history(
     backtest_id: int,
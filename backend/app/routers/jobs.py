@@ -0,0 +1,93 @@
+from typing import Any, List
+
+from fastapi import APIRouter, HTTPException, Depends, Query
+from sqlalchemy.orm import Session
+
+from app.core.database import get_db
+from app.core.models import User, BacktestRecord, Job
+from app.core.security import get_current_user
+from app.models.backtest import JobInfo, JobKind, JobStatus, JobSubmitRequest
+from app.services.job_queue import job_to_info, submit_job
+from app.services.records import db_record_to_result
+
+router = APIRouter(prefix="/api/jobs", tags=["Jobs"])
+
+
+def _get_job(db: Session, job_id: int, user_id: int) -> Job:
+    job = db.query(Job).filter(Job.id == job_id, Job.user_id == user_id).first()
+    if not job:
+        raise HTTPException(status_code=404, detail="找不到此工作")
+    return job
+
+
+@router.post("", response_model=JobInfo, status_code=202)
+async def create_job(
+    request: JobSubmitRequest,
+    db: Session = Depends(get_db),
+    current_user: User = Depends(get_current_user),
+):
+    """提交背景工作，立即回傳工作 id (由 worker 行程執行)"""
+    try:
+        job = submit_job(
+            db, current_user.id, request.kind, request.payload, request.max_attempts
+        )
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return job_to_info(job)
+
+
+@router.get("", response_model=List[JobInfo])
+async def list_jobs(
+    limit: int = Query(default=50, ge=1, le=500),
+    db: Session = Depends(get_db),
+    current_user: User = Depends(get_current_user),
+):
+    jobs = (
+        db.query(Job)
+        .filter(Job.user_id == current_user.id)
+        .order_by(Job.created_at.desc())
+        .limit(limit)
+        .all()
+    )
+    return [job_to_info(job) for job in jobs]
+
+
+@router.get("/{job_id}", response_model=JobInfo)
+async def get_job(
+    job_id: int,
+    db: Session = Depends(get_db),
+    current_user: User = Depends(get_current_user),
+):
+    return job_to_info(_get_job(db, job_id, current_user.id))
+
+
+@router.get("/{job_id}/result")
+async def get_job_result(
+    job_id: int,
+    db: Session = Depends(get_db),
+    current_user: User = Depends(get_current_user),
+) -> Any:
+    """
+    取得已完成工作的結果
+
+    backtest 工作回傳完整的 BacktestResult (已存入回測歷史)，其他工作回傳對應的結果模型。
+    """
+    job = _get_job(db, job_id, current_user.id)
+    if job.status == JobStatus.FAILED.value:
+        raise HTTPException(status_code=400, detail=job.error or "工作執行失敗")
+    if job.status != JobStatus.SUCCEEDED.value:
+        raise HTTPException(status_code=409, detail=f"工作尚未完成 ({job.status})")
+
+    if job.kind == JobKind.BACKTEST.value:
+        record = (
+            db.query(BacktestRecord)
+            .filter(
+                BacktestRecord.id == job.result["backtest_id"],
+                BacktestRecord.user_id == current_user.id,
+            )
+            .first()
+        )
+        if not record:
+            raise HTTPException(status_code=404, detail="找不到此回測結果")
+        return db_record_to_result(record)
+    return job.result
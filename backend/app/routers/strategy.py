@@ -1,21 +1,49 @@
-from fastapi import APIRouter, HTTPException, Depends
+import asyncio
+import json
+from typing import Any, Dict, List, Optional
+
+from fastapi import (
+    APIRouter,
+    HTTPException,
+    Depends,
+    Request,
+    WebSocket,
+    WebSocketDisconnect,
+    status,
+)
 from sqlalchemy.orm import Session
+from starlette.concurrency import run_in_threadpool
+from starlette.websockets import WebSocketState
 
-from app.core.database import get_db
+from app.core.cancellation import CancellationToken, run_cancellable
+from app.core.database import SessionLocal, get_db
 from app.core.models import User, BacktestRecord
-from app.core.security import get_current_user
+from app.core.security import get_current_user, get_websocket_user
 from app.models.backtest import (
     OptimizeRequest,
     OptimizeResult,
     CompareRequest,
-    BacktestRequest,
     StrategyType,
+    WalkForwardRequest,
+    WalkForwardResult,
+)
+from app.services.backtest_engine import optimize_dca_allocation
+from app.services.optimizer import (
+    GridSweep,
+    optimize_parameter_grid,
+    run_walk_forward,
 )
-from app.services.backtest_engine import BacktestEngine, optimize_dca_allocation
+from app.services.strategy_registry import strategy_schema
 
 router = APIRouter(prefix="/api/strategy", tags=["Strategy"])
 
 
+@router.get("/schema")
+async def get_strategy_schema(current_user: User = Depends(get_current_user)):
+    """各技術分析策略的參數、所需指標與可最佳化的網格參數"""
+    return strategy_schema()
+
+
 @router.post("/compare")
 async def compare_strategies(
     request: CompareRequest,
@@ -73,83 +101,173 @@ async def compare_strategies(
 @router.post("/optimize", response_model=OptimizeResult)
 async def optimize_strategy(
     request: OptimizeRequest,
+    http_request: Request,
     current_user: User = Depends(get_current_user),
 ):
+    token = CancellationToken.for_request(request)
     if request.strategy_type == StrategyType.DCA:
         try:
-            return optimize_dca_allocation(request)
+            return await run_cancellable(
+                http_request, token, optimize_dca_allocation, request, token
+            )
         except Exception as e:
             raise HTTPException(status_code=400, detail=str(e))
 
     try:
-        param1_values = list(
-            range(
-                request.param1_range[0],
-                request.param1_range[1] + 1,
-                request.param1_step,
-            )
-        )
-        param2_values = list(
-            range(
-                request.param2_range[0],
-                request.param2_range[1] + 1,
-                request.param2_step,
-            )
+        return await run_cancellable(
+            http_request, token, optimize_parameter_grid, request, token
         )
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"最佳化失敗: {str(e)}")
 
-        heatmap_data = []
-        best_return = -float("inf")
-        best_sharpe = 0
-        best_param1 = param1_values[0]
-        best_param2 = param2_values[0]
 
-        for i, p1 in enumerate(param1_values):
-            for j, p2 in enumerate(param2_values):
-                if p2 <= p1:
-                    heatmap_data.append([i, j, None])
+def _progress_message(sweep: GridSweep, cells: List[List[Any]]) -> Dict[str, Any]:
+    eta = sweep.eta()
+    return {
+        "type": "progress",
+        "cells": cells,
+        "done": sweep.done,
+        "total": sweep.total,
+        "best": sweep.best(),
+        "elapsed": round(sweep.elapsed, 3),
+        "eta": round(eta, 3) if eta is not None else None,
+    }
+
+
+async def _close_with_error(websocket: WebSocket, detail: str) -> None:
+    if websocket.client_state == WebSocketState.CONNECTED:
+        await websocket.send_json({"type": "error", "detail": detail})
+        await websocket.close()
+
+
+async def _stream_sweep(websocket: WebSocket, sweep: GridSweep) -> None:
+    """
+    邊計算邊推送進度
+
+    前一則訊息尚未送出時，新完成的格子先累積、下次合併送出：連線較慢的客戶端
+    收到的訊息較少但每則較大，計算不會被傳送拖慢，也不會堆積未送出的訊息。
+    收到 {"action": "cancel"} 或連線中斷時，於目前批次結束後停止 (其他訊息忽略)；
+    超過請求的運算預算時送出部分結果 (truncated=True)。
+    """
+    token = sweep.token
+
+    async def listen() -> None:
+        # 只有中斷連線或明確的 cancel 會停止；無法解析的訊息直接忽略
+        try:
+            while True:
+                try:
+                    message = json.loads(await websocket.receive_text())
+                except ValueError:
                     continue
+                if isinstance(message, dict) and message.get("action") == "cancel":
+                    break
+        except WebSocketDisconnect:
+            pass
+        token.cancel()
+
+    listener = asyncio.create_task(listen())
+    sending: Optional[asyncio.Task] = None
+    pending: List[List[Any]] = []
+    try:
+        await websocket.send_json(
+            {
+                "type": "start",
+                "total": sweep.total,
+                "x_labels": sweep.param1_values,
+                "y_labels": sweep.param2_values or None,
+            }
+        )
+        while not sweep.finished and not sweep.stopped:
+            pending.extend(await run_in_threadpool(sweep.run_batch))
+            if sending is None or sending.done():
+                if sending is not None:
+                    sending.result()
+                sending = asyncio.create_task(
+                    websocket.send_json(_progress_message(sweep, pending))
+                )
+                pending = []
+        if sending is not None:
+            await sending
 
-                bt_request = BacktestRequest(
-                    strategy_name=f"Optimize_{p1}_{p2}",
-                    stock_symbol=request.stock_symbol,
-                    start_date=request.start_date,
-                    end_date=request.end_date,
-                    strategy_type=request.strategy_type,
-                    short_period=p1,
-                    long_period=p2,
+        if token.cancelled:
+            if websocket.client_state == WebSocketState.CONNECTED:
+                await websocket.send_json(
+                    {
+                        "type": "cancelled",
+                        "done": sweep.done,
+                        "total": sweep.total,
+                        "best": sweep.best(),
+                    }
                 )
+                await websocket.close()
+            return
 
-                try:
-                    engine = BacktestEngine(bt_request)
-                    engine.fetch_data()
-                    engine.calculate_indicators()
-                    engine.generate_signals()
-                    engine.run_backtest()
-                    summary = engine.calculate_metrics()
-
-                    total_return = summary.total_return
-                    sharpe = summary.sharpe_ratio
-
-                    heatmap_data.append([i, j, round(total_return, 1)])
-
-                    if total_return > best_return:
-                        best_return = total_return
-                        best_sharpe = sharpe
-                        best_param1 = p1
-                        best_param2 = p2
-
-                except Exception:
-                    heatmap_data.append([i, j, None])
-
-        return OptimizeResult(
-            best_param1=best_param1,
-            best_param2=best_param2,
-            best_return=round(best_return, 2),
-            best_sharpe=round(best_sharpe, 2),
-            heatmap_data=heatmap_data,
-            x_labels=param1_values,
-            y_labels=param2_values,
+        if pending:
+            await websocket.send_json(_progress_message(sweep, pending))
+        await websocket.send_json(
+            {"type": "result", "result": sweep.result().model_dump(mode="json")}
         )
+        await websocket.close()
+    except WebSocketDisconnect:
+        pass
+    except Exception as e:
+        await _close_with_error(websocket, f"最佳化失敗: {str(e)}")
+    finally:
+        listener.cancel()
 
+
+@router.websocket("/optimize/ws")
+async def optimize_strategy_stream(websocket: WebSocket):
+    """
+    串流參數網格最佳化進度
+
+    連線後送出 OptimizeRequest JSON，伺服器依序推送：
+    start (組合總數與座標軸) -> progress (新完成的熱力圖格、目前最佳組合、預估剩餘秒數)
+    -> result (與 POST /optimize 相同的結果)。
+    """
+    db = SessionLocal()
+    try:
+        user = get_websocket_user(websocket, db)
+    finally:
+        db.close()
+    if user is None:
+        await websocket.close(code=status.WS_1008_POLICY_VIOLATION)
+        return
+
+    await websocket.accept()
+    try:
+        request = OptimizeRequest.model_validate(await websocket.receive_json())
+        if request.strategy_type == StrategyType.DCA:
+            raise ValueError("DCA 資產配置最佳化不支援串流進度")
+        sweep = await run_in_threadpool(
+            GridSweep, request, CancellationToken.for_request(request)
+        )
+    except WebSocketDisconnect:
+        return
+    except ValueError as e:
+        await _close_with_error(websocket, str(e))
+        return
     except Exception as e:
-        raise HTTPException(status_code=500, detail=f"最佳化失敗: {str(e)}")
+        await _close_with_error(websocket, f"最佳化失敗: {str(e)}")
+        return
+
+    await _stream_sweep(websocket, sweep)
+
+
+@router.post("/walk-forward", response_model=WalkForwardResult)
+async def walk_forward(
+    request: WalkForwardRequest,
+    http_request: Request,
+    current_user: User = Depends(get_current_user),
+):
+    token = CancellationToken.for_request(request)
+    try:
+        return await run_cancellable(
+            http_request, token, run_walk_forward, request, None, token
+        )
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Walk-forward 分析失敗: {str(e)}")
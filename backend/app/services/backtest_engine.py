@@ -2,12 +2,20 @@
 股票回測引擎 - 使用 yfinance 取得數據，pandas 進行回測計算
 """
 
-import yfinance as yf
+import math
 import pandas as pd
 import numpy as np
+import os
 from datetime import datetime
-from typing import Dict, Any, List, Tuple, Optional
-
+from typing import List, Tuple, Optional
+
+from app.core.cancellation import CancellationToken
+from app.services.checkpoints import (
+    EngineCheckpoint,
+    bar_digest,
+    checkpoint_bar,
+    engine_checkpoints,
+)
 from app.models.backtest import (
     BacktestRequest,
     BacktestResult,
@@ -20,15 +28,35 @@ from app.models.backtest import (
     OptimizeRequest,
     OptimizeResult,
     OptimizeTarget,
+    RebalanceMode,
+    BenchmarkMode,
+    Timeframe,
+)
+from app.services.market_data import (
+    fetch_aligned_closes,
+    fetch_closes_on,
+    fetch_history,
+)
+from app.services.schedule import contribution_mask, period_start_mask
+from app.services.stops import StopRules, first_stop_hit, next_signal_bars
+from app.services.strategy_dsl import ExpressionEvaluator, ohlcv_series
+from app.services.timeframes import INTRADAY_TIMEFRAMES, periods_per_year
+from app.services.strategy_registry import (
+    STRATEGIES,
+    build_signal_matrix,
+    compute_indicators,
+)
+from app.services.metrics import (
+    _clean_float,
+    build_rolling_series,
+    compute_benchmark_metrics,
+    build_summary,
+    compute_metrics,
+    summarize_equity,
 )
 
-
-def _clean_float(val) -> float:
-    if val is None:
-        return 0.0
-    if np.isnan(val) or np.isinf(val):
-        return 0.0
-    return float(val)
+# DCA 資產配置 Monte Carlo 每批模擬的權重組合數
+ALLOCATION_BATCH_SIMULATIONS = int(os.getenv("ALLOCATION_BATCH_SIMULATIONS", "250"))
 
 
 class BacktestEngine:
@@ -42,91 +70,33 @@ class BacktestEngine:
         self.total_invested: float = 0.0  # 總投入本金 (初始 + 追加)
         self.total_cost: float = 0.0  # 實際買入成本
         self.final_stock_value: float = 0.0
+        self.evaluator: Optional[ExpressionEvaluator] = None
+        self.checkpoint: Optional[EngineCheckpoint] = None
+        self.resumed_bars: int = 0  # 由檢查點接續時略過的 K 棒數
 
     def fetch_data(self) -> pd.DataFrame:
-        """從 yfinance 取得股票數據"""
-        symbol = self.request.stock_symbol
-
-        # 使用 Ticker.history() 方法 (yfinance 1.0 推薦方式)
-        try:
-            ticker = yf.Ticker(symbol)
-            df = ticker.history(
-                start=self.request.start_date,
-                end=self.request.end_date,
-                auto_adjust=True,
-            )
-        except Exception as e:
-            raise ValueError(f"無法取得 {symbol} 的數據: {str(e)}")
-
-        if df.empty:
-            raise ValueError(f"無法取得 {symbol} 的數據，請確認股票代碼是否正確")
-
-        # 處理 timezone-aware datetime
-        df = df.reset_index()
-        if hasattr(df["Date"].dtype, "tz") and df["Date"].dt.tz is not None:
-            # 移除時區信息，只保留日期
-            df["Date"] = df["Date"].dt.tz_localize(None)
-        df["Date"] = pd.to_datetime(df["Date"]).dt.strftime("%Y-%m-%d")
+        """從 yfinance 取得股票數據 (依 timeframe 為日 / 週 / 月 K)"""
+        df = fetch_history(
+            self.request.stock_symbol,
+            self.request.start_date,
+            self.request.end_date,
+            self.request.timeframe,
+        )
 
         self.df = df
         return df
 
     def calculate_indicators(self) -> None:
-        """計算技術指標"""
+        """計算策略在註冊表中宣告的技術指標 (DCA 不需要指標)"""
         if self.df is None:
             raise ValueError("請先呼叫 fetch_data()")
 
         df = self.df
-        strategy = self.request.strategy_type
-
-        if strategy == StrategyType.MA_CROSS:
-            df["MA_Short"] = (
-                df["Close"].rolling(window=self.request.short_period).mean()
-            )
-            df["MA_Long"] = df["Close"].rolling(window=self.request.long_period).mean()
-
-        elif strategy == StrategyType.RSI:
-            delta = df["Close"].diff()
-            gain = (
-                (delta.where(delta > 0, 0))
-                .rolling(window=self.request.rsi_period)
-                .mean()
-            )
-            loss = (
-                (-delta.where(delta < 0, 0))
-                .rolling(window=self.request.rsi_period)
-                .mean()
-            )
-            rs = gain / loss
-            df["RSI"] = 100 - (100 / (1 + rs))
-
-        elif strategy == StrategyType.MACD:
-            exp1 = df["Close"].ewm(span=self.request.macd_fast, adjust=False).mean()
-            exp2 = df["Close"].ewm(span=self.request.macd_slow, adjust=False).mean()
-            df["MACD"] = exp1 - exp2
-            df["Signal"] = (
-                df["MACD"].ewm(span=self.request.macd_signal, adjust=False).mean()
-            )
-
-        elif strategy == StrategyType.BOLLINGER:
-            df["BB_Mid"] = df["Close"].rolling(window=self.request.bb_period).mean()
-            df["BB_Std"] = df["Close"].rolling(window=self.request.bb_period).std()
-            df["BB_Upper"] = df["BB_Mid"] + (df["BB_Std"] * self.request.bb_std)
-            df["BB_Lower"] = df["BB_Mid"] - (df["BB_Std"] * self.request.bb_std)
-
-        elif strategy == StrategyType.DCA:
-            # DCA 不需要技術指標，只需要日期資訊
-            pass
-
-        elif strategy == StrategyType.SMA_BREAKOUT:
-            # 計算 SMA (預設 200 日)
-            df["SMA"] = df["Close"].rolling(window=self.request.sma_period).mean()
-
-        # 通用：計算日期資訊供定期注資使用
-        df["Day"] = pd.to_datetime(df["Date"]).dt.day
-        df["Month"] = pd.to_datetime(df["Date"]).dt.to_period("M")
-        df["MonthNum"] = pd.to_datetime(df["Date"]).dt.month  # 月份數字 (1-12)
-        df["Year"] = pd.to_datetime(df["Date"]).dt.to_period("Y")  # 新增年度資訊
+        if self.request.strategy_type in STRATEGIES:
+            self.evaluator = ExpressionEvaluator(ohlcv_series(df), df["Date"].tolist())
+            indicators = compute_indicators(self.request, self.evaluator)
+            for name, values in indicators.items():
+                df[name] = values
 
         self.df = df
 
@@ -140,141 +110,41 @@ class BacktestEngine:
 
         df["Signal"] = 0  # 0: 無訊號, 1: 買入, -1: 賣出
 
-        if strategy == StrategyType.MA_CROSS:
-            # 短均線上穿長均線 -> 買入
-            df.loc[
-                (df["MA_Short"] > df["MA_Long"])
-                & (df["MA_Short"].shift(1) <= df["MA_Long"].shift(1)),
-                "Signal",
-            ] = 1
-            # 短均線下穿長均線 -> 賣出
-            df.loc[
-                (df["MA_Short"] < df["MA_Long"])
-                & (df["MA_Short"].shift(1) >= df["MA_Long"].shift(1)),
-                "Signal",
-            ] = -1
-
-        elif strategy == StrategyType.RSI:
-            df.loc[
-                (df["RSI"] < self.request.rsi_buy)
-                & (df["RSI"].shift(1) >= self.request.rsi_buy),
-                "Signal",
-            ] = 1
-            df.loc[
-                (df["RSI"] > self.request.rsi_sell)
-                & (df["RSI"].shift(1) <= self.request.rsi_sell),
-                "Signal",
-            ] = -1
-
-        elif strategy == StrategyType.MACD:
-            # 使用原始 MACD 欄位，避免與 Signal 欄位衝突
-            macd_line = df["MACD"]
-            signal_line = (
-                df["Close"].ewm(span=self.request.macd_signal, adjust=False).mean()
-            )  # 重新計算
-            signal_line = macd_line.ewm(
-                span=self.request.macd_signal, adjust=False
-            ).mean()
-
-            df["Signal"] = 0
-            df.loc[
-                (macd_line > signal_line)
-                & (macd_line.shift(1) <= signal_line.shift(1)),
-                "Signal",
-            ] = 1
-            df.loc[
-                (macd_line < signal_line)
-                & (macd_line.shift(1) >= signal_line.shift(1)),
-                "Signal",
-            ] = -1
-
-        elif strategy == StrategyType.BOLLINGER:
-            df.loc[df["Close"] < df["BB_Lower"], "Signal"] = 1
-            df.loc[df["Close"] > df["BB_Upper"], "Signal"] = -1
-
-        elif strategy == StrategyType.DCA:
-            # DCA: 每月或每年指定日期買入（找該週期最接近指定日的交易日）
-            target_day = self.request.dca_day
-            target_month = self.request.dca_month  # 年度投入時使用
-            interval = self.request.dca_interval
-            seen_periods = set()
-
-            for idx, row in df.iterrows():
-                day = row["Day"]
-                month_num = row["MonthNum"]
-
-                if interval == InvestmentInterval.YEARLY:
-                    # 年度投入：檢查是否為目標年份的目標月份和日期
-                    year = row["Year"]
-
-                    # 每年只買一次，檢查是否為目標月份
-                    if year not in seen_periods and month_num == target_month:
-                        # 在目標月份中，找到最接近目標日期的交易日
-                        if day >= target_day:
-                            df.loc[idx, "Signal"] = 1
-                            seen_periods.add(year)
-                        else:
-                            # 檢查是否為該月最後一天
-                            next_idx = idx + 1
-                            if next_idx < len(df):
-                                next_month = df.loc[next_idx, "MonthNum"]
-                                next_year = df.loc[next_idx, "Year"]
-                                # 如果下一筆資料不是同月，表示這是該月最後一筆
-                                if next_month != month_num or next_year != year:
-                                    df.loc[idx, "Signal"] = 1
-                                    seen_periods.add(year)
-                            else:
-                                # 最後一筆資料
-                                df.loc[idx, "Signal"] = 1
-                                seen_periods.add(year)
-                else:
-                    # 月度投入：每月指定日期買入
-                    period = row["Month"]
-
-                    # 每個月只買一次，選擇最接近目標日的交易日
-                    if period not in seen_periods and day >= target_day:
-                        df.loc[idx, "Signal"] = 1
-                        seen_periods.add(period)
-                    # 如果月底還沒買到，就在該月最後一天買
-                    elif period not in seen_periods:
-                        next_idx = idx + 1
-                        if next_idx < len(df):
-                            next_period = df.loc[next_idx, "Month"]
-                            if next_period != period:
-                                df.loc[idx, "Signal"] = 1
-                                seen_periods.add(period)
-                        else:
-                            # 最後一筆資料
-                            df.loc[idx, "Signal"] = 1
-                            seen_periods.add(period)
-
-        elif strategy == StrategyType.SMA_BREAKOUT:
-            # 價格上穿 SMA -> 買入
-            df.loc[
-                (df["Close"] > df["SMA"])
-                & (df["Close"].shift(1) <= df["SMA"].shift(1)),
-                "Signal",
-            ] = 1
-            # 價格下穿 SMA -> 賣出
-            df.loc[
-                (df["Close"] < df["SMA"])
-                & (df["Close"].shift(1) >= df["SMA"].shift(1)),
-                "Signal",
-            ] = -1
+        if strategy == StrategyType.DCA:
+            # DCA: 每個週期 (月 / 年的目標月份) 取第一個日期 >= dca_day 的交易日買入，
+            # 整個週期都沒有則在該週期最後一個交易日買入
+            paydays = contribution_mask(
+                df["Date"].tolist(),
+                self.request.dca_interval,
+                self.request.dca_day,
+                self.request.dca_month,
+            )
+            df["Signal"] = paydays.astype(int)
+
+        elif strategy in STRATEGIES:
+            evaluator = self.evaluator or ExpressionEvaluator(
+                ohlcv_series(df), df["Date"].tolist()
+            )
+            df["Signal"] = build_signal_matrix(
+                self.request, df["Close"].to_numpy(dtype=float), evaluator
+            )
 
         self.df = df
 
-    def run_backtest(self) -> Tuple[List[TradeRecord], List[float]]:
-        """執行回測模擬"""
+    def run_backtest(
+        self, resume: Optional[EngineCheckpoint] = None
+    ) -> Tuple[List[TradeRecord], List[float]]:
+        """
+        執行回測模擬
+
+        resume 為同一請求較早結束日的檢查點：前段資料與訊號一致時從檢查點接續，
+        只模擬之後的 K 棒，否則從頭執行。執行後 self.checkpoint 為本次的檢查點。
+        """
         if self.df is None:
             raise ValueError("請先呼叫 fetch_data()")
 
         df = self.df
         strategy = self.request.strategy_type
-        print(
-            f"DEBUG: Starting backtest. Strategy={strategy}, DCA Amount={self.request.dca_amount}",
-            flush=True,
-        )
 
         cash = self.request.initial_capital
         shares = 0
@@ -283,89 +153,94 @@ class BacktestEngine:
         trades = []
         entry_price = 0.0
         self.total_invested = cash  # 初始化總投入本金
-        seen_periods = set()  # 改用通用的週期追蹤
+        paydays = None
+        if strategy != StrategyType.DCA and self.request.dca_amount > 0:
+            paydays = contribution_mask(
+                df["Date"].tolist(),
+                self.request.dca_interval,
+                self.request.dca_day,
+                self.request.dca_month,
+            )
+
+        # 停損/停利：進場或遇到訊號時一次排定下一段的觸價出場日
+        stops = StopRules.from_request(self.request)
+        if strategy == StrategyType.DCA:
+            stops = None
+        pending_stop = None
+        peak = 0.0
+        if stops is not None:
+            close_values = df["Close"].to_numpy(dtype=float)
+            ohl_values = [
+                df[col].to_numpy(dtype=float) if col in df else None
+                for col in ("Open", "High", "Low")
+            ]
+            upcoming_signal = next_signal_bars(df["Signal"].to_numpy())
+
+        start = 0
+        if (
+            resume is not None
+            and resume.n_bars <= len(df)
+            and resume.digest == bar_digest(df, resume.n_bars, paydays)
+        ):
+            start = resume.n_bars
+            cash = resume.cash
+            shares = resume.shares
+            total_cost = resume.total_cost
+            entry_price = resume.entry_price
+            peak = resume.peak
+            self.total_invested = resume.total_invested
+            trades = [t.model_copy() for t in resume.trades]
+            equity_curve = list(resume.equity_curve)
+            # 檢查點之後的觸價出場：延續最後一段的搜尋 (到下一個訊號為止)
+            if stops is not None and shares > 0:
+                pending_stop, peak = first_stop_hit(
+                    stops,
+                    total_cost / shares,
+                    peak,
+                    start,
+                    min(int(upcoming_signal[start - 1]) + 1, len(df)),
+                    close_values,
+                    *ohl_values,
+                )
+        self.resumed_bars = start
+
+        def snapshot(n_bars: int) -> EngineCheckpoint:
+            return EngineCheckpoint(
+                end_date=self.request.end_date,
+                n_bars=n_bars,
+                digest=bar_digest(df, n_bars, paydays),
+                cash=cash,
+                shares=shares,
+                total_cost=total_cost,
+                total_invested=self.total_invested,
+                entry_price=entry_price,
+                peak=peak,
+                trades=[t.model_copy() for t in trades],
+                equity_curve=list(equity_curve),
+            )
+
+        # 檢查點通常在最後一根 K 棒之後 (期末結算前)
+        self.checkpoint = None
+        checkpoint_at = checkpoint_bar(
+            df["Date"].tolist(),
+            df["Signal"].to_numpy() == 1 if strategy == StrategyType.DCA else paydays,
+            self.request.dca_day,
+            self.request.timeframe,
+        )
 
-        for idx, row in df.iterrows():
+        for idx, row in df.iloc[start:].iterrows():
+            if idx == checkpoint_at:
+                self.checkpoint = snapshot(idx)
             price = row["Close"]
             signal = row["Signal"]
             date = row["Date"]
 
             # === 通用定期注資邏輯 (適用於所有非 DCA 策略) ===
             # 如果設定了每月投入金額，則每月發薪日自動補充現金
-            if strategy != StrategyType.DCA and self.request.dca_amount > 0:
-                day = row.get("Day")
-                month_num = row.get("MonthNum")
-
-                if self.request.dca_interval == InvestmentInterval.YEARLY:
-                    # 年度注資
-                    year = row.get("Year")
-                    target_month = self.request.dca_month
-
-                    if (
-                        day is not None
-                        and year is not None
-                        and month_num == target_month
-                    ):
-                        target_day = self.request.dca_day
-                        is_payday = False
-
-                        if year not in seen_periods:
-                            if day >= target_day:
-                                is_payday = True
-                            else:
-                                # 檢查是否為該月最後一筆數據
-                                next_idx = idx + 1
-                                if next_idx >= len(df):
-                                    is_payday = True
-                                else:
-                                    next_month = df.iloc[next_idx]["MonthNum"]
-                                    next_year = df.iloc[next_idx]["Year"]
-                                    if next_month != month_num or next_year != year:
-                                        is_payday = True
-
-                        if is_payday:
-                            dca_amount = self.request.dca_amount
-                            cash += dca_amount
-                            self.total_invested += dca_amount
-                            seen_periods.add(year)
-                            print(
-                                f"DEBUG: Payday! Year={year}, Month={month_num}, Day={day}, Added={dca_amount}, Total Invested={self.total_invested}"
-                            )
-                else:
-                    # 月度注資
-                    period = row.get("Month")
-
-                    # Debug print (只印第一天)
-                    if idx == 0:
-                        print(
-                            f"DEBUG: DCA Amount={self.request.dca_amount}, Day={day}, Period={period}"
-                        )
-
-                    if day is not None and period is not None:
-                        target_day = self.request.dca_day
-                        is_payday = False
-
-                        if period not in seen_periods:
-                            if day >= target_day:
-                                is_payday = True
-                            else:
-                                # 檢查是否為該週期最後一筆數據
-                                next_idx = idx + 1
-                                if next_idx >= len(df):
-                                    is_payday = True
-                                else:
-                                    next_period = df.iloc[next_idx]["Month"]
-                                    if next_period != period:
-                                        is_payday = True
-
-                        if is_payday:
-                            dca_amount = self.request.dca_amount
-                            cash += dca_amount
-                            self.total_invested += dca_amount
-                            seen_periods.add(period)
-                            print(
-                                f"DEBUG: Payday! Period={period}, Added={dca_amount}, Total Invested={self.total_invested}"
-                            )
+            if paydays is not None and paydays[idx]:
+                dca_amount = self.request.dca_amount
+                cash += dca_amount
+                self.total_invested += dca_amount
 
             # === 策略執行邏輯 ===
             if strategy == StrategyType.DCA:
@@ -428,6 +303,31 @@ class BacktestEngine:
                 if signal == 1:
                     can_buy = True
 
+                held_before = shares > 0
+                if pending_stop is not None and pending_stop.bar == idx and shares > 0:
+                    # 觸價出場 (全部賣出)，當日不再處理策略訊號
+                    revenue = shares * pending_stop.price
+                    pnl = revenue - total_cost
+                    cash += revenue
+                    trades.append(
+                        TradeRecord(
+                            date=date,
+                            action="SELL",
+                            price=round(pending_stop.price, 2),
+                            shares=shares,
+                            value=round(revenue, 2),
+                            balance=round(cash, 2),
+                            total_assets=round(cash, 2),
+                            pnl=round(pnl, 2),
+                            exit_reason=pending_stop.reason,
+                        )
+                    )
+                    shares = 0
+                    total_cost = 0.0
+                    pending_stop = None
+                    can_buy = False
+                    signal = 0
+
                 if can_buy:
                     # 防止零價格導致除零錯誤
                     if price > 0:
@@ -505,12 +405,29 @@ class BacktestEngine:
                         if shares == 0:
                             total_cost = 0.0
 
+                # 有訊號且仍持倉 (新倉、加碼或部分賣出) 時重新排定觸價出場
+                if stops is not None and signal != 0 and shares > 0:
+                    if not held_before:
+                        peak = price
+                    pending_stop, peak = first_stop_hit(
+                        stops,
+                        total_cost / shares,
+                        peak,
+                        idx + 1,
+                        min(int(upcoming_signal[idx]) + 1, len(df)),
+                        close_values,
+                        *ohl_values,
+                    )
+
             # 記錄當日權益
 
             # 記錄當日權益
             current_equity = cash + shares * price
             equity_curve.append(round(current_equity, 2))
 
+        if self.checkpoint is None:
+            self.checkpoint = snapshot(len(df))
+
         # 回測結束時處理
         last_date = df.iloc[-1]["Date"]
         last_price = df.iloc[-1]["Close"]
@@ -594,109 +511,20 @@ class BacktestEngine:
 
         try:
             initial = self.request.initial_capital
-            final = self.equity_curve[-1]
+            periods = periods_per_year(self.request.timeframe)
 
-            # 對於 DCA 策略，使用實際買入成本計算報酬率
             if self.request.strategy_type == StrategyType.DCA:
-                cost = self.total_cost
-                stock_value = self.final_stock_value
-                if cost > 0:
-                    total_return = ((stock_value - cost) / cost) * 100
-                else:
-                    total_return = 0
-
-                # 年化報酬率
-                days = len(self.equity_curve)
-                years = days / 252
-                if years > 0 and cost > 0:
-                    ratio = stock_value / cost
-                    if ratio > 0:
-                        annualized_return = (ratio ** (1 / years) - 1) * 100
-                    else:
-                        annualized_return = -100
-                else:
-                    annualized_return = 0
-            else:
-                # 一般策略 (含 SMA_BREAKOUT + 定期注資)
-                # 使用總投入本金計算 (若有定期注資，total_invested 會大於 initial)
-                base_capital = (
-                    self.total_invested if self.total_invested > 0 else initial
+                # DCA 策略：報酬率以持股市值相對實際買入成本計算
+                metrics = compute_metrics(
+                    self.equity_curve,
+                    self.total_cost,
+                    final_value=self.final_stock_value,
+                    periods_per_year=periods,
                 )
 
-                if base_capital > 0:
-                    total_return = ((final - base_capital) / base_capital) * 100
-                else:
-                    total_return = 0
-
-                # 年化報酬率 (假設 252 個交易日)
-                days = len(self.equity_curve)
-                years = days / 252
-                if years > 0 and base_capital > 0:
-                    # 避免負數底數的冪運算導致複數或錯誤
-                    ratio = final / base_capital
-                    if ratio > 0:
-                        annualized_return = (ratio ** (1 / years) - 1) * 100
-                    else:
-                        annualized_return = -100  # 全虧
-                else:
-                    annualized_return = 0
-
-            # 計算每日報酬
-            equity_series = pd.Series(self.equity_curve)
-            daily_returns = equity_series.pct_change().dropna()
-
-            # 夏普比率 (假設無風險利率為 2%)
-            risk_free = 0.02 / 252
-            excess_returns = daily_returns - risk_free
-
-            std_dev = excess_returns.std()
-            if std_dev > 0 and not np.isnan(std_dev):
-                sharpe_ratio = (excess_returns.mean() / std_dev) * np.sqrt(252)
-            else:
-                sharpe_ratio = 0
-
-            # 最大回撤
-            cummax = equity_series.cummax()
-            # 只在 cummax > 0 時計算回撤，避免除以零或初始為0的情況
-            safe_cummax = cummax.where(cummax > 0, np.nan)
-            drawdown = (equity_series - safe_cummax) / safe_cummax
-            valid_drawdown = drawdown.dropna()
-            if len(valid_drawdown) > 0:
-                max_drawdown = valid_drawdown.min() * 100
-            else:
-                max_drawdown = 0
-
-            # 交易統計 (略)
-            # ... (這部分沒動，應該沒事) ...
-
-            # 交易統計
-            if self.request.strategy_type == StrategyType.DCA:
-                # DCA 策略：統計每次買入交易（排除期末 HOLD）
+                # 將每次買入視為一次交易，以未實現報酬率判斷獲利/虧損 (排除期末 HOLD)
                 buy_trades = [t for t in self.trades if t.action == "BUY"]
-
-                # 將每次買入視為一次交易，以未實現報酬率判斷獲利/虧損
-                total_trades = len(buy_trades)
-                profit_trades_list = [t for t in buy_trades if t.pnl and t.pnl > 0]
-                loss_trades_list = [t for t in buy_trades if t.pnl and t.pnl <= 0]
-
-                win_rate = (
-                    (len(profit_trades_list) / total_trades * 100)
-                    if total_trades > 0
-                    else 0
-                )
-                avg_profit = (
-                    np.mean([t.pnl for t in profit_trades_list])
-                    if profit_trades_list
-                    else 0
-                )
-                avg_loss = (
-                    np.mean([t.pnl for t in loss_trades_list])
-                    if loss_trades_list
-                    else 0
-                )
-
-                profit_trades_count = len(profit_trades_list)
-                loss_trades_count = len(loss_trades_list)
+                pnls = [t.pnl for t in buy_trades]
 
                 # DCA 總成本 = 累積投入資金
                 if self.total_invested > 0:
@@ -705,31 +533,17 @@ class BacktestEngine:
                     # 兼容舊邏輯：若沒追蹤到 total_invested (理論上不可能)，則回退
                     total_cost = sum(t.value for t in buy_trades)
             else:
-                # 其他策略：統計賣出交易
-                sell_trades = [t for t in self.trades if t.action == "SELL"]
-                profit_trades_list = [t for t in sell_trades if t.pnl and t.pnl > 0]
-                loss_trades_list = [t for t in sell_trades if t.pnl and t.pnl <= 0]
-
-                total_trades = len(sell_trades)
-                win_rate = (
-                    (len(profit_trades_list) / total_trades * 100)
-                    if total_trades > 0
-                    else 0
-                )
-
-                avg_profit = (
-                    np.mean([t.pnl for t in profit_trades_list])
-                    if profit_trades_list
-                    else 0
+                # 一般策略 (含 SMA_BREAKOUT + 定期注資)
+                # 使用總投入本金計算 (若有定期注資，total_invested 會大於 initial)
+                base_capital = (
+                    self.total_invested if self.total_invested > 0 else initial
                 )
-                avg_loss = (
-                    np.mean([t.pnl for t in loss_trades_list])
-                    if loss_trades_list
-                    else 0
+                metrics = compute_metrics(
+                    self.equity_curve, base_capital, periods_per_year=periods
                 )
 
-                profit_trades_count = len(profit_trades_list)
-                loss_trades_count = len(loss_trades_list)
+                # 其他策略：統計賣出交易
+                pnls = [t.pnl for t in self.trades if t.action == "SELL"]
 
                 # 其他策略總成本
                 if self.request.dca_amount > 0:
@@ -737,19 +551,7 @@ class BacktestEngine:
                 else:
                     total_cost = self.request.initial_capital
 
-            return BacktestSummary(
-                total_return=round(_clean_float(total_return), 2),
-                annualized_return=round(_clean_float(annualized_return), 2),
-                sharpe_ratio=round(_clean_float(sharpe_ratio), 2),
-                max_drawdown=round(_clean_float(max_drawdown), 2),
-                win_rate=round(_clean_float(win_rate), 2),
-                total_trades=total_trades,
-                profit_trades=profit_trades_count,
-                loss_trades=loss_trades_count,
-                avg_profit=round(_clean_float(avg_profit), 2),
-                avg_loss=round(_clean_float(avg_loss), 2),
-                total_cost=round(_clean_float(total_cost), 2),
-            )
+            return build_summary(metrics, pnls, total_cost)
         except Exception as e:
             # 發生錯誤時回傳預設值，避免 API 崩潰
             print(f"Error calculating metrics: {e}")
@@ -778,7 +580,8 @@ class BacktestEngine:
         ma_long = df.get("MA_Long", pd.Series([None] * len(df)))
 
         def clean_val(v):
-            if pd.isna(v) or v is None or np.isinf(v):
+            # math.isfinite 比 pd.isna / np.isinf 逐值呼叫快得多
+            if v is None or not math.isfinite(v):
                 return None
             return round(float(v), 2)
 
@@ -798,12 +601,139 @@ class BacktestEngine:
 
         return EquityData(dates=self.df["Date"].tolist(), equity=self.equity_curve)
 
+    def build_result(self, backtest_id: int) -> BacktestResult:
+        """計算績效並組裝 BacktestResult (需先執行 run_backtest)"""
+        request = self.request
+        summary = self.calculate_metrics()
+        equity = self.equity_curve
+        return BacktestResult(
+            id=backtest_id,
+            strategy_name=request.strategy_name,
+            stock_symbol=request.stock_symbol,
+            strategy_type=request.strategy_type.value,
+            start_date=request.start_date,
+            end_date=request.end_date,
+            initial_capital=request.initial_capital,
+            final_capital=equity[-1] if equity else request.initial_capital,
+            created_at=datetime.now().strftime("%Y-%m-%d %H:%M"),
+            summary=summary,
+            price_data=self.get_price_data(),
+            equity_data=self.get_equity_data(),
+            trades=self.trades,
+            params={
+                "strategy_type": request.strategy_type.value,
+                "short_period": request.short_period,
+                "long_period": request.long_period,
+                "rsi_period": request.rsi_period,
+                "rsi_buy": request.rsi_buy,
+                "rsi_sell": request.rsi_sell,
+            },
+        )
+
+
+def run_full_backtest(
+    request: BacktestRequest,
+    backtest_id: int,
+    token: Optional[CancellationToken] = None,
+) -> BacktestResult:
+    """
+    執行完整回測流程 (有指定 rolling_windows 時附上滾動指標)
+
+    token 只用於多股票引擎，取消或超過運算預算時拋出 OperationCancelled。
+    """
+    result = _dispatch_backtest(request, backtest_id, token)
+    return attach_analytics(result, request)
+
+
+def attach_analytics(
+    result: BacktestResult, request: BacktestRequest
+) -> BacktestResult:
+    """依請求附上基準比較與滾動指標"""
+    if request.benchmark_mode != BenchmarkMode.NONE:
+        attach_benchmark(result, request)
+    if request.rolling_windows:
+        result.equity_data.rolling = build_rolling_series(
+            result.equity_data.equity,
+            request.rolling_windows,
+            periods_per_year(request.timeframe),
+        )
+    return result
+
+
+def attach_benchmark(result: BacktestResult, request: BacktestRequest) -> None:
+    """以價格快取取得基準收盤價，將相對指標寫入 summary 與 equity_data"""
+    if request.benchmark_mode == BenchmarkMode.SYMBOL:
+        if not request.benchmark_symbol:
+            raise ValueError("benchmark_mode 為 SYMBOL 時需要提供 benchmark_symbol")
+        symbol = request.benchmark_symbol
+    else:
+        symbol = request.stock_symbol
+
+    dates = result.equity_data.dates
+    if not dates:
+        return
+    benchmark = fetch_closes_on(symbol, dates, request.start_date, request.end_date)
+    metrics = compute_benchmark_metrics(
+        result.equity_data.equity,
+        benchmark,
+        periods_per_year=periods_per_year(request.timeframe),
+    )
+
+    summary = result.summary
+    summary.benchmark_symbol = symbol
+    for key in (
+        "benchmark_return",
+        "alpha",
+        "beta",
+        "tracking_error",
+        "information_ratio",
+    ):
+        setattr(summary, key, round(_clean_float(metrics[key]), 2))
+    result.equity_data.relative = [
+        round(_clean_float(v), 4) for v in metrics["relative_equity"]
+    ]
+
+
+def _dispatch_backtest(
+    request: BacktestRequest,
+    backtest_id: int,
+    token: Optional[CancellationToken] = None,
+) -> BacktestResult:
+    """依策略類型選擇回測引擎"""
+    # 分 K / 小時 K：由本地資料檔分段串流回測
+    if request.timeframe in INTRADAY_TIMEFRAMES:
+        from app.services.streaming_engine import run_streaming_backtest
+
+        return run_streaming_backtest(request, backtest_id, token)
+
+    multi_stock = request.stock_allocations or request.strategy_type in (
+        StrategyType.MOMENTUM_ROTATION,
+        StrategyType.PAIRS_TRADING,
+    )
+    if multi_stock and request.timeframe != Timeframe.DAILY:
+        raise ValueError("多股票策略目前只支援日 K (timeframe=DAILY)")
 
-def run_full_backtest(request: BacktestRequest, backtest_id: int) -> BacktestResult:
-    """執行完整回測流程"""
     # 檢查是否為多股票DCA
     if request.strategy_type == StrategyType.DCA and request.stock_allocations:
-        return run_multi_stock_dca(request, backtest_id)
+        return run_multi_stock_dca(request, backtest_id, token)
+
+    # 動能輪動：對整個股票池排名換股
+    if request.strategy_type == StrategyType.MOMENTUM_ROTATION:
+        from app.services.portfolio_engine import run_momentum_rotation
+
+        return run_momentum_rotation(request, backtest_id, token)
+
+    # 配對交易：兩檔股票的價差均值回歸
+    if request.strategy_type == StrategyType.PAIRS_TRADING:
+        from app.services.pairs_engine import run_pairs_backtest
+
+        return run_pairs_backtest(request, backtest_id, token)
+
+    # 多股票技術分析策略：交給投資組合引擎
+    if request.stock_allocations:
+        from app.services.portfolio_engine import run_portfolio_backtest
+
+        return run_portfolio_backtest(request, backtest_id, token)
 
     engine = BacktestEngine(request)
 
@@ -816,247 +746,251 @@ def run_full_backtest(request: BacktestRequest, backtest_id: int) -> BacktestRes
     # 3. 生成訊號
     engine.generate_signals()
 
-    # 4. 執行回測
-    trades, equity = engine.run_backtest()
-
-    # 5. 計算績效
-    summary = engine.calculate_metrics()
-
-    # 6. 組裝結果
-    return BacktestResult(
-        id=backtest_id,
-        strategy_name=request.strategy_name,
-        stock_symbol=request.stock_symbol,
-        strategy_type=request.strategy_type.value,
-        start_date=request.start_date,
-        end_date=request.end_date,
-        initial_capital=request.initial_capital,
-        final_capital=equity[-1] if equity else request.initial_capital,
-        created_at=datetime.now().strftime("%Y-%m-%d %H:%M"),
-        summary=summary,
-        price_data=engine.get_price_data(),
-        equity_data=engine.get_equity_data(),
-        trades=trades,
-        params={
-            "strategy_type": request.strategy_type.value,
-            "short_period": request.short_period,
-            "long_period": request.long_period,
-            "rsi_period": request.rsi_period,
-            "rsi_buy": request.rsi_buy,
-            "rsi_sell": request.rsi_sell,
-        },
-    )
-
+    # 4. 執行回測 (同一請求先前以較早的結束日執行過時，由其檢查點接續)
+    engine.run_backtest(engine_checkpoints.get(request))
+    engine_checkpoints.put(request, engine.checkpoint)
+
+    # 5. 計算績效並組裝結果
+    return engine.build_result(backtest_id)
+
+
+def _rebalance_to_target(
+    shares: np.ndarray,
+    cash: float,
+    prices: np.ndarray,
+    weights: np.ndarray,
+) -> np.ndarray:
+    """計算再平衡到目標權重所需的股數變化 (正=買入, 負=賣出)"""
+    equity = cash + float(np.dot(shares, prices))
+    safe_prices = np.where(prices > 0, prices, np.inf)
+    target_shares = np.floor(equity * weights / safe_prices)
+    # 價格異常的股票維持原持股
+    target_shares = np.where(prices > 0, target_shares, shares)
+    return target_shares - shares
+
+
+def _first_drift_breach(
+    price_slice: np.ndarray,
+    shares: np.ndarray,
+    weights: np.ndarray,
+    threshold: float,
+) -> int:
+    """在持股不變的區段內，向量化找出第一個權重偏離超過門檻的位置 (-1 表示沒有)"""
+    if len(price_slice) == 0 or not (shares > 0).any():
+        return -1
+    values = price_slice * shares
+    totals = values.sum(axis=1, keepdims=True)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        current_weights = np.where(totals > 0, values / totals, weights)
+    drift = np.abs(current_weights - weights).max(axis=1)
+    hits = np.flatnonzero(drift > threshold)
+    return int(hits[0]) if len(hits) else -1
+
+
+def run_multi_stock_dca(
+    request: BacktestRequest,
+    backtest_id: int,
+    token: Optional[CancellationToken] = None,
+) -> BacktestResult:
+    """
+    執行多股票DCA回測 (效能優化版)
 
-def run_multi_stock_dca(request: BacktestRequest, backtest_id: int) -> BacktestResult:
-    """執行多股票DCA回測 (效能優化版)"""
+    價格以共同交易日對齊成 (Days, Stocks) 矩陣；持股只在投入日與再平衡日改變，
+    其餘時間以區段向量化運算處理 (權重偏離檢查、權益曲線)。
+    """
     if not request.stock_allocations:
         raise ValueError("多股票DCA需要提供stock_allocations")
 
-    # 為每個股票創建引擎並取得數據
-    stock_engines = {}
-    stock_data = {}
-    # 效能優化：預先建立價格查詢字典 {date: price}，避免重複 DataFrame 過濾
-    price_lookup: Dict[str, Dict[str, float]] = {}  # {symbol: {date: price}}
-
-    for allocation in request.stock_allocations:
-        symbol = allocation.stock_symbol
-        # 創建該股票的請求
-        stock_request = BacktestRequest(
-            strategy_name=f"{request.strategy_name}_{symbol}",
-            stock_symbol=symbol,
-            start_date=request.start_date,
-            end_date=request.end_date,
-            initial_capital=0,
-            strategy_type=StrategyType.DCA,
-            dca_amount=request.dca_amount * allocation.allocation_ratio,
-            dca_day=request.dca_day,
-            dca_month=request.dca_month,
-            dca_interval=request.dca_interval,
-        )
+    all_symbols = [a.stock_symbol for a in request.stock_allocations]
+    weights = np.array([a.allocation_ratio for a in request.stock_allocations])
+    dates, price_matrix = fetch_aligned_closes(
+        all_symbols, request.start_date, request.end_date
+    )
+    n_days, n_stocks = price_matrix.shape
 
-        engine = BacktestEngine(stock_request)
-        engine.fetch_data()
-        engine.calculate_indicators()
-        engine.generate_signals()
-
-        stock_engines[symbol] = engine
-        stock_data[symbol] = {
-            "df": engine.df,
-            "ratio": allocation.allocation_ratio,
-            "shares": 0,
-            "total_cost": 0.0,
-        }
-        # 建立價格查詢字典 O(N) 預處理，後續查詢 O(1)
-        price_lookup[symbol] = dict(zip(engine.df["Date"], engine.df["Close"]))
+    contribution_days = contribution_mask(
+        dates, request.dca_interval, request.dca_day, request.dca_month
+    )
+    mode = request.rebalance_mode
+    if mode in (RebalanceMode.MONTHLY, RebalanceMode.QUARTERLY, RebalanceMode.YEARLY):
+        rebalance_days = period_start_mask(dates, mode.value)
+    else:
+        rebalance_days = np.zeros(n_days, dtype=bool)
+    scheduled = np.flatnonzero(contribution_days | rebalance_days)
+
+    # 持股與現金的逐日變化量，最後以累加還原每日狀態
+    share_deltas = np.zeros((n_days, n_stocks))
+    cash_deltas = np.zeros(n_days)
+    cash_deltas[0] = request.initial_capital
 
-    # 執行多股票DCA回測
     cash = request.initial_capital
     total_invested = cash
-    all_trades = []
-    equity_curve = []
-
-    # 獲取所有日期（使用第一個股票的日期）
-    first_symbol = request.stock_allocations[0].stock_symbol
-    dates_df = stock_engines[first_symbol].df
-    all_symbols = [a.stock_symbol for a in request.stock_allocations]
+    shares = np.zeros(n_stocks)
+    cost_basis = np.zeros(n_stocks)
+    trade_events = (
+        []
+    )  # (bar, col, action, shares, value, pnl, pnl_amount, is_contribution)
+
+    def apply_rebalance(bar: int) -> None:
+        nonlocal cash
+        prices = price_matrix[bar]
+        delta = _rebalance_to_target(shares, cash, prices, weights)
+        if not delta.any():
+            return
+        # 先賣後買，批次產生交易
+        sell_cols = np.flatnonzero(delta < 0)
+        buy_cols = np.flatnonzero(delta > 0)
+        if len(sell_cols):
+            sold = -delta[sell_cols]
+            revenue = sold * prices[sell_cols]
+            sold_cost = cost_basis[sell_cols] / shares[sell_cols] * sold
+            for col, qty, value, cost_part in zip(sell_cols, sold, revenue, sold_cost):
+                pnl_amount = value - cost_part
+                pnl_pct = pnl_amount / cost_part * 100 if cost_part > 0 else 0
+                trade_events.append(
+                    (bar, col, "SELL", int(qty), value, pnl_pct, pnl_amount, False)
+                )
+            cost_basis[sell_cols] -= sold_cost
+            cash += float(revenue.sum())
+        if len(buy_cols):
+            bought = delta[buy_cols]
+            cost = bought * prices[buy_cols]
+            cost_basis[buy_cols] += cost
+            cash -= float(cost.sum())
+            for col, qty, value in zip(buy_cols, bought, cost):
+                trade_events.append(
+                    (bar, col, "BUY", int(qty), value, None, None, False)
+                )
+        shares[:] += delta
+        cost_basis[shares == 0] = 0.0
+        share_deltas[bar] += delta
+        cash_deltas[bar] += float(-np.dot(delta, prices))
+
+    cursor = 0
+    for bar in np.append(scheduled, n_days):
+        if token is not None:
+            token.check()
+        # 門檻模式：在持股不變的區段內找出第一個偏離點
+        while mode == RebalanceMode.THRESHOLD and cursor < bar:
+            hit = _first_drift_breach(
+                price_matrix[cursor:bar], shares, weights, request.rebalance_threshold
+            )
+            if hit < 0:
+                break
+            apply_rebalance(cursor + hit)
+            cursor = cursor + hit + 1
 
-    for idx, row in dates_df.iterrows():
-        date = row["Date"]
-        signal = row.get("Signal", 0)
+        if bar >= n_days:
+            break
 
-        # 如果是DCA買入日
-        if signal == 1:
-            # 注入資金
+        prices = price_matrix[bar]
+        if contribution_days[bar]:
+            # 注入資金並按比例買入各股票
             cash += request.dca_amount
             total_invested += request.dca_amount
+            cash_deltas[bar] += request.dca_amount
+
+            amounts = request.dca_amount * weights
+            safe_prices = np.where(prices > 0, prices, np.inf)
+            buy_shares = np.floor(amounts / safe_prices)
+            cost = buy_shares * prices
+            cash -= float(cost.sum())
+            cash_deltas[bar] -= float(cost.sum())
+            shares[:] += buy_shares
+            cost_basis[:] += cost
+            share_deltas[bar] += buy_shares
+
+            for col in np.flatnonzero(buy_shares > 0):
+                pnl_pct = (
+                    (shares[col] * prices[col] - cost_basis[col])
+                    / cost_basis[col]
+                    * 100
+                    if cost_basis[col] > 0
+                    else 0
+                )
+                trade_events.append(
+                    (
+                        bar,
+                        col,
+                        "BUY",
+                        int(buy_shares[col]),
+                        cost[col],
+                        pnl_pct,
+                        None,
+                        True,
+                    )
+                )
 
-            # 按比例買入各股票
-            for allocation in request.stock_allocations:
-                symbol = allocation.stock_symbol
-                ratio = allocation.allocation_ratio
-                amount = request.dca_amount * ratio
-
-                # 效能優化：使用預建的價格字典，O(1) 查詢
-                price = price_lookup[symbol].get(date, 0.0)
-
-                if price > 0:
-                    buy_shares = int(amount // price)
-
-                    if buy_shares > 0:
-                        cost = buy_shares * price
-                        cash -= cost
-
-                        stock_data[symbol]["shares"] += buy_shares
-                        stock_data[symbol]["total_cost"] += cost
-
-                        # 計算當前該股票的未實現報酬
-                        current_value = stock_data[symbol]["shares"] * price
-                        unrealized_pnl_pct = (
-                            (
-                                (current_value - stock_data[symbol]["total_cost"])
-                                / stock_data[symbol]["total_cost"]
-                                * 100
-                            )
-                            if stock_data[symbol]["total_cost"] > 0
-                            else 0
-                        )
-
-                        # 效能優化：計算 total_assets 使用價格字典
-                        total_assets_value = cash + sum(
-                            stock_data[s]["shares"] * price_lookup[s].get(date, 0.0)
-                            for s in all_symbols
-                        )
-
-                        all_trades.append(
-                            TradeRecord(
-                                date=date,
-                                action="BUY",
-                                price=round(price, 2),
-                                shares=buy_shares,
-                                value=round(cost, 2),
-                                balance=round(cash, 2),
-                                total_assets=round(total_assets_value, 2),
-                                pnl=round(unrealized_pnl_pct, 2),
-                                stock_symbol=symbol,
-                            )
-                        )
-
-        # 效能優化：計算當日總資產使用價格字典，O(M) 而非 O(M*N)
-        total_stock_value = sum(
-            stock_data[s]["shares"] * price_lookup[s].get(date, 0.0)
-            for s in all_symbols
+        if rebalance_days[bar] or (
+            mode == RebalanceMode.THRESHOLD
+            and _first_drift_breach(
+                price_matrix[bar : bar + 1],
+                shares,
+                weights,
+                request.rebalance_threshold,
+            )
+            == 0
+        ):
+            apply_rebalance(bar)
+
+        cursor = bar + 1
+
+    # 權益曲線：累加持股與現金變化後一次計算
+    holdings = np.cumsum(share_deltas, axis=0)
+    cash_path = np.cumsum(cash_deltas)
+    equity = cash_path + (holdings * price_matrix).sum(axis=1)
+    equity_curve = [round(_clean_float(v), 2) for v in equity]
+
+    # 每筆交易後的現金：由當日交易前的現金 (前一日現金 + 當日注資) 依序累加
+    cash_start = np.concatenate([[request.initial_capital], cash_path[:-1]])
+    cash_start += np.where(contribution_days, request.dca_amount, 0.0)
+    balances = []
+    balance_bar = -1
+    for bar, _, action, _, value, *_ in trade_events:
+        if bar != balance_bar:
+            balance_bar = bar
+            balance = cash_start[bar]
+        balance += value if action == "SELL" else -value
+        balances.append(balance)
+
+    all_trades = [
+        TradeRecord(
+            date=dates[bar],
+            action=action,
+            price=round(float(price_matrix[bar, col]), 2),
+            shares=qty,
+            value=round(float(value), 2),
+            balance=round(float(balance), 2),
+            total_assets=round(float(equity[bar]), 2),
+            pnl=round(_clean_float(pnl), 2) if pnl is not None else None,
+            pnl_amount=(
+                round(_clean_float(pnl_amount), 2) if pnl_amount is not None else None
+            ),
+            stock_symbol=all_symbols[col],
         )
+        for (bar, col, action, qty, value, pnl, pnl_amount, _), balance in zip(
+            trade_events, balances
+        )
+    ]
 
-        equity_curve.append(round(cash + total_stock_value, 2))
-
-    # 計算績效
+    # 計算績效 (交易統計只計入定期投入的買入，不含再平衡交易)
     final_equity = equity_curve[-1] if equity_curve else 0
-    total_return = (
-        ((final_equity - total_invested) / total_invested * 100)
-        if total_invested > 0
-        else 0
-    )
-
-    # 完整的績效計算
-    # 1. 年化報酬率
-    days = len(equity_curve)
-    years = days / 252  # 假設252個交易日
-    if years > 0 and total_invested > 0:
-        ratio = final_equity / total_invested
-        if ratio > 0:
-            annualized_return = (ratio ** (1 / years) - 1) * 100
-        else:
-            annualized_return = -100
-    else:
-        annualized_return = 0
-
-    # 2. 夏普比率
-    equity_series = pd.Series(equity_curve)
-    daily_returns = equity_series.pct_change().dropna()
-    risk_free = 0.02 / 252  # 假設無風險利率 2%
-    excess_returns = daily_returns - risk_free
-    std_dev = excess_returns.std()
-    if std_dev > 0 and not np.isnan(std_dev):
-        sharpe_ratio = (excess_returns.mean() / std_dev) * np.sqrt(252)
-    else:
-        sharpe_ratio = 0
-
-    # 3. 最大回撤
-    cummax = equity_series.cummax()
-    # 只在 cummax > 0 時計算回撤，避免除以零或初始為0的情況
-    safe_cummax = cummax.where(cummax > 0, np.nan)
-    drawdown = (equity_series - safe_cummax) / safe_cummax
-    valid_drawdown = drawdown.dropna()
-    if len(valid_drawdown) > 0:
-        max_drawdown = valid_drawdown.min() * 100
-    else:
-        max_drawdown = 0
-
-    # 4. 交易統計 (DCA策略)
-    buy_trades = [t for t in all_trades if t.action == "BUY"]
-    profit_trades_list = [t for t in buy_trades if t.pnl and t.pnl > 0]
-    loss_trades_list = [t for t in buy_trades if t.pnl and t.pnl <= 0]
-
-    total_trades = len(buy_trades)
-    win_rate = (len(profit_trades_list) / total_trades * 100) if total_trades > 0 else 0
-    avg_profit = (
-        np.mean([t.pnl for t in profit_trades_list]) if profit_trades_list else 0
-    )
-    avg_loss = np.mean([t.pnl for t in loss_trades_list]) if loss_trades_list else 0
-
-    summary = BacktestSummary(
-        total_return=round(_clean_float(total_return), 2),
-        annualized_return=round(_clean_float(annualized_return), 2),
-        sharpe_ratio=round(_clean_float(sharpe_ratio), 2),
-        max_drawdown=round(_clean_float(max_drawdown), 2),
-        win_rate=round(_clean_float(win_rate), 2),
-        total_trades=total_trades,
-        profit_trades=len(profit_trades_list),
-        loss_trades=len(loss_trades_list),
-        avg_profit=round(_clean_float(avg_profit), 2),
-        avg_loss=round(_clean_float(avg_loss), 2),
-        total_cost=total_invested,
-    )
-
-    # 返回結果（构建多股票价格数据）
-    first_engine = stock_engines[first_symbol]
+    contribution_pnls = [
+        t.pnl for t, ev in zip(all_trades, trade_events) if ev[7] and t.action == "BUY"
+    ]
+    summary = summarize_equity(equity, total_invested, contribution_pnls)
 
     # 构建多股票价格数据
-    multi_stock_prices = {}
-    for symbol in stock_engines.keys():
-        engine = stock_engines[symbol]
-        prices = [
-            round(float(p), 2) if not pd.isna(p) and not np.isinf(p) else 0.0
-            for p in engine.df["Close"].tolist()
-        ]
-        multi_stock_prices[symbol] = prices
+    multi_stock_prices = {
+        symbol: [round(_clean_float(p), 2) for p in price_matrix[:, i]]
+        for i, symbol in enumerate(all_symbols)
+    }
 
     price_data = PriceData(
-        dates=first_engine.df["Date"].tolist(),
+        dates=dates,
         prices=[],  # 多股票时不使用单一价格列
-        ma_short=[None] * len(first_engine.df),
-        ma_long=[None] * len(first_engine.df),
+        ma_short=[None] * n_days,
+        ma_long=[None] * n_days,
         multi_stock_prices=multi_stock_prices,
     )
 
@@ -1072,13 +1006,13 @@ def run_multi_stock_dca(request: BacktestRequest, backtest_id: int) -> BacktestR
         created_at=datetime.now().strftime("%Y-%m-%d %H:%M"),
         summary=summary,
         price_data=price_data,
-        equity_data=EquityData(
-            dates=first_engine.df["Date"].tolist(), equity=equity_curve
-        ),
+        equity_data=EquityData(dates=dates, equity=equity_curve),
         trades=all_trades,
         params={
             "strategy_type": request.strategy_type.value,
             "dca_interval": request.dca_interval.value,
+            "rebalance_mode": request.rebalance_mode.value,
+            "rebalance_threshold": request.rebalance_threshold,
             "stock_allocations": [
                 {"stock_symbol": a.stock_symbol, "allocation_ratio": a.allocation_ratio}
                 for a in request.stock_allocations
@@ -1087,224 +1021,112 @@ def run_multi_stock_dca(request: BacktestRequest, backtest_id: int) -> BacktestR
     )
 
 
-def optimize_dca_allocation(request: OptimizeRequest) -> OptimizeResult:
+def optimize_dca_allocation(
+    request: OptimizeRequest, token: Optional[CancellationToken] = None
+) -> OptimizeResult:
     """
     DCA 資產配置最佳化 (Monte Carlo Simulation)
 
-    1. 獲取所有股票數據
+    1. 獲取所有股票數據 (共同交易日對齊)
     2. 隨機生成 N 組權重
-    3. 快速回測計算 Sharpe Ratio
-    4. 返回最佳組合
+    3. 每批 ALLOCATION_BATCH_SIMULATIONS 組建立 (Days, Batch) 的權益曲線矩陣，
+       以共用指標核心批次計算績效 (批次之間檢查取消與運算預算)
+    4. 返回最佳組合；提前停止時為已模擬組合中的最佳者 (truncated=True)
     """
     if not request.stocks or len(request.stocks) < 2:
         raise ValueError("Allocation optimization requires at least 2 stocks")
 
-    # 1. 獲取數據 (Fetch Data Once)
-    stock_dfs = {}
-    dates = None
-
-    # 建立一個臨時的 BacktestRequest 來獲取數據
-    # 我們需要確保所有股票都在相同的時間範圍內對齊
     try:
-        common_dates = None
-
-        for symbol in request.stocks:
-            temp_req = BacktestRequest(
-                strategy_name="temp",
-                stock_symbol=symbol,
-                start_date=request.start_date,
-                end_date=request.end_date,
-                strategy_type=StrategyType.DCA,
-                dca_day=1,  # Default
-            )
-            engine = BacktestEngine(temp_req)
-            df = engine.fetch_data()
-
-            # 只保留需要的列
-            clean_df = df[["Date", "Close"]].copy()
-            clean_df["Date"] = pd.to_datetime(clean_df["Date"])
-            clean_df.set_index("Date", inplace=True)
-
-            if common_dates is None:
-                common_dates = clean_df.index
-            else:
-                common_dates = common_dates.intersection(clean_df.index)
-
-            stock_dfs[symbol] = clean_df
-
-        if len(common_dates) == 0:
-            raise ValueError("No overlapping dates found for the selected stocks")
-
-        # 對齊數據
-        aligned_prices = {}  # {symbol: numpy_array_of_prices}
-        for symbol in request.stocks:
-            aligned_prices[symbol] = stock_dfs[symbol].loc[common_dates]["Close"].values
-
-        # 產生 DCA 信號 (使用每個月/年的第一天，或最接近的交易日)
-        # 這裡簡化處理：找出每個月的第一個交易日索引
-        dca_indices = []
-        dates_list = common_dates.tolist()
-
-        last_period = -1
-        for i, date in enumerate(dates_list):
-            current_period = (
-                date.month
-                if request.dca_interval == InvestmentInterval.MONTHLY
-                else date.year
+        # 1. 獲取數據 (Fetch Data Once)
+        dates, price_matrix = fetch_aligned_closes(
+            request.stocks, request.start_date, request.end_date
+        )
+        n_days, n_stocks = price_matrix.shape
+
+        # DCA 投入日 (與回測使用相同規則)
+        dca_indices = np.flatnonzero(
+            contribution_mask(
+                dates,
+                request.dca_interval or InvestmentInterval.MONTHLY,
+                request.dca_day or 1,
+                request.dca_month or 1,
             )
+        )
+        if len(dca_indices) == 0:
+            raise ValueError("No DCA investment dates in the selected range")
 
-            if current_period != last_period:
-                # 換月/換年，這一天是該週期的第一天
-                dca_indices.append(i)
-                last_period = current_period
-
-        # 2. Monte Carlo Simulation
+        # 2. Monte Carlo Simulation：一次產生所有權重組合 (Simulations, Stocks)
         num_simulations = 1000
-        best_sharpe = -float("inf")
-        best_return = -float("inf")
-        best_allocation = {}
-
-        results = []  # for heatmap-like visualization or just logic
-
-        # 轉換為 numpy 陣列加速運算
-        price_matrix = np.array(
-            [aligned_prices[s] for s in request.stocks]
-        ).T  # (Days, Stocks)
-        n_days = price_matrix.shape[0]
-        n_stocks = len(request.stocks)
-
-        # 預先計算每日報酬率 (用於 Sharpe 計算)
-        # log_returns = np.diff(np.log(price_matrix), axis=0) # 簡化：我們直接用權益曲線算
-
-        for _ in range(num_simulations):
-            # 生成隨機權重 sum=1
-            weights = np.random.random(n_stocks)
-            weights /= weights.sum()
-
-            # 快速模擬 DCA
-            # 總投入
-            dca_amount = request.dca_amount
-            total_invested = 0
-
-            # 持有股數
-            shares = np.zeros(n_stocks)
-
-            # 現金 (簡化：假設全部買入，忽略餘額累積，或精確計算)
-            # 精確計算：
-            # 在每個 dca_index:
-            #   money_for_stock_i = dca_amount * weight_i
-            #   shares_bought_i = money_for_stock_i // price_i
-            #   cost_i = shares_bought_i * price_i
-            #   (忽略剩餘現金，因為影響很小)
-
-            # 為了向量化加速，我們建立一個 injection matrix
-            # 但 loop dca_indices 已經夠快了 (最多 250 個月)
-
-            for idx in dca_indices:
-                current_prices = price_matrix[idx]
-                money_alloc = dca_amount * weights
-
-                # 向下取整買入股數
-                new_shares = np.floor(money_alloc / current_prices)
-                shares += new_shares
-
-                # 累計投入 (假設全部 dca_amount 都算投入，即使有剩餘零錢)
-                total_invested += dca_amount
-
-            # 計算最終價值
-            final_prices = price_matrix[-1]
-            final_value = np.sum(shares * final_prices)
-
-            # 總報酬率
-            total_return_pct = (
-                (final_value - total_invested) / total_invested * 100
-                if total_invested > 0
-                else 0
+        weights = np.random.default_rng().random((num_simulations, n_stocks))
+        weights /= weights.sum(axis=1, keepdims=True)
+
+        dca_amount = request.dca_amount or 0
+        dca_prices = price_matrix[dca_indices]
+        safe_prices = np.where(dca_prices > 0, dca_prices, np.inf)
+        total_invested = dca_amount * len(dca_indices)
+        target = (
+            "total_return"
+            if request.optimization_target == OptimizeTarget.ROI
+            else "sharpe_ratio"  # Default to SHARPE
+        )
+
+        # 持股只在投入日改變：每日對應到最近一次投入
+        last_investment = (
+            np.searchsorted(dca_indices, np.arange(n_days), side="right") - 1
+        )
+        invested_days = last_investment >= 0
+        segment = last_investment[invested_days]
+
+        best_metrics = None
+        best = 0
+        done = 0
+        while done < num_simulations:
+            if done and token is not None and token.should_stop():
+                break
+            size = ALLOCATION_BATCH_SIMULATIONS
+            if token is not None:
+                size = token.batch_limit(size, n_days)
+            size = min(size, num_simulations - done)
+            batch = weights[done : done + size]
+
+            # 3. 每次投入的買入股數 (Investments, Batch, Stocks)
+            new_shares = np.floor(
+                dca_amount * batch[None, :, :] / safe_prices[:, None, :]
             )
+            spent = (new_shares * dca_prices[:, None, :]).sum(axis=2)
+            held_shares = np.cumsum(new_shares, axis=0)
+            leftover_cash = np.cumsum(dca_amount - spent, axis=0)
+
+            # 組出 (Days, Batch) 權益曲線
+            equity = np.zeros((n_days, size))
+            equity[invested_days] = leftover_cash[segment]
+            for k in range(n_stocks):
+                equity[invested_days] += (
+                    price_matrix[invested_days, k][:, None] * held_shares[segment, :, k]
+                )
 
-            # 計算 Sharpe (需要權益曲線)
-            # 這裡做一個權衡：計算每日權益曲線比較慢。
-            # 我們可以用 "加權後的股票每日報酬率" 來近似 Portfolio 波動率
-            # 但 DCA 的權益曲線形狀跟 Lump Sum 不一樣。
-            # 為了準確，我們必須構建權益曲線。
-
-            # 構建每日持倉市值
-            # shares 是一個隨時間變化的階梯函數
-            # 我們可以構建一個 shares_history 矩陣 (Days, Stocks)
-            shares_history = np.zeros((n_days, n_stocks))
-
-            current_shares_dynamic = np.zeros(n_stocks)
-            dca_idx_set = set(dca_indices)
-
-            # 這部分 loop n_days (252*N) * 1000 次可能有點慢。
-            # 優化：shares 只在 dca_indices 改變。
-            # 我們可以分段計算。
-
-            equity_curve = np.zeros(n_days)
-
-            last_idx = 0
-            for d_idx in dca_indices:
-                # 填補上一段的市值 (持有股數不變)
-                if d_idx > last_idx:
-                    # price_matrix[last_idx:d_idx] (TimeSlice, Stocks)
-                    # current_shares_dynamic (Stocks)
-                    # dot product -> (TimeSlice)
-                    period_values = np.dot(
-                        price_matrix[last_idx:d_idx], current_shares_dynamic
-                    )
-                    equity_curve[last_idx:d_idx] = period_values + (
-                        total_invested - dca_amount if total_invested > 0 else 0
-                    )  # 加上剩餘現金? 忽略
-
-                # 執行買入
-                current_prices = price_matrix[d_idx]
-                money_alloc = dca_amount * weights
-                new_shares = np.floor(money_alloc / current_prices)
-                current_shares_dynamic += new_shares
-                total_invested += dca_amount  # 這裡要注意 total_invested 是隨時間增加的
-
-                last_idx = d_idx
-
-            # 填補最後一段
-            if last_idx < n_days:
-                period_values = np.dot(price_matrix[last_idx:], current_shares_dynamic)
-                equity_curve[last_idx:] = period_values
-
-            # 計算 Sharpe
-            # 簡單版 Sharpe: 基於每日權益變化的回報
-            equity_series = pd.Series(equity_curve)
-            # 過濾掉前面為0的部分
-            equity_series = equity_series[equity_series > 0]
-
-            sharpe = 0
-            if len(equity_series) > 10:
-                pct_change = equity_series.pct_change().dropna()
-                std = pct_change.std()
-                if std > 0:
-                    sharpe = (pct_change.mean() / std) * np.sqrt(252)
-
-            # 記錄
-            is_better = False
-            if request.optimization_target == OptimizeTarget.ROI:
-                if total_return_pct > best_return:
-                    is_better = True
-            else:  # Default to SHARPE
-                if sharpe > best_sharpe:
-                    is_better = True
-
-            if is_better:
-                best_sharpe = sharpe
-                best_return = total_return_pct
-                best_allocation = {
-                    symbol: float(w) for symbol, w in zip(request.stocks, weights)
+            metrics = compute_metrics(equity, total_invested)
+            i = int(np.argmax(metrics[target]))
+            if best_metrics is None or metrics[target][i] > best_metrics[target]:
+                best_metrics = {
+                    key: metrics[key][i] for key in ("total_return", "sharpe_ratio")
                 }
+                best = done + i
+            done += size
+            if token is not None:
+                token.charge(size * n_days)
+
+        best_allocation = {
+            symbol: float(w) for symbol, w in zip(request.stocks, weights[best])
+        }
 
         # 返回結果
         return OptimizeResult(
-            best_return=round(best_return, 2),
-            best_sharpe=round(best_sharpe, 2),
+            best_return=round(_clean_float(best_metrics["total_return"]), 2),
+            best_sharpe=round(_clean_float(best_metrics["sharpe_ratio"]), 2),
             best_allocation={k: round(v, 4) for k, v in best_allocation.items()},
             heatmap_data=[],  # Allocation doesn't produce a 2D heatmap easily
+            truncated=done < num_simulations,
         )
 
     except Exception as e:
@@ -0,0 +1,245 @@
+"""
+批次回測 - 一次執行多個 BacktestRequest，共用行情資料與指標計算
+
+單一股票的技術分析策略依 (股票, 起訖日, K 棒週期) 分組：每組只取一次資料，並共用同一個
+ExpressionEvaluator (各請求相同的指標只計算一次)；再依出場規則 (賣出比例、
+停損停利) 分成子組，每個子組的所有請求以批次核心一次模擬，最後還原成與
+BacktestEngine 相同的逐筆交易、權益曲線與績效。DCA、多股票等其他策略
+逐一以 run_full_backtest 執行 (仍共用行程內價格快取)；有檢查點的請求同樣逐一執行，
+由檢查點接續並更新檢查點。結果快取命中的請求直接回傳，新計算的結果寫入結果快取。
+"""
+
+import os
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+
+from app.core.cancellation import CancellationToken
+from app.models.backtest import BacktestRequest, BacktestResult, TradeRecord
+from app.services.backtest_engine import (
+    BacktestEngine,
+    attach_analytics,
+    run_full_backtest,
+)
+from app.services.batch_kernel import simulate_long_only
+from app.services.checkpoints import engine_checkpoints
+from app.services.metrics import _clean_float
+from app.services.price_bars import PriceBars
+from app.services.result_cache import result_cache
+from app.services.stops import StopRules
+from app.services.strategy_registry import (
+    STRATEGIES,
+    build_signal_matrix,
+    compute_indicators,
+)
+from app.services.timeframes import INTRADAY_TIMEFRAMES
+
+BATCH_MAX_WORKERS = int(os.getenv("BATCH_MAX_WORKERS", "4"))
+
+# (結果, 錯誤訊息)，兩者恰有一個為 None
+BatchOutcome = Tuple[Optional[BacktestResult], Optional[str]]
+
+
+def _kernel_supported(request: BacktestRequest) -> bool:
+    return (
+        request.strategy_type in STRATEGIES
+        and not request.stock_allocations
+        and request.timeframe not in INTRADAY_TIMEFRAMES
+    )
+
+
+def _error_message(e: Exception) -> str:
+    return str(e) if isinstance(e, ValueError) else f"回測執行失敗: {str(e)}"
+
+
+def _replay_trades(
+    events: List[Dict],
+    dates: List[str],
+    close: np.ndarray,
+    cash_start: np.ndarray,
+    shares: int = 0,
+) -> List[TradeRecord]:
+    """
+    將批次核心的交易事件還原成 BacktestEngine 格式的 TradeRecord
+
+    cash_start[t] 為第 t 日交易前的現金 (前一日收盤現金 + 當日注資)；
+    balance / total_assets 為該筆交易後的現金與總資產，與引擎的計算順序相同。
+    shares 為期初持股 (分段模擬時接續前一段)。
+    """
+    trades = []
+    bar = -1
+    cash = 0.0
+    for ev in events:
+        if ev["bar"] != bar:
+            bar = ev["bar"]
+            cash = cash_start[bar]
+        if ev["action"] == "BUY":
+            cash -= ev["value"]
+            shares += ev["shares"]
+        else:
+            cash += ev["value"]
+            shares -= ev["shares"]
+        pnl = ev["pnl"]
+        trades.append(
+            TradeRecord(
+                date=dates[bar],
+                action=ev["action"],
+                price=round(ev["price"], 2),
+                shares=ev["shares"],
+                value=round(_clean_float(ev["value"]), 2),
+                balance=round(_clean_float(cash), 2),
+                total_assets=round(_clean_float(cash + shares * close[bar]), 2),
+                pnl=round(_clean_float(pnl), 2) if pnl is not None else None,
+                exit_reason=ev.get("exit_reason"),
+            )
+        )
+    return trades
+
+
+def _run_group(
+    requests: List[BacktestRequest],
+    token: Optional[CancellationToken] = None,
+) -> List[BatchOutcome]:
+    """同一股票、起訖日與 K 棒週期的技術分析策略請求 (共用資料與指標)"""
+    first = requests[0]
+    try:
+        bars = PriceBars.fetch(first)
+    except Exception as e:
+        return [(None, _error_message(e))] * len(requests)
+
+    dates = bars.dates
+    close = bars.close
+    evaluator = bars.evaluator()
+    n_days = len(bars)
+
+    outcomes: List[BatchOutcome] = [(None, None)] * len(requests)
+    columns: Dict[int, Tuple[np.ndarray, Dict[str, np.ndarray]]] = {}
+    subgroups = defaultdict(list)
+    for i, request in enumerate(requests):
+        try:
+            signals = build_signal_matrix(request, close, evaluator)
+            indicators = compute_indicators(request, evaluator)
+        except Exception as e:
+            outcomes[i] = (None, _error_message(e))
+            continue
+        columns[i] = (signals, indicators)
+        subgroups[(request.sell_ratio, StopRules.from_request(request))].append(i)
+
+    for (sell_ratio, stops), members in subgroups.items():
+        injections = np.zeros((n_days, len(members)))
+        for k, i in enumerate(members):
+            amounts = bars.injections(requests[i])
+            if amounts is not None:
+                injections[:, k] = amounts
+        initial_cash = np.array([requests[i].initial_capital for i in members])
+
+        try:
+            kernel = simulate_long_only(
+                np.broadcast_to(close[:, None], (n_days, len(members))),
+                np.column_stack([columns[i][0] for i in members]),
+                initial_cash,
+                injections=injections,
+                sell_ratio=sell_ratio,
+                stops=stops,
+                token=token,
+                **bars.ohlc(),
+            )
+        except Exception as e:
+            for i in members:
+                outcomes[i] = (None, _error_message(e))
+            continue
+
+        events = defaultdict(list)
+        for ev in kernel.trades:
+            events[ev["col"]].append(ev)
+        equity = kernel.equity
+        cash_start = np.vstack([initial_cash, kernel.cash[:-1]]) + injections
+        # 與引擎相同的逐次累加 (浮點數結果一致)
+        invested = np.cumsum(np.vstack([initial_cash, injections]), axis=0)[-1]
+
+        for k, i in enumerate(members):
+            request = requests[i]
+            try:
+                engine = BacktestEngine(request)
+                engine.df = pd.DataFrame({"Date": dates, "Close": close}).assign(
+                    **columns[i][1]
+                )
+                engine.trades = _replay_trades(
+                    events[k], dates, close, cash_start[:, k]
+                )
+                engine.equity_curve = [
+                    _clean_float(round(v, 2)) for v in equity[:, k].tolist()
+                ]
+                engine.total_invested = float(invested[k])
+                engine.total_cost = float(kernel.final_cost[k])
+                result = attach_analytics(engine.build_result(0), request)
+                outcomes[i] = (result, None)
+            except Exception as e:
+                outcomes[i] = (None, _error_message(e))
+    return outcomes
+
+
+def _run_single(
+    request: BacktestRequest, token: Optional[CancellationToken] = None
+) -> BatchOutcome:
+    try:
+        return run_full_backtest(request, 0, token), None
+    except Exception as e:
+        return None, _error_message(e)
+
+
+def run_backtest_batch(
+    requests: List[BacktestRequest], token: Optional[CancellationToken] = None
+) -> List[BatchOutcome]:
+    """
+    執行多個回測請求
+
+    Returns:
+        與 requests 同順序的 (結果, 錯誤訊息)；單一請求失敗不影響其他請求
+    """
+    outcomes: List[BatchOutcome] = [(None, None)] * len(requests)
+    computed: List[int] = []
+    groups: Dict[Tuple, List[int]] = defaultdict(list)
+    singles: List[int] = []
+    for i, request in enumerate(requests):
+        cached = result_cache.lookup(request)
+        if cached is not None:
+            outcomes[i] = (cached, None)
+            continue
+        computed.append(i)
+        # 批次核心不讀寫檢查點，有檢查點的請求交給引擎接續
+        if _kernel_supported(request) and engine_checkpoints.get(request) is None:
+            key = (
+                request.stock_symbol,
+                request.start_date,
+                request.end_date,
+                request.timeframe,
+            )
+            groups[key].append(i)
+        else:
+            singles.append(i)
+
+    tasks = len(groups) + len(singles)
+    workers = max(1, min(BATCH_MAX_WORKERS, tasks))
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        group_futures = {
+            key: pool.submit(_run_group, [requests[i] for i in members], token)
+            for key, members in groups.items()
+        }
+        single_futures = {
+            i: pool.submit(_run_single, requests[i], token) for i in singles
+        }
+        for key, future in group_futures.items():
+            for i, outcome in zip(groups[key], future.result()):
+                outcomes[i] = outcome
+        for i, future in single_futures.items():
+            outcomes[i] = future.result()
+
+    for i in computed:
+        result = outcomes[i][0]
+        if result is not None:
+            result_cache.store(requests[i], result)
+    return outcomes
@@ -0,0 +1,295 @@
+"""
+批次回測核心 - 在 (Days, N) 的價格/訊號矩陣上同時模擬 N 個多頭部位
+
+交易規則與 BacktestEngine.run_backtest 的一般策略相同：
+- 注資日先把 injections 加入現金
+- 買入訊號：以可用現金買進整數股數
+- 賣出訊號：依 sell_ratio 賣出持股，以平均成本計算已實現損益
+- 設定出場規則時，排定的停損/停利日先以觸價價格全部賣出，當日不再處理訊號
+- 期末仍有持股則強制平倉
+"""
+
+from typing import Any, Dict, List, NamedTuple, Optional
+
+import numpy as np
+
+from app.core.cancellation import CancellationToken
+from app.services.stops import StopRules, first_stop_hit, next_signal_bars
+
+# 傳入 token 時每隔此 K 棒數檢查一次取消 / 運算預算
+KERNEL_CHECK_BARS = 256
+
+
+class KernelResult(NamedTuple):
+    cash: np.ndarray  # (Days, N)；共用資金池時為 (Days, 1)
+    market_value: np.ndarray  # (Days, N) 每欄持股市值
+    trades: List[Dict[str, Any]]  # 交易事件 (bar, col, action, ...)
+    final_shares: np.ndarray  # (N,)
+    final_cost: np.ndarray  # (N,)
+
+    @property
+    def equity(self) -> np.ndarray:
+        """每欄權益 (Days, N)；共用資金池時為總權益 (Days,)"""
+        if self.cash.shape[1] == self.market_value.shape[1]:
+            return self.cash + self.market_value
+        return self.cash[:, 0] + self.market_value.sum(axis=1)
+
+
+def simulate_long_only(
+    prices: np.ndarray,
+    signals: np.ndarray,
+    initial_cash,
+    injections: Optional[np.ndarray] = None,
+    sell_ratio: float = 1.0,
+    shared_cash: bool = False,
+    liquidate_at_end: bool = True,
+    record_trades: bool = True,
+    stops: Optional[StopRules] = None,
+    open_: Optional[np.ndarray] = None,
+    high: Optional[np.ndarray] = None,
+    low: Optional[np.ndarray] = None,
+    token: Optional[CancellationToken] = None,
+    initial_shares: Optional[np.ndarray] = None,
+    initial_cost: Optional[np.ndarray] = None,
+) -> KernelResult:
+    """
+    Args:
+        prices: (Days, N) 收盤價
+        signals: (Days, N) 訊號 (1/-1/0)
+        initial_cash: 初始現金，純量或 (N,) (每欄獨立資金)
+        injections: 每日注資金額，(Days,) 或 (Days, N)
+        sell_ratio: 每次賣出的持股比例
+        shared_cash: True 時所有欄位共用一個資金池，同日多檔買入訊號平分現金
+        liquidate_at_end: 期末是否強制平倉
+        record_trades: 是否記錄逐筆交易 (最佳化時可關閉以加速)
+        stops: 停損/停利/移動停損規則
+        open_, high, low: (Days,) 或 (Days, N) 開高低價，盤中觸價判斷使用
+            (未提供時以收盤價判斷)
+        token: 取消 / 運算預算，停止時拋出 OperationCancelled
+        initial_shares, initial_cost: (N,) 期初持股與持倉成本 (分段模擬時接續
+            前一段的 final_shares / final_cost，initial_cash 為前一段最後的現金)
+    """
+    prices = np.asarray(prices, dtype=float)
+    signals = np.asarray(signals)
+    n_days, n_cols = prices.shape
+
+    if sell_ratio <= 0 or sell_ratio > 1:
+        sell_ratio = 1.0
+
+    n_cash = 1 if shared_cash else n_cols
+    cash = np.broadcast_to(np.asarray(initial_cash, dtype=float), (n_cash,)).copy()
+    if injections is None:
+        inject = None
+    else:
+        inject = np.asarray(injections, dtype=float)
+        if inject.ndim == 1:
+            inject = inject[:, None]
+        if shared_cash and inject.shape[1] != 1:
+            inject = inject.sum(axis=1, keepdims=True)
+
+    shares = np.zeros(n_cols)
+    total_cost = np.zeros(n_cols)
+    if initial_shares is not None:
+        shares += initial_shares
+        total_cost += initial_cost
+    cash_path = np.empty((n_days, n_cash))
+    value_path = np.empty((n_days, n_cols))
+    trades: List[Dict[str, Any]] = []
+
+    valid_price = prices > 0
+    is_buy = (signals == 1) & valid_price
+    is_sell = signals == -1
+    active_rows = is_buy.any(axis=1) | is_sell.any(axis=1)
+
+    if stops is not None:
+        upcoming_signal = next_signal_bars(signals)
+        stop_bar = np.full(n_cols, -1)
+        stop_price = np.zeros(n_cols)
+        stop_reason = [""] * n_cols
+        peak = np.zeros(n_cols)
+        ohl = [
+            (
+                None
+                if a is None
+                else np.broadcast_to(
+                    np.asarray(a, dtype=float).reshape(n_days, -1), (n_days, n_cols)
+                )
+            )
+            for a in (open_, high, low)
+        ]
+
+    for t in range(n_days):
+        if token is not None and t % KERNEL_CHECK_BARS == 0:
+            token.check()
+
+        if inject is not None:
+            cash += inject[t]
+
+        stop_due = None
+        if stops is not None:
+            stop_due = (stop_bar == t) & (shares > 0)
+            if stop_due.any():
+                # 排定的觸價出場：以觸價價格全部賣出
+                exit_price = np.where(stop_due, stop_price, 0.0)
+                revenue = shares * exit_price
+                pnl = revenue - total_cost
+                if shared_cash:
+                    cash += revenue.sum()
+                else:
+                    cash += revenue
+                if record_trades:
+                    for col in np.flatnonzero(stop_due):
+                        trades.append(
+                            {
+                                "bar": t,
+                                "col": int(col),
+                                "action": "SELL",
+                                "price": float(exit_price[col]),
+                                "shares": int(shares[col]),
+                                "value": float(revenue[col]),
+                                "pnl": float(pnl[col]),
+                                "exit_reason": stop_reason[col],
+                            }
+                        )
+                shares[stop_due] = 0.0
+                total_cost[stop_due] = 0.0
+            else:
+                stop_due = None
+
+        if active_rows[t]:
+            price = prices[t]
+            held_before = shares > 0
+
+            # 賣出 (共用資金池時先賣後買，釋放現金)
+            sell_mask = is_sell[t] & (shares > 0)
+            if stop_due is not None:
+                sell_mask &= ~stop_due
+            if sell_mask.any():
+                sell_shares = np.where(sell_mask, np.floor(shares * sell_ratio), 0.0)
+                sell_mask &= sell_shares > 0
+                revenue = np.where(sell_mask, sell_shares * price, 0.0)
+                # 平均成本法計算賣出部分的成本
+                avg_cost = np.divide(
+                    total_cost, shares, out=np.zeros(n_cols), where=shares > 0
+                )
+                sold_cost = np.where(sell_mask, avg_cost * sell_shares, 0.0)
+                pnl = revenue - sold_cost
+                if shared_cash:
+                    cash += revenue.sum()
+                else:
+                    cash += revenue
+                total_cost -= sold_cost
+                shares -= sell_shares
+                total_cost[shares == 0] = 0.0
+                if record_trades:
+                    for col in np.flatnonzero(sell_mask):
+                        trades.append(
+                            {
+                                "bar": t,
+                                "col": int(col),
+                                "action": "SELL",
+                                "price": float(price[col]),
+                                "shares": int(sell_shares[col]),
+                                "value": float(revenue[col]),
+                                "pnl": float(pnl[col]),
+                            }
+                        )
+
+            # 買入
+            buy_mask = is_buy[t] & ~is_sell[t]
+            if stop_due is not None:
+                buy_mask &= ~stop_due
+            if buy_mask.any():
+                safe_price = np.where(buy_mask, price, 1.0)
+                if shared_cash:
+                    budget = np.full(n_cols, cash[0] / int(buy_mask.sum()))
+                else:
+                    budget = cash
+                buy_shares = np.where(
+                    buy_mask, np.floor_divide(budget, safe_price), 0.0
+                )
+                buy_shares = np.clip(buy_shares, 0.0, None)
+                cost = buy_shares * np.where(buy_mask, price, 0.0)
+                if shared_cash:
+                    cash -= cost.sum()
+                else:
+                    cash -= cost
+                total_cost += cost
+                shares += buy_shares
+                if record_trades:
+                    for col in np.flatnonzero(buy_shares > 0):
+                        trades.append(
+                            {
+                                "bar": t,
+                                "col": int(col),
+                                "action": "BUY",
+                                "price": float(price[col]),
+                                "shares": int(buy_shares[col]),
+                                "value": float(cost[col]),
+                                "pnl": None,
+                            }
+                        )
+
+            # 有訊號的持倉欄位 (新倉、加碼或部分賣出) 重新排定下一段的觸價出場
+            if stops is not None:
+                reschedule = (signals[t] != 0) & (shares > 0)
+                if stop_due is not None:
+                    reschedule &= ~stop_due
+                for col in np.flatnonzero(reschedule):
+                    if not held_before[col]:
+                        peak[col] = price[col]
+                    hit, peak[col] = first_stop_hit(
+                        stops,
+                        total_cost[col] / shares[col],
+                        peak[col],
+                        t + 1,
+                        min(int(upcoming_signal[t, col]) + 1, n_days),
+                        prices[:, col],
+                        *(None if a is None else a[:, col] for a in ohl),
+                    )
+                    if hit is None:
+                        stop_bar[col] = -1
+                    else:
+                        stop_bar[col] = hit.bar
+                        stop_price[col] = hit.price
+                        stop_reason[col] = hit.reason
+
+        cash_path[t] = cash
+        value_path[t] = shares * prices[t]
+
+    # 期末強制平倉
+    if liquidate_at_end and n_days > 0:
+        last = prices[-1]
+        held = shares > 0
+        if held.any():
+            revenue = np.where(held, shares * last, 0.0)
+            pnl = revenue - total_cost
+            if record_trades:
+                for col in np.flatnonzero(held):
+                    trades.append(
+                        {
+                            "bar": n_days - 1,
+                            "col": int(col),
+                            "action": "SELL",
+                            "price": float(last[col]),
+                            "shares": int(shares[col]),
+                            "value": float(revenue[col]),
+                            "pnl": float(pnl[col]),
+                        }
+                    )
+            if shared_cash:
+                cash += revenue.sum()
+            else:
+                cash += revenue
+            shares = np.zeros(n_cols)
+            total_cost = np.zeros(n_cols)
+            cash_path[-1] = cash
+            value_path[-1] = 0.0
+
+    return KernelResult(
+        cash=cash_path,
+        market_value=value_path,
+        trades=trades,
+        final_shares=shares,
+        final_cost=total_cost,
+    )
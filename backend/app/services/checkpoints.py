@@ -0,0 +1,173 @@
+"""
+回測檢查點 - 保存單一股票回測迴圈結束時的狀態，結束日延長後只模擬新增的 K 棒
+
+檢查點記錄最後一根 K 棒處理完 (期末結算或強制平倉之前) 的現金、持股、持倉成本、
+累積投入、移動停損的最高參考價，以及至今的交易紀錄與權益曲線。指標與訊號為
+向量化計算 (成本遠低於逐日模擬)，接續時仍對完整區間重新計算，並以前段資料與訊號的
+摘要確認與檢查點一致 (例如價格經除權息調整後即不一致，改為從頭執行)。
+
+行程內以 engine_checkpoints 保存；檢查點狀態也隨回測紀錄寫入資料庫
+(BacktestRecord.checkpoint)，每日更新時由紀錄還原，重新啟動的行程同樣只需模擬新的 K 棒。
+"""
+
+import hashlib
+import json
+import os
+import threading
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Any, Dict, List, Optional
+
+import numpy as np
+import pandas as pd
+
+from app.models.backtest import BacktestRequest, Timeframe, TradeRecord
+
+CHECKPOINT_MAX_ENTRIES = int(os.getenv("CHECKPOINT_MAX_ENTRIES", "256"))
+
+# 不影響回測迴圈狀態的欄位 (結束日、顯示名稱與事後附加的分析)
+_KEY_EXCLUDE = {
+    "strategy_name",
+    "end_date",
+    "benchmark_mode",
+    "benchmark_symbol",
+    "rolling_windows",
+}
+
+
+@dataclass
+class EngineCheckpoint:
+    end_date: str  # 產生此檢查點的請求結束日
+    n_bars: int  # 已模擬的 K 棒數
+    digest: str  # 前 n_bars 根 K 棒的價格、訊號與注資日摘要
+    cash: float
+    shares: int
+    total_cost: float
+    total_invested: float
+    entry_price: float
+    peak: float
+    trades: List[TradeRecord]
+    equity_curve: List[float]
+
+    def state(self) -> Dict[str, Any]:
+        """
+        可保存到資料庫的狀態 (JSON)
+
+        交易紀錄與權益曲線不重複保存：它們是回測結果的前段，只記錄筆數與
+        期末強制平倉前的最後一筆權益，由 from_state 還原。
+        """
+        state = {name: getattr(self, name) for name in _STATE_FIELDS}
+        state["n_trades"] = len(self.trades)
+        state["last_equity"] = self.equity_curve[-1] if self.equity_curve else None
+        return state
+
+    @classmethod
+    def from_state(
+        cls, state: Dict[str, Any], trades: List[TradeRecord], equity: List[float]
+    ) -> "EngineCheckpoint":
+        """由 state() 與同一次執行的結果 (交易紀錄、權益曲線) 還原檢查點"""
+        equity_curve = list(equity[: state["n_bars"]])
+        if equity_curve:
+            equity_curve[-1] = state["last_equity"]
+        return cls(
+            **{name: state[name] for name in _STATE_FIELDS},
+            trades=list(trades[: state["n_trades"]]),
+            equity_curve=equity_curve,
+        )
+
+
+_STATE_FIELDS = (
+    "end_date",
+    "n_bars",
+    "digest",
+    "cash",
+    "shares",
+    "total_cost",
+    "total_invested",
+    "entry_price",
+    "peak",
+)
+
+
+def bar_digest(df: pd.DataFrame, n_bars: int, paydays: Optional[np.ndarray]) -> str:
+    """前 n_bars 根 K 棒的日期、OHLC、訊號與注資日摘要"""
+    h = hashlib.sha256()
+    h.update("\n".join(df["Date"].iloc[:n_bars]).encode("utf-8"))
+    for col in ("Open", "High", "Low", "Close"):
+        if col in df:
+            h.update(df[col].to_numpy(dtype=float)[:n_bars].tobytes())
+    h.update(df["Signal"].to_numpy(dtype=np.int8)[:n_bars].tobytes())
+    if paydays is not None:
+        h.update(np.asarray(paydays, dtype=bool)[:n_bars].tobytes())
+    return h.hexdigest()
+
+
+def checkpoint_bar(
+    dates: List[str],
+    paydays: Optional[np.ndarray],
+    target_day: int,
+    timeframe: Timeframe = Timeframe.DAILY,
+) -> int:
+    """
+    檢查點的位置 (已模擬的 K 棒數)
+
+    最後一根 K 棒若是週期內沒有日期 >= target_day 的交易日而退回的投入日，
+    延長資料後該週期的投入日會往後移，因此檢查點改存在這根 K 棒之前。
+    週 / 月 K 的最後一根可能尚未完成 (延長後價格會改變)，同樣存在它之前。
+    """
+    n = len(dates)
+    if n and timeframe != Timeframe.DAILY:
+        return n - 1
+    if n and paydays is not None and paydays[-1] and int(dates[-1][8:10]) < target_day:
+        return n - 1
+    return n
+
+
+def checkpoint_key(request: BacktestRequest) -> str:
+    """除結束日外完全相同的請求共用同一個鍵"""
+    payload = request.model_dump(mode="json", exclude=_KEY_EXCLUDE)
+    text = json.dumps(payload, sort_keys=True, separators=(",", ":"))
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+class CheckpointStore:
+    """行程內 LRU 檢查點儲存，每個鍵只保留最近一次執行的檢查點"""
+
+    def __init__(self, max_entries: int = CHECKPOINT_MAX_ENTRIES):
+        self.max_entries = max_entries
+        self._entries: "OrderedDict[str, EngineCheckpoint]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, request: BacktestRequest) -> Optional[EngineCheckpoint]:
+        key = checkpoint_key(request)
+        with self._lock:
+            checkpoint = self._entries.get(key)
+            if checkpoint is not None:
+                self._entries.move_to_end(key)
+            return checkpoint
+
+    def put(
+        self, request: BacktestRequest, checkpoint: Optional[EngineCheckpoint]
+    ) -> None:
+        if checkpoint is None or self.max_entries <= 0:
+            return
+        key = checkpoint_key(request)
+        with self._lock:
+            self._entries[key] = checkpoint
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def state_for(self, request: BacktestRequest) -> Optional[Dict[str, Any]]:
+        """此請求 (含結束日) 最近一次執行的檢查點狀態，供與結果一起保存"""
+        checkpoint = self.get(request)
+        if checkpoint is None or checkpoint.end_date != request.end_date:
+            return None
+        return checkpoint.state()
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+
+
+engine_checkpoints = CheckpointStore()
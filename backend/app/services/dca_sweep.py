@@ -0,0 +1,133 @@
+"""
+DCA 起始日掃描 - 一次計算「任一投入日開始、持有任一期間」的定期定額報酬曲面
+
+每次投入買入的股數與成本只計算一次，任一區間的累積持股與成本都是前綴和相減，
+因此總成本與輸出的 起點 x 持有期間 格數成正比。
+"""
+
+from typing import List, Optional
+
+import numpy as np
+
+from app.core.cancellation import CancellationToken
+from app.models.backtest import (
+    DcaSweepHorizonStats,
+    DcaSweepRequest,
+    DcaSweepResult,
+)
+from app.services.market_data import fetch_history
+from app.services.schedule import contribution_mask
+
+
+def dca_return_surface(
+    close: np.ndarray, paydays: np.ndarray, dca_amount: float, horizons: np.ndarray
+) -> np.ndarray:
+    """
+    計算 起點 x 持有期間 的 DCA 總報酬率 (%)
+
+    規則與 BacktestEngine 的 DCA 相同：每個投入日買入 int(dca_amount // price) 股，
+    報酬以持股市值相對實際買入成本計算。持有 h 次投入的期間結束於第 h+1 次投入的前一個
+    交易日 (資料不足時為最後一個交易日)；horizon 0 表示持有至資料結束。
+
+    Args:
+        close: (Days,) 收盤價
+        paydays: 投入日在 close 中的索引 (遞增)
+        dca_amount: 每次投入金額
+        horizons: 持有期間 (投入次數)
+
+    Returns:
+        (len(paydays), len(horizons)) 陣列，超出資料範圍的格子為 NaN
+    """
+    n_days = len(close)
+    n_paydays = len(paydays)
+    prices = close[paydays]
+    with np.errstate(divide="ignore", invalid="ignore"):
+        shares = np.where(prices > 0, np.floor(dca_amount / prices), 0.0)
+    cost = shares * prices
+
+    # 前綴和：第 k 個元素為前 k 次投入的累積持股 / 成本
+    cum_shares = np.concatenate([[0.0], np.cumsum(shares)])
+    cum_cost = np.concatenate([[0.0], np.cumsum(cost)])
+
+    starts = np.arange(n_paydays)[:, None]
+    horizons = np.asarray(horizons, dtype=int)[None, :]
+    stop = np.where(horizons > 0, starts + horizons, n_paydays)
+    in_range = stop <= n_paydays
+    stop = np.minimum(stop, n_paydays)
+
+    # 估值日：下一次投入的前一個交易日，最後一段為資料結尾
+    next_payday = np.concatenate([paydays, [n_days]])
+    end_bar = next_payday[stop] - 1
+
+    held = cum_shares[stop] - cum_shares[starts]
+    invested = cum_cost[stop] - cum_cost[starts]
+    with np.errstate(divide="ignore", invalid="ignore"):
+        surface = (held * close[end_bar] - invested) / invested * 100
+    return np.where(in_range & (invested > 0), surface, np.nan)
+
+
+def _horizon_stats(horizon: int, column: np.ndarray) -> DcaSweepHorizonStats:
+    values = column[np.isfinite(column)]
+    if len(values) == 0:
+        return DcaSweepHorizonStats(
+            horizon=horizon,
+            count=0,
+            best=0.0,
+            worst=0.0,
+            median=0.0,
+            positive_ratio=0.0,
+        )
+    return DcaSweepHorizonStats(
+        horizon=horizon,
+        count=len(values),
+        best=round(float(values.max()), 2),
+        worst=round(float(values.min()), 2),
+        median=round(float(np.median(values)), 2),
+        positive_ratio=round(float((values > 0).mean() * 100), 2),
+    )
+
+
+def run_dca_sweep(
+    request: DcaSweepRequest, token: Optional[CancellationToken] = None
+) -> DcaSweepResult:
+    """
+    以單次資料讀取產生 DCA 起始日 x 持有期間報酬曲面
+
+    曲面為一次向量化計算，token 只在計算前後檢查 (取消時拋出 OperationCancelled)。
+    """
+    df = fetch_history(request.stock_symbol, request.start_date, request.end_date)
+    dates: List[str] = df["Date"].tolist()
+    close = df["Close"].to_numpy(dtype=float)
+
+    paydays = np.flatnonzero(
+        contribution_mask(
+            dates, request.dca_interval, request.dca_day, request.dca_month
+        )
+    )
+    if len(paydays) == 0:
+        raise ValueError("選取的期間內沒有任何投入日")
+
+    if request.all_horizons:
+        horizons = np.arange(1, len(paydays) + 1)
+    elif request.horizons:
+        horizons = np.array(sorted(set(request.horizons)))
+    else:
+        horizons = np.array([0])
+
+    if token is not None:
+        token.check()
+    surface = dca_return_surface(close, paydays, request.dca_amount, horizons)
+    if token is not None:
+        token.check()
+
+    return DcaSweepResult(
+        stock_symbol=request.stock_symbol,
+        dca_interval=request.dca_interval.value,
+        start_dates=[dates[i] for i in paydays],
+        horizons=horizons.tolist(),
+        returns=[
+            [None if np.isnan(v) else round(float(v), 2) for v in row]
+            for row in surface
+        ],
+        stats=[_horizon_stats(int(h), surface[:, j]) for j, h in enumerate(horizons)],
+    )
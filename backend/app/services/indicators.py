@@ -0,0 +1,179 @@
+"""
+向量化技術指標 - 以 numpy 沿時間軸 (axis 0) 同時計算多欄位
+
+所有函式接受 (Days,) 或 (Days, N) 陣列，回傳相同形狀的 float 陣列，
+暖機期以 NaN 表示，數值與 BacktestEngine 中 pandas rolling/ewm 的結果一致。
+"""
+
+import numpy as np
+
+
+def _as_2d(values: np.ndarray) -> np.ndarray:
+    arr = np.asarray(values, dtype=float)
+    return arr.reshape(-1, 1) if arr.ndim == 1 else arr
+
+
+def _restore_shape(result: np.ndarray, values: np.ndarray) -> np.ndarray:
+    return result.ravel() if np.ndim(values) == 1 else result
+
+
+def shift(values: np.ndarray, periods: int = 1) -> np.ndarray:
+    """沿時間軸平移，空出的位置補 NaN"""
+    arr = np.asarray(values, dtype=float)
+    out = np.full_like(arr, np.nan)
+    if periods > 0:
+        out[periods:] = arr[:-periods]
+    elif periods < 0:
+        out[:periods] = arr[-periods:]
+    else:
+        out[:] = arr
+    return out
+
+
+def rolling_sum(values: np.ndarray, window: int) -> np.ndarray:
+    """滾動加總 (以累積和計算，O(n))"""
+    arr = _as_2d(values)
+    n = arr.shape[0]
+    out = np.full(arr.shape, np.nan)
+    if window <= 0 or window > n:
+        return _restore_shape(out, values)
+    missing = np.isnan(arr)
+    zeros = np.zeros((1, arr.shape[1]))
+    csum = np.cumsum(np.vstack([zeros, np.where(missing, 0.0, arr)]), axis=0)
+    out[window - 1 :] = csum[window:] - csum[:-window]
+    if missing.any():
+        # 視窗內含 NaN 時結果為 NaN (同 pandas min_periods=window)
+        nan_count = np.cumsum(np.vstack([zeros, missing]), axis=0)
+        has_nan = (nan_count[window:] - nan_count[:-window]) > 0
+        out[window - 1 :][has_nan] = np.nan
+    return _restore_shape(out, values)
+
+
+def rolling_mean(values: np.ndarray, window: int) -> np.ndarray:
+    """簡單移動平均 (對應 Series.rolling(window).mean())"""
+    return rolling_sum(values, window) / window
+
+
+def rolling_std(values: np.ndarray, window: int) -> np.ndarray:
+    """滾動樣本標準差 (ddof=1，對應 Series.rolling(window).std())"""
+    arr = _as_2d(values)
+    if window < 2:
+        return _restore_shape(np.full(arr.shape, np.nan), values)
+    # 先減去欄平均以降低大數相減的精度損失
+    valid = ~np.isnan(arr)
+    counts = valid.sum(axis=0)
+    center = np.where(valid, arr, 0.0).sum(axis=0) / np.maximum(counts, 1)
+    centered = arr - center
+    s1 = rolling_sum(centered, window)
+    s2 = rolling_sum(centered * centered, window)
+    var = (s2 - s1 * s1 / window) / (window - 1)
+    return _restore_shape(np.sqrt(np.clip(var, 0.0, None)), values)
+
+
+def rolling_max(values: np.ndarray, window: int) -> np.ndarray:
+    """
+    滾動最大值 (對應 Series.rolling(window).max())
+
+    以區塊前綴/後綴最大值 (van Herk/Gil-Werman) 計算，與視窗長度無關，O(n)。
+    """
+    arr = _as_2d(values)
+    n, n_cols = arr.shape
+    out = np.full(arr.shape, np.nan)
+    if window <= 0 or window > n:
+        return _restore_shape(out, values)
+    missing = np.isnan(arr)
+    n_blocks = -(-n // window)
+    padded = np.full((n_blocks * window, n_cols), -np.inf)
+    padded[:n] = np.where(missing, -np.inf, arr)
+    blocks = padded.reshape(n_blocks, window, n_cols)
+    prefix = np.maximum.accumulate(blocks, axis=1).reshape(-1, n_cols)
+    suffix = np.maximum.accumulate(blocks[:, ::-1], axis=1)[:, ::-1].reshape(-1, n_cols)
+    # 視窗 [i - window + 1, i] 跨越至多兩個區塊
+    ends = np.arange(window - 1, n)
+    out[window - 1 :] = np.maximum(suffix[ends - window + 1], prefix[ends])
+    if missing.any():
+        nan_count = np.cumsum(np.vstack([np.zeros((1, n_cols)), missing]), axis=0)
+        has_nan = (nan_count[window:] - nan_count[:-window]) > 0
+        out[window - 1 :][has_nan] = np.nan
+    return _restore_shape(out, values)
+
+
+def ema(values: np.ndarray, span: int, initial=None) -> np.ndarray:
+    """
+    指數移動平均 (對應 Series.ewm(span, adjust=False).mean())
+
+    initial 為前一段最後的 EMA 值時由此接續 (分段計算與整段計算結果相同)。
+    """
+    arr = _as_2d(values)
+    alpha = 2.0 / (span + 1.0)
+    out = np.empty(arr.shape)
+    if arr.shape[0] == 0:
+        return _restore_shape(out, values)
+    if initial is None:
+        prev = arr[0].copy()
+        out[0] = prev
+        first = 1
+    else:
+        prev = np.broadcast_to(np.asarray(initial, dtype=float), arr.shape[1:]).copy()
+        first = 0
+    for t in range(first, arr.shape[0]):
+        row = arr[t]
+        valid = ~np.isnan(row)
+        prev = np.where(
+            valid,
+            np.where(np.isnan(prev), row, alpha * row + (1 - alpha) * prev),
+            prev,
+        )
+        out[t] = prev
+    return _restore_shape(out, values)
+
+
+def rsi(values: np.ndarray, period: int) -> np.ndarray:
+    """RSI (簡單平均版本，與 BacktestEngine 一致)"""
+    arr = _as_2d(values)
+    delta = arr - shift(arr, 1)
+    gain = rolling_mean(np.where(delta > 0, delta, 0.0), period)
+    loss = rolling_mean(np.where(delta < 0, -delta, 0.0), period)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        rs = gain / loss
+        out = 100 - (100 / (1 + rs))
+    return _restore_shape(out, values)
+
+
+def rolling_ols(y: np.ndarray, x: np.ndarray, window: int):
+    """
+    滾動最小平方法 y = alpha + beta * x (以滾動加總計算，O(n))
+
+    Returns:
+        (alpha, beta)，暖機期為 NaN
+    """
+    y = np.asarray(y, dtype=float)
+    x = np.asarray(x, dtype=float)
+    # 斜率不受平移影響，先減去平均值以降低累積和的精度損失
+    x_center = np.nanmean(x) if np.isfinite(x).any() else 0.0
+    y_center = np.nanmean(y) if np.isfinite(y).any() else 0.0
+    xc = x - x_center
+    yc = y - y_center
+
+    sx = rolling_sum(xc, window)
+    sy = rolling_sum(yc, window)
+    sxx = rolling_sum(xc * xc, window)
+    sxy = rolling_sum(xc * yc, window)
+
+    with np.errstate(divide="ignore", invalid="ignore"):
+        var_x = window * sxx - sx * sx
+        beta = np.where(var_x > 0, (window * sxy - sx * sy) / var_x, np.nan)
+        alpha = (sy - beta * sx) / window + y_center - beta * x_center
+    return alpha, beta
+
+
+def cross_above(a: np.ndarray, b) -> np.ndarray:
+    """a 由下往上穿越 b"""
+    b_prev = shift(b, 1) if np.ndim(b) else b
+    return (a > b) & (shift(a, 1) <= b_prev)
+
+
+def cross_below(a: np.ndarray, b) -> np.ndarray:
+    """a 由上往下穿越 b"""
+    b_prev = shift(b, 1) if np.ndim(b) else b
+    return (a < b) & (shift(a, 1) >= b_prev)
@@ -0,0 +1,356 @@
+"""
+背景工作佇列 - 以資料庫 jobs 資料表作為持久化佇列，由獨立的 worker 行程執行
+
+提交工作只寫入一筆 QUEUED 紀錄並立即回傳 id。worker 以條件式 UPDATE
+(WHERE status='QUEUED') 領取工作，因此指向同一個資料庫的多個 worker / 多台機器
+可以安全地共用佇列。執行中的工作定期更新 heartbeat_at，心跳逾時的工作視為
+worker 已中斷，會重新排入佇列 (超過 max_attempts 則標記為失敗)。
+"""
+
+import logging
+import os
+import socket
+import threading
+from datetime import datetime, timedelta
+from typing import Any, Callable, Dict, Optional, Tuple, Type
+
+from pydantic import BaseModel, ValidationError
+from sqlalchemy.orm import Session
+
+from app.core.cancellation import CancellationToken
+from app.core.database import SessionLocal
+from app.core.models import Job
+from app.models.backtest import (
+    BacktestRequest,
+    DcaSweepRequest,
+    JobInfo,
+    JobKind,
+    JobStatus,
+    OptimizeRequest,
+    RobustnessRequest,
+    StrategyType,
+    WalkForwardRequest,
+)
+
+JOB_HEARTBEAT_SECONDS = float(os.getenv("JOB_HEARTBEAT_SECONDS", "10"))
+# 超過此秒數沒有心跳的 RUNNING 工作視為 worker 已中斷
+JOB_STALE_SECONDS = float(os.getenv("JOB_STALE_SECONDS", "60"))
+
+ProgressCallback = Callable[[float], None]
+
+logger = logging.getLogger(__name__)
+
+
+def _run_backtest(
+    request: BacktestRequest, user_id: int, progress: ProgressCallback
+) -> Dict:
+    # 延遲匯入：回測引擎會載入所有策略模組
+    from app.services.records import next_backtest_id, result_to_record
+    from app.services.result_cache import cached_backtest
+
+    db = SessionLocal()
+    try:
+        result = cached_backtest(
+            request, next_backtest_id(db), CancellationToken.for_request(request)
+        )
+        record = result_to_record(result, user_id, request)
+        db.add(record)
+        db.commit()
+        return {"backtest_id": record.id}
+    finally:
+        db.close()
+
+
+def _run_optimize(
+    request: OptimizeRequest, user_id: int, progress: ProgressCallback
+) -> Dict:
+    from app.services.backtest_engine import optimize_dca_allocation
+    from app.services.optimizer import GridSweep
+
+    token = CancellationToken.for_request(request)
+    if request.strategy_type == StrategyType.DCA:
+        return optimize_dca_allocation(request, token).model_dump(mode="json")
+    sweep = GridSweep(request, token)
+    return sweep.run(progress).model_dump(mode="json")
+
+
+def _run_walk_forward(
+    request: WalkForwardRequest, user_id: int, progress: ProgressCallback
+) -> Dict:
+    from app.services.optimizer import run_walk_forward
+
+    token = CancellationToken.for_request(request)
+    return run_walk_forward(request, progress, token).model_dump(mode="json")
+
+
+def _run_robustness(
+    request: RobustnessRequest, user_id: int, progress: ProgressCallback
+) -> Dict:
+    from app.services.robustness import run_robustness
+
+    token = CancellationToken.for_request(request)
+    return run_robustness(request, token, progress).model_dump(mode="json")
+
+
+def _run_dca_sweep(
+    request: DcaSweepRequest, user_id: int, progress: ProgressCallback
+) -> Dict:
+    from app.services.dca_sweep import run_dca_sweep
+
+    return run_dca_sweep(request).model_dump(mode="json")
+
+
+# 工作種類 -> (請求模型, 執行函式)
+JOB_HANDLERS: Dict[JobKind, Tuple[Type[BaseModel], Callable]] = {
+    JobKind.BACKTEST: (BacktestRequest, _run_backtest),
+    JobKind.OPTIMIZE: (OptimizeRequest, _run_optimize),
+    JobKind.WALK_FORWARD: (WalkForwardRequest, _run_walk_forward),
+    JobKind.ROBUSTNESS: (RobustnessRequest, _run_robustness),
+    JobKind.DCA_SWEEP: (DcaSweepRequest, _run_dca_sweep),
+}
+
+
+def _parse_payload(kind: JobKind, payload: Dict[str, Any]) -> BaseModel:
+    model = JOB_HANDLERS[kind][0]
+    try:
+        return model.model_validate(payload)
+    except ValidationError as e:
+        raise ValueError(f"payload 格式錯誤: {e.errors()[0].get('msg', str(e))}")
+
+
+def submit_job(
+    db: Session,
+    user_id: int,
+    kind: JobKind,
+    payload: Dict[str, Any],
+    max_attempts: int = 3,
+) -> Job:
+    """驗證 payload 後寫入佇列 (不執行)"""
+    request = _parse_payload(kind, payload)
+    job = Job(
+        user_id=user_id,
+        kind=kind.value,
+        status=JobStatus.QUEUED.value,
+        payload=request.model_dump(mode="json"),
+        max_attempts=max_attempts,
+    )
+    db.add(job)
+    db.commit()
+    db.refresh(job)
+    return job
+
+
+def requeue_stale_jobs(db: Session) -> int:
+    """
+    心跳逾時的 RUNNING 工作重新排入佇列，已達重試上限者標記為失敗
+
+    Returns:
+        處理的工作數
+    """
+    cutoff = datetime.utcnow() - timedelta(seconds=JOB_STALE_SECONDS)
+    stale = (
+        db.query(Job)
+        .filter(Job.status == JobStatus.RUNNING.value, Job.heartbeat_at < cutoff)
+        .all()
+    )
+    requeued = 0
+    for job in stale:
+        retry = job.attempts < job.max_attempts
+        updated = (
+            db.query(Job)
+            .filter(
+                Job.id == job.id,
+                Job.status == JobStatus.RUNNING.value,
+                Job.worker_id == job.worker_id,
+            )
+            .update(
+                {
+                    "status": (
+                        JobStatus.QUEUED.value if retry else JobStatus.FAILED.value
+                    ),
+                    "worker_id": None,
+                    "error": None if retry else "worker 中斷次數超過重試上限",
+                    "finished_at": None if retry else datetime.utcnow(),
+                },
+                synchronize_session=False,
+            )
+        )
+        db.commit()
+        requeued += updated
+    return requeued
+
+
+def claim_next_job(db: Session, worker_id: str) -> Optional[Job]:
+    """
+    領取最早的 QUEUED 工作
+
+    先選出候選 id，再以 WHERE status='QUEUED' 的 UPDATE 搶占；
+    被其他 worker 搶先時 rowcount 為 0，改試下一筆。
+    """
+    while True:
+        candidate = (
+            db.query(Job.id)
+            .filter(Job.status == JobStatus.QUEUED.value)
+            .order_by(Job.id)
+            .first()
+        )
+        if candidate is None:
+            return None
+        now = datetime.utcnow()
+        claimed = (
+            db.query(Job)
+            .filter(Job.id == candidate.id, Job.status == JobStatus.QUEUED.value)
+            .update(
+                {
+                    "status": JobStatus.RUNNING.value,
+                    "worker_id": worker_id,
+                    "attempts": Job.attempts + 1,
+                    "started_at": now,
+                    "heartbeat_at": now,
+                    "progress": 0.0,
+                },
+                synchronize_session=False,
+            )
+        )
+        db.commit()
+        if claimed:
+            return db.get(Job, candidate.id)
+
+
+def _update_owned(job_id: int, worker_id: str, values: Dict[str, Any]) -> bool:
+    """只在工作仍由此 worker 持有時更新 (被判定中斷並重新分派後不再覆寫)"""
+    db = SessionLocal()
+    try:
+        updated = (
+            db.query(Job)
+            .filter(
+                Job.id == job_id,
+                Job.worker_id == worker_id,
+                Job.status == JobStatus.RUNNING.value,
+            )
+            .update(values, synchronize_session=False)
+        )
+        db.commit()
+        return bool(updated)
+    finally:
+        db.close()
+
+
+class _Heartbeat:
+    """背景執行緒定期寫入心跳與最新進度"""
+
+    def __init__(self, job_id: int, worker_id: str):
+        self.job_id = job_id
+        self.worker_id = worker_id
+        self.progress = 0.0
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._loop, daemon=True)
+
+    def report(self, progress: float) -> None:
+        self.progress = min(max(float(progress), 0.0), 1.0)
+
+    def _loop(self) -> None:
+        while not self._stop.wait(JOB_HEARTBEAT_SECONDS):
+            try:
+                _update_owned(
+                    self.job_id,
+                    self.worker_id,
+                    {"heartbeat_at": datetime.utcnow(), "progress": self.progress},
+                )
+            except Exception:
+                # 例如 SQLite "database is locked"：下一次再寫入，執行緒不可結束，
+                # 否則工作逾時後會被重新分派而由兩個 worker 同時執行
+                logger.exception("Job %s heartbeat failed", self.job_id)
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        self._thread.join()
+
+
+def execute_job(job: Job, worker_id: str) -> JobStatus:
+    """
+    執行已領取的工作並寫回結果
+
+    ValueError (輸入錯誤) 不重試；其他例外在未達 max_attempts 前重新排入佇列。
+    """
+    kind = JobKind(job.kind)
+    handler = JOB_HANDLERS[kind][1]
+    try:
+        request = _parse_payload(kind, job.payload)
+        with _Heartbeat(job.id, worker_id) as heartbeat:
+            result = handler(request, job.user_id, heartbeat.report)
+    except ValueError as e:
+        status, values = JobStatus.FAILED, {"error": str(e)}
+    except Exception as e:
+        if job.attempts < job.max_attempts:
+            status, values = JobStatus.QUEUED, {"worker_id": None, "error": str(e)}
+        else:
+            status, values = JobStatus.FAILED, {"error": f"執行失敗: {str(e)}"}
+    else:
+        status, values = JobStatus.SUCCEEDED, {"result": result, "progress": 1.0}
+
+    values["status"] = status.value
+    if status != JobStatus.QUEUED:
+        values["finished_at"] = datetime.utcnow()
+    _update_owned(job.id, worker_id, values)
+    return status
+
+
+def run_worker(
+    worker_id: Optional[str] = None,
+    poll_interval: float = 1.0,
+    stop_event: Optional[threading.Event] = None,
+    max_jobs: Optional[int] = None,
+) -> int:
+    """
+    worker 主迴圈：回收逾時工作、領取並執行，佇列為空時等待 poll_interval 秒
+
+    未指定 worker_id 時以 worker_name() 產生 (需在執行 worker 的執行緒內呼叫)。
+
+    Returns:
+        執行過的工作數
+    """
+    worker_id = worker_id or worker_name()
+    stop_event = stop_event or threading.Event()
+    executed = 0
+    while not stop_event.is_set() and (max_jobs is None or executed < max_jobs):
+        db = SessionLocal()
+        try:
+            requeue_stale_jobs(db)
+            job = claim_next_job(db, worker_id)
+        finally:
+            db.close()
+        if job is None:
+            stop_event.wait(poll_interval)
+            continue
+        execute_job(job, worker_id)
+        executed += 1
+    return executed
+
+
+def _iso(value: Optional[datetime]) -> Optional[str]:
+    return value.isoformat() if value else None
+
+
+def job_to_info(job: Job) -> JobInfo:
+    return JobInfo(
+        id=job.id,
+        kind=job.kind,
+        status=job.status,
+        progress=round(job.progress or 0.0, 4),
+        attempts=job.attempts or 0,
+        max_attempts=job.max_attempts,
+        error=job.error,
+        created_at=_iso(job.created_at) or "",
+        started_at=_iso(job.started_at),
+        finished_at=_iso(job.finished_at),
+    )
+
+
+def worker_name() -> str:
+    """預設 worker id：主機名稱 + 行程 id + 執行緒 id"""
+    return f"{socket.gethostname()}:{os.getpid()}:{threading.get_ident()}"
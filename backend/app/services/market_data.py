@@ -0,0 +1,410 @@
+"""
+行情資料存取 - 封裝 yfinance 下載 (或本地資料檔)、行程內價格快取、週 / 月 K 重採樣
+與多股票日期對齊
+"""
+
+import itertools
+import os
+import threading
+from collections import OrderedDict
+from datetime import date, timedelta
+from typing import Dict, Iterator, List, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+import yfinance as yf
+
+from app.models.backtest import Timeframe
+from app.services.timeframes import INTRADAY_TIMEFRAMES, resample_ohlcv
+
+PRICE_CACHE_MAX_SYMBOLS = int(os.getenv("PRICE_CACHE_MAX_SYMBOLS", "512"))
+RESAMPLE_CACHE_MAX_ENTRIES = int(os.getenv("RESAMPLE_CACHE_MAX_ENTRIES", "512"))
+# 本地行情資料目錄：設定後由 <目錄>/<股票代碼>.csv (或 .parquet) 讀取，不連線 yfinance
+LOCAL_DATA_DIR = os.getenv("LOCAL_DATA_DIR", "")
+# 價格快取下載互斥的鎖數 (不同股票可能共用同一個鎖)
+_SYMBOL_LOCK_STRIPES = 64
+
+
+def _download_history(symbol: str, start_date: str, end_date: str) -> pd.DataFrame:
+    """從 yfinance 下載日 K 數據 (Date 欄為 YYYY-MM-DD 字串)"""
+    # 使用 Ticker.history() 方法 (yfinance 1.0 推薦方式)
+    try:
+        ticker = yf.Ticker(symbol)
+        df = ticker.history(
+            start=start_date,
+            end=end_date,
+            auto_adjust=True,
+        )
+    except Exception as e:
+        raise ValueError(f"無法取得 {symbol} 的數據: {str(e)}")
+
+    if df.empty:
+        raise ValueError(f"無法取得 {symbol} 的數據，請確認股票代碼是否正確")
+
+    # 處理 timezone-aware datetime
+    df = df.reset_index()
+    if hasattr(df["Date"].dtype, "tz") and df["Date"].dt.tz is not None:
+        # 移除時區信息，只保留日期
+        df["Date"] = df["Date"].dt.tz_localize(None)
+    df["Date"] = pd.to_datetime(df["Date"]).dt.strftime("%Y-%m-%d")
+
+    return df
+
+
+def _read_local_history(symbol: str, start_date: str, end_date: str) -> pd.DataFrame:
+    """
+    從 LOCAL_DATA_DIR 讀取日 K 數據 (格式同 _download_history)
+
+    檔案需有 Date、Open、High、Low、Close 欄 (Volume 可省略)。
+    """
+    base = os.path.join(LOCAL_DATA_DIR, symbol)
+    try:
+        if os.path.exists(base + ".parquet"):
+            df = pd.read_parquet(base + ".parquet")
+        elif os.path.exists(base + ".csv"):
+            df = pd.read_csv(base + ".csv")
+        else:
+            raise ValueError(f"找不到 {symbol} 的本地數據 ({base}.csv)")
+        df["Date"] = pd.to_datetime(df["Date"]).dt.strftime("%Y-%m-%d")
+    except ValueError:
+        raise
+    except Exception as e:
+        raise ValueError(f"無法讀取 {symbol} 的本地數據: {str(e)}")
+
+    df = df[(df["Date"] >= start_date) & (df["Date"] < end_date)]
+    if df.empty:
+        raise ValueError(f"本地數據中沒有 {symbol} 在 {start_date} ~ {end_date} 的資料")
+    return df.sort_values("Date").reset_index(drop=True)
+
+
+def _load_history(symbol: str, start_date: str, end_date: str) -> pd.DataFrame:
+    if LOCAL_DATA_DIR:
+        return _read_local_history(symbol, start_date, end_date)
+    return _download_history(symbol, start_date, end_date)
+
+
+# 盤中資料檔名後綴：<目錄>/<股票代碼>_1m.csv (或 .parquet)
+_INTRADAY_SUFFIX = {Timeframe.MINUTE: "1m", Timeframe.HOURLY: "1h"}
+
+
+def _read_chunks(
+    path: str, chunk_rows: int, columns: Optional[List[str]]
+) -> Iterator[pd.DataFrame]:
+    def wanted(name: str) -> bool:
+        return columns is None or name in ("Datetime", "Date", *columns)
+
+    if path.endswith(".csv"):
+        yield from pd.read_csv(path, chunksize=chunk_rows, usecols=wanted)
+        return
+    try:
+        import pyarrow.parquet as pq
+    except ImportError:
+        raise ValueError("讀取 Parquet 需要安裝 pyarrow (pip install pyarrow)")
+    parquet = pq.ParquetFile(path)
+    names = [name for name in parquet.schema_arrow.names if wanted(name)]
+    for batch in parquet.iter_batches(batch_size=chunk_rows, columns=names):
+        yield batch.to_pandas()
+
+
+def iter_intraday_bars(
+    symbol: str,
+    timeframe: Timeframe,
+    start_date: str,
+    end_date: str,
+    chunk_rows: int,
+    columns: Optional[List[str]] = None,
+) -> Iterator[pd.DataFrame]:
+    """
+    分段讀取本地盤中 K 線 (不經由價格快取，記憶體只保留一段)
+
+    檔案為 LOCAL_DATA_DIR/<股票代碼>_1m (或 _1h).csv / .parquet，依時間遞增排序，
+    時間欄為 Datetime 或 Date。每段為 [start_date, end_date) 內的 K 棒，
+    Date 欄為 "YYYY-MM-DD HH:MM" 字串 (時區資訊移除，保留當地時間)。
+    columns 指定時只讀取這些價格欄位 (空列表即只讀時間)。
+    """
+    if not LOCAL_DATA_DIR:
+        raise ValueError("盤中回測需要本地資料目錄 (LOCAL_DATA_DIR)")
+    base = os.path.join(LOCAL_DATA_DIR, f"{symbol}_{_INTRADAY_SUFFIX[timeframe]}")
+    path = next(
+        (base + ext for ext in (".parquet", ".csv") if os.path.exists(base + ext)),
+        None,
+    )
+    if path is None:
+        raise ValueError(f"找不到 {symbol} 的盤中數據 ({base}.csv)")
+
+    for chunk in _read_chunks(path, chunk_rows, columns):
+        column = "Datetime" if "Datetime" in chunk else "Date"
+        raw = chunk[column]
+        if pd.api.types.is_datetime64_any_dtype(raw):
+            if raw.dt.tz is not None:
+                raw = raw.dt.tz_localize(None)
+            stamps = raw.dt.strftime("%Y-%m-%d %H:%M")
+        else:
+            # 文字時間直接取前 16 字元 (檔案中的當地時間，略過秒數與時區)
+            stamps = raw.astype(str).str.slice(0, 16).str.replace("T", " ")
+        days = stamps.str.slice(0, 10)
+        keep = (days >= start_date) & (days < end_date)
+        if keep.any():
+            chunk = chunk.loc[keep].drop(columns=[column])
+            chunk.insert(0, "Date", stamps[keep])
+            yield chunk.reset_index(drop=True)
+        if days.iloc[-1] >= end_date:
+            return
+
+
+def use_local_data(directory: str) -> None:
+    """改由本地資料目錄提供行情 (清空已快取的價格)"""
+    global LOCAL_DATA_DIR
+    LOCAL_DATA_DIR = directory
+    price_cache.clear()
+
+
+class PriceCache:
+    """
+    行程內價格快取 (LRU)
+
+    每檔股票保存一段連續的已下載區間 [start, end)，請求超出區間時只補抓缺少的部分。
+    補抓的區間多包含一根已快取的 K 棒作為錨點：下載失敗或沒有回傳錨點時拋出
+    ValueError 且不擴大覆蓋範圍；錨點收盤價與快取不同 (期間有除權息，還原價格
+    已重新計算) 時整段重新下載，避免新舊還原基準混在同一段資料。
+    version 在資料內容改變時遞增，供結果快取判斷資料是否更新；版本號在整個快取內
+    不重複，股票被淘汰後重新下載也會取得新的版本。
+    今日的 K 棒尚未完成，只取到前一天為止：結束日在未來的請求 (回測到最新) 當天
+    只需補抓一次。下載以固定數量的鎖依股票分段互斥，鎖的數量不隨股票數增加。
+    """
+
+    def __init__(self, max_symbols: int = PRICE_CACHE_MAX_SYMBOLS):
+        self.max_symbols = max_symbols
+        self._entries: "OrderedDict[str, Dict]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._symbol_locks = [threading.Lock() for _ in range(_SYMBOL_LOCK_STRIPES)]
+        self._versions = itertools.count(1)
+
+    def _symbol_lock(self, symbol: str) -> threading.Lock:
+        return self._symbol_locks[hash(symbol) % len(self._symbol_locks)]
+
+    @staticmethod
+    def _anchored(
+        symbol: str, start: str, end: str, anchor: pd.Series
+    ) -> Optional[pd.DataFrame]:
+        """
+        下載包含錨點 K 棒的區間 (失敗時拋出 ValueError)
+
+        Returns:
+            下載的數據；錨點收盤價與快取不一致時為 None
+        """
+        df = _load_history(symbol, start, end)
+        matched = df.loc[df["Date"] == anchor["Date"], "Close"]
+        if matched.empty or not np.isclose(matched.iloc[0], anchor["Close"], rtol=1e-6):
+            return None
+        return df
+
+    def get(self, symbol: str, start_date: str, end_date: str) -> pd.DataFrame:
+        """取得 [start_date, end_date) 的數據副本，必要時補抓缺少的區間"""
+        # 最後一根已完成的 K 棒為昨天 (區間不含 end)
+        end_date = min(end_date, date.today().isoformat())
+
+        with self._symbol_lock(symbol):
+            with self._lock:
+                entry = self._entries.get(symbol)
+                if entry is not None:
+                    self._entries.move_to_end(symbol)
+
+            if entry is None:
+                df = _load_history(symbol, start_date, end_date)
+                entry = {
+                    "df": df,
+                    "start": start_date,
+                    "end": end_date,
+                    "version": next(self._versions),
+                }
+            elif start_date < entry["start"] or end_date > entry["end"]:
+                cached = entry["df"]
+                first, last = cached.iloc[0], cached.iloc[-1]
+                new_start = min(start_date, entry["start"])
+                new_end = max(end_date, entry["end"])
+                parts = [cached]
+                if start_date < entry["start"]:
+                    after_first = date.fromisoformat(first["Date"]) + timedelta(days=1)
+                    parts.insert(
+                        0,
+                        self._anchored(
+                            symbol, start_date, after_first.isoformat(), first
+                        ),
+                    )
+                if end_date > entry["end"]:
+                    parts.append(self._anchored(symbol, last["Date"], end_date, last))
+
+                if any(part is None for part in parts):
+                    merged = _load_history(symbol, new_start, new_end)
+                else:
+                    merged = pd.concat(parts, ignore_index=True)
+                    merged = merged.drop_duplicates(subset="Date", keep="last")
+                    merged = merged.sort_values("Date").reset_index(drop=True)
+                entry = {
+                    "df": merged,
+                    "start": new_start,
+                    "end": new_end,
+                    "version": (
+                        entry["version"]
+                        if merged.equals(cached)
+                        else next(self._versions)
+                    ),
+                }
+
+            with self._lock:
+                self._entries[symbol] = entry
+                self._entries.move_to_end(symbol)
+                while len(self._entries) > self.max_symbols:
+                    self._entries.popitem(last=False)
+
+        df = entry["df"]
+        sliced = df[(df["Date"] >= start_date) & (df["Date"] < end_date)]
+        if sliced.empty:
+            raise ValueError(f"無法取得 {symbol} 的數據，請確認股票代碼是否正確")
+        return sliced.reset_index(drop=True).copy()
+
+    def version(self, symbol: str) -> int:
+        """目前快取中該股票的資料版本 (未快取為 0)"""
+        with self._lock:
+            entry = self._entries.get(symbol)
+            return entry["version"] if entry else 0
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+
+
+price_cache = PriceCache()
+
+
+class ResampleCache:
+    """
+    週 / 月 K 快取 (LRU)
+
+    以 (股票, 週期, 起訖日) 為鍵，記錄重採樣時的日 K 版本；日 K 補入新資料
+    (版本改變) 後重新重採樣。日 K 仍經由 price_cache 取得 (必要時補抓)。
+    """
+
+    def __init__(self, max_entries: int = RESAMPLE_CACHE_MAX_ENTRIES):
+        self.max_entries = max_entries
+        self._entries: "OrderedDict[Tuple, Dict]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(
+        self, symbol: str, start_date: str, end_date: str, timeframe: Timeframe
+    ) -> pd.DataFrame:
+        daily = price_cache.get(symbol, start_date, end_date)
+        version = price_cache.version(symbol)
+        key = (symbol, timeframe, start_date, end_date)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry["version"] == version:
+                self._entries.move_to_end(key)
+                return entry["df"].copy()
+
+        df = resample_ohlcv(daily, timeframe)
+        if self.max_entries > 0:
+            with self._lock:
+                self._entries[key] = {"df": df, "version": version}
+                self._entries.move_to_end(key)
+                while len(self._entries) > self.max_entries:
+                    self._entries.popitem(last=False)
+        return df.copy()
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+
+
+resample_cache = ResampleCache()
+
+
+def fetch_history(
+    symbol: str,
+    start_date: str,
+    end_date: str,
+    timeframe: Timeframe = Timeframe.DAILY,
+) -> pd.DataFrame:
+    """
+    取得單一股票的 K 線數據 (經由價格快取，回傳可自由修改的副本)
+
+    timeframe 為 WEEKLY / MONTHLY 時回傳由日 K 重採樣的週 / 月 K (經由重採樣快取)。
+    盤中週期不一次載入，需以 iter_intraday_bars 分段讀取。
+    """
+    if timeframe in INTRADAY_TIMEFRAMES:
+        raise ValueError("分 K / 小時 K 只支援串流回測 (POST /api/backtest/run)")
+    if timeframe == Timeframe.DAILY:
+        return price_cache.get(symbol, start_date, end_date)
+    return resample_cache.get(symbol, start_date, end_date, timeframe)
+
+
+def fetch_aligned_ohlc(
+    symbols: List[str], start_date: str, end_date: str
+) -> Tuple[List[str], Dict[str, np.ndarray]]:
+    """
+    批次取得多檔股票的 OHLC 並以共同交易日對齊
+
+    Returns:
+        (dates, {欄位: (Days, Stocks) 矩陣})，欄位順序同 symbols；
+        Open / High / Low 只在所有股票都有該欄時提供，Close 一定提供
+    """
+    if not symbols:
+        raise ValueError("至少需要一檔股票")
+
+    frames = {}
+    common_dates = None
+    for symbol in symbols:
+        if symbol in frames:
+            continue
+        df = fetch_history(symbol, start_date, end_date).set_index("Date")
+        df = df[~df.index.duplicated(keep="last")]
+        frames[symbol] = df
+        if common_dates is None:
+            common_dates = df.index
+        else:
+            common_dates = common_dates.intersection(df.index)
+
+    if common_dates is None or len(common_dates) == 0:
+        raise ValueError("No overlapping dates found for the selected stocks")
+
+    common_dates = common_dates.sort_values()
+    columns = [
+        col
+        for col in ("Open", "High", "Low", "Close")
+        if col == "Close" or all(col in df for df in frames.values())
+    ]
+    matrices = {
+        col: np.column_stack(
+            [frames[s].loc[common_dates, col].to_numpy(dtype=float) for s in symbols]
+        )
+        for col in columns
+    }
+    return common_dates.tolist(), matrices
+
+
+def fetch_aligned_closes(
+    symbols: List[str], start_date: str, end_date: str
+) -> Tuple[List[str], np.ndarray]:
+    """
+    批次取得多檔股票收盤價並以共同交易日對齊
+
+    Returns:
+        (dates, price_matrix)，price_matrix 形狀為 (Days, Stocks)，欄位順序同 symbols
+    """
+    dates, matrices = fetch_aligned_ohlc(symbols, start_date, end_date)
+    return dates, matrices["Close"]
+
+
+def fetch_closes_on(
+    symbol: str, dates: List[str], start_date: str, end_date: str
+) -> np.ndarray:
+    """
+    取得單一股票在指定交易日上的收盤價 (供基準比較使用)
+
+    缺少的交易日沿用前一筆收盤價，dates 開頭之前沒有資料的日期為 NaN。
+    """
+    df = fetch_history(symbol, start_date, end_date)
+    series = df.drop_duplicates(subset="Date", keep="last").set_index("Date")["Close"]
+    combined = series.reindex(series.index.union(dates)).sort_index().ffill()
+    return combined.reindex(dates).to_numpy(dtype=float)
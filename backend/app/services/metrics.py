@@ -0,0 +1,406 @@
+"""
+績效指標核心 - 以 numpy 從權益曲線一次計算所有摘要指標
+
+所有回測引擎與最佳化器共用此模組；equity 可為單一曲線 (Days,) 或
+批次曲線 (Days, N)，批次時每個指標回傳長度 N 的陣列。
+"""
+
+import warnings
+from typing import Dict, List, Optional, Sequence
+
+import numpy as np
+
+from app.models.backtest import BacktestSummary, RollingSeries
+from app.services.indicators import rolling_max, rolling_mean, rolling_std
+
+TRADING_DAYS_PER_YEAR = 252
+RISK_FREE_RATE = 0.02  # 夏普比率使用的年化無風險利率
+
+
+def _clean_float(val) -> float:
+    if val is None:
+        return 0.0
+    if np.isnan(val) or np.isinf(val):
+        return 0.0
+    return float(val)
+
+
+METRIC_KEYS = (
+    "total_return",
+    "annualized_return",
+    "sharpe_ratio",
+    "max_drawdown",
+    "sortino_ratio",
+    "calmar_ratio",
+    "ulcer_index",
+    "max_drawdown_duration",
+    "time_under_water",
+    "volatility",
+    "skewness",
+    "tail_ratio",
+)
+
+
+def _daily_returns(eq: np.ndarray) -> np.ndarray:
+    """逐日報酬 (長度少 1)，前一日權益為 0 或缺值時為 NaN"""
+    prev = eq[:-1]
+    with np.errstate(divide="ignore", invalid="ignore"):
+        return np.where(prev != 0, (eq[1:] - prev) / prev, np.nan)
+
+
+def _safe_div(numerator: np.ndarray, denominator: np.ndarray) -> np.ndarray:
+    """分母為 0 時回傳 0"""
+    ok = denominator != 0
+    return np.where(ok, numerator / np.where(ok, denominator, 1.0), 0.0)
+
+
+def compute_metrics(
+    equity: np.ndarray,
+    base_capital,
+    final_value=None,
+    periods_per_year: int = TRADING_DAYS_PER_YEAR,
+    risk_free_rate: float = RISK_FREE_RATE,
+) -> Dict[str, np.ndarray]:
+    """
+    從權益曲線一次計算所有績效與風險指標
+
+    日報酬、離差與回撤序列只計算一次，各指標共用這些中間結果。
+
+    Args:
+        equity: (Days,) 或 (Days, N) 權益曲線
+        base_capital: 報酬率計算基準 (總投入本金)，純量或 (N,)
+        final_value: 期末價值，預設為權益曲線最後一筆 (DCA 以持股市值計算時傳入)
+        periods_per_year: 每年期數 (年化與夏普比率使用)
+        risk_free_rate: 年化無風險利率
+
+    Returns:
+        METRIC_KEYS 對應的指標 (報酬、回撤、波動度為百分比，回撤期間為交易日數)，
+        單一曲線時為 float，批次時為 (N,) 陣列
+    """
+    single = np.ndim(equity) == 1
+    eq = np.asarray(equity, dtype=float)
+    if single:
+        eq = eq[:, None]
+    n_days, n_cols = eq.shape
+
+    if n_days == 0:
+        result = {key: np.zeros(n_cols) for key in METRIC_KEYS}
+        return {k: float(v[0]) for k, v in result.items()} if single else result
+
+    base = np.broadcast_to(np.asarray(base_capital, dtype=float), (n_cols,))
+    final = (
+        eq[-1]
+        if final_value is None
+        else np.broadcast_to(np.asarray(final_value, dtype=float), (n_cols,))
+    )
+    has_base = base > 0
+    safe_base = np.where(has_base, base, 1.0)
+
+    # 總報酬率與年化報酬率
+    total_return = np.where(has_base, (final - base) / safe_base * 100, 0.0)
+    years = n_days / periods_per_year
+    ratio = final / safe_base
+    with np.errstate(invalid="ignore", over="ignore"):
+        growth = (np.where(ratio > 0, ratio, 1.0) ** (1 / years) - 1) * 100
+    annualized_return = np.where(
+        has_base & (years > 0), np.where(ratio > 0, growth, -100.0), 0.0
+    )
+
+    # 日報酬 (前一日權益為 0 的期間略過)
+    returns = _daily_returns(eq)
+    valid = np.isfinite(returns)
+    count = valid.sum(axis=0)
+    safe_count = np.maximum(count, 1)
+
+    # 日報酬的一階、二階、三階動差 (兩段式計算，避免常數報酬產生數值誤差)
+    daily_rf = risk_free_rate / periods_per_year
+    raw_mean = np.where(valid, returns, 0.0).sum(axis=0) / safe_count
+    mean = raw_mean - daily_rf  # 平均超額報酬
+    deviation = np.where(valid, returns - raw_mean, 0.0)
+    sq_deviation = deviation * deviation
+    std = np.sqrt(sq_deviation.sum(axis=0) / np.maximum(count - 1, 1))
+    annualizer = np.sqrt(periods_per_year)
+
+    sharpe_ratio = np.where(count > 1, _safe_div(mean, std) * annualizer, 0.0)
+    volatility = np.where(count > 1, std * annualizer * 100, 0.0)
+
+    # 偏態 (調整後 Fisher-Pearson，同 pandas.Series.skew)
+    m2 = sq_deviation.sum(axis=0) / safe_count
+    m3 = (sq_deviation * deviation).sum(axis=0) / safe_count
+    with np.errstate(invalid="ignore"):
+        adjust = np.sqrt(count * (count - 1.0)) / np.maximum(count - 2.0, 1.0)
+    skewness = np.where(count > 2, _safe_div(m3, m2**1.5) * adjust, 0.0)
+
+    # 索提諾比率 (只以低於無風險報酬的部分計算下檔風險)
+    downside = np.where(valid, np.minimum(returns - daily_rf, 0.0), 0.0)
+    downside_dev = np.sqrt((downside * downside).sum(axis=0) / safe_count)
+    sortino_ratio = np.where(
+        (count > 1) & (std > 0), _safe_div(mean, downside_dev) * annualizer, 0.0
+    )
+
+    # 尾部比率 (第 95 百分位報酬 / 第 5 百分位報酬的絕對值)
+    if count.any():
+        with np.errstate(invalid="ignore"), warnings.catch_warnings():
+            warnings.simplefilter("ignore", RuntimeWarning)
+            low, high = np.nanpercentile(
+                np.where(valid, returns, np.nan), [5, 95], axis=0
+            )
+        tail_ratio = np.nan_to_num(_safe_div(high, np.abs(low)))
+    else:
+        tail_ratio = np.zeros(n_cols)
+
+    # 回撤序列 (只在歷史高點 > 0 時計算)
+    peak = np.maximum.accumulate(eq, axis=0)
+    drawdown = np.where(peak > 0, (eq - peak) / np.where(peak > 0, peak, 1.0), 0.0)
+    max_drawdown = drawdown.min(axis=0) * 100
+    ulcer_index = np.sqrt((drawdown * drawdown).mean(axis=0)) * 100
+    calmar_ratio = _safe_div(annualized_return, np.abs(max_drawdown))
+
+    # 水下期間：距離上一次創高 (或未回撤) 的交易日數
+    underwater = drawdown < 0
+    bars = np.arange(n_days)[:, None]
+    last_high = np.maximum.accumulate(np.where(underwater, -1, bars), axis=0)
+    max_drawdown_duration = np.where(underwater, bars - last_high, 0).max(axis=0)
+    time_under_water = underwater.mean(axis=0) * 100
+
+    result = {
+        "total_return": total_return,
+        "annualized_return": annualized_return,
+        "sharpe_ratio": sharpe_ratio,
+        "max_drawdown": max_drawdown,
+        "sortino_ratio": sortino_ratio,
+        "calmar_ratio": calmar_ratio,
+        "ulcer_index": ulcer_index,
+        "max_drawdown_duration": max_drawdown_duration,
+        "time_under_water": time_under_water,
+        "volatility": volatility,
+        "skewness": skewness,
+        "tail_ratio": tail_ratio,
+    }
+    if single:
+        return {k: float(v[0]) for k, v in result.items()}
+    return result
+
+
+def trade_statistics(pnls: Sequence[Optional[float]]) -> Dict[str, float]:
+    """
+    交易統計 (勝率、平均獲利/虧損)
+
+    pnls 為每筆列入統計的交易損益；損益為 0 或 None 的交易計入總數但不算獲利或虧損。
+    """
+    values = np.array([p if p is not None else 0.0 for p in pnls], dtype=float)
+    profits = values[values > 0]
+    losses = values[values < 0]
+    total = len(values)
+    return {
+        "total_trades": total,
+        "profit_trades": len(profits),
+        "loss_trades": len(losses),
+        "win_rate": len(profits) / total * 100 if total > 0 else 0.0,
+        "avg_profit": profits.mean() if len(profits) else 0.0,
+        "avg_loss": losses.mean() if len(losses) else 0.0,
+    }
+
+
+def build_summary(
+    metrics: Dict[str, float],
+    pnls: Sequence[Optional[float]],
+    total_cost: float,
+    stats: Optional[Dict[str, float]] = None,
+) -> BacktestSummary:
+    """
+    組合權益指標與交易統計為 BacktestSummary (數值四捨五入至小數 2 位)
+
+    stats 為已彙總的交易統計 (格式同 trade_statistics) 時不使用 pnls。
+    """
+    if stats is None:
+        stats = trade_statistics(pnls)
+    return BacktestSummary(
+        total_return=round(_clean_float(metrics["total_return"]), 2),
+        annualized_return=round(_clean_float(metrics["annualized_return"]), 2),
+        sharpe_ratio=round(_clean_float(metrics["sharpe_ratio"]), 2),
+        max_drawdown=round(_clean_float(metrics["max_drawdown"]), 2),
+        win_rate=round(_clean_float(stats["win_rate"]), 2),
+        total_trades=stats["total_trades"],
+        profit_trades=stats["profit_trades"],
+        loss_trades=stats["loss_trades"],
+        avg_profit=round(_clean_float(stats["avg_profit"]), 2),
+        avg_loss=round(_clean_float(stats["avg_loss"]), 2),
+        total_cost=round(_clean_float(total_cost), 2),
+        sortino_ratio=round(_clean_float(metrics["sortino_ratio"]), 2),
+        calmar_ratio=round(_clean_float(metrics["calmar_ratio"]), 2),
+        ulcer_index=round(_clean_float(metrics["ulcer_index"]), 2),
+        max_drawdown_duration=int(_clean_float(metrics["max_drawdown_duration"])),
+        time_under_water=round(_clean_float(metrics["time_under_water"]), 2),
+        volatility=round(_clean_float(metrics["volatility"]), 2),
+        skewness=round(_clean_float(metrics["skewness"]), 2),
+        tail_ratio=round(_clean_float(metrics["tail_ratio"]), 2),
+    )
+
+
+def compute_benchmark_metrics(
+    equity: np.ndarray,
+    benchmark: np.ndarray,
+    periods_per_year: int = TRADING_DAYS_PER_YEAR,
+    risk_free_rate: float = RISK_FREE_RATE,
+) -> Dict[str, np.ndarray]:
+    """
+    相對基準的 alpha、beta、追蹤誤差、資訊比率與相對權益
+
+    策略與基準的日報酬堆疊後一次計算 (只使用兩者皆有效的交易日)；
+    equity 可為 (Days,) 或 (Days, N)，benchmark 為同長度的 (Days,) 價格或權益序列。
+    相對權益以逐日報酬比連乘 (與夏普比率相同，日報酬包含定期投入造成的權益變動)。
+
+    Returns:
+        {"alpha" (年化 %), "beta", "tracking_error" (年化 %), "information_ratio",
+         "benchmark_return" (%), "relative_equity" (Days,) 或 (Days, N)}
+    """
+    single = np.ndim(equity) == 1
+    eq = np.asarray(equity, dtype=float)
+    if single:
+        eq = eq[:, None]
+    bench = np.asarray(benchmark, dtype=float).reshape(-1, 1)
+    n_days, n_cols = eq.shape
+
+    returns = _daily_returns(np.hstack([eq, bench]))
+    strategy, market = returns[:, :n_cols], returns[:, n_cols:]
+    valid = np.isfinite(strategy) & np.isfinite(market)
+    count = valid.sum(axis=0)
+    safe_count = np.maximum(count, 1)
+
+    strategy = np.where(valid, strategy, 0.0)
+    market = np.where(valid, market, 0.0)
+    active = strategy - market
+
+    strategy_mean = strategy.sum(axis=0) / safe_count
+    market_mean = market.sum(axis=0) / safe_count
+    active_mean = strategy_mean - market_mean
+    market_dev = np.where(valid, market - market_mean, 0.0)
+    strategy_dev = np.where(valid, strategy - strategy_mean, 0.0)
+    active_dev = np.where(valid, active - active_mean, 0.0)
+    dof = np.maximum(count - 1, 1)
+
+    beta = _safe_div(
+        (strategy_dev * market_dev).sum(axis=0), (market_dev**2).sum(axis=0)
+    )
+    daily_rf = risk_free_rate / periods_per_year
+    alpha = (
+        ((strategy_mean - daily_rf) - beta * (market_mean - daily_rf))
+        * periods_per_year
+        * 100
+    )
+    active_std = np.sqrt((active_dev**2).sum(axis=0) / dof)
+    annualizer = np.sqrt(periods_per_year)
+    has_data = count > 1
+
+    # 相對權益：(1 + 策略報酬) / (1 + 基準報酬) 連乘
+    relative = np.ones((n_days, n_cols))
+    relative[1:] = np.cumprod((1 + strategy) / (1 + market), axis=0)
+
+    valid_bench = bench[np.isfinite(bench[:, 0]) & (bench[:, 0] > 0), 0]
+    benchmark_return = (
+        (valid_bench[-1] / valid_bench[0] - 1) * 100 if len(valid_bench) else 0.0
+    )
+
+    result = {
+        "alpha": np.where(has_data, alpha, 0.0),
+        "beta": np.where(has_data, beta, 0.0),
+        "tracking_error": np.where(has_data, active_std * annualizer * 100, 0.0),
+        "information_ratio": np.where(
+            has_data, _safe_div(active_mean, active_std) * annualizer, 0.0
+        ),
+        "benchmark_return": np.full(n_cols, benchmark_return),
+        "relative_equity": relative,
+    }
+    if single:
+        return {
+            k: v[:, 0] if k == "relative_equity" else float(v[0])
+            for k, v in result.items()
+        }
+    return result
+
+
+def summarize_equity(
+    equity: np.ndarray,
+    base_capital: float,
+    pnls: Sequence[Optional[float]],
+    total_cost: Optional[float] = None,
+    final_value: Optional[float] = None,
+    periods_per_year: int = TRADING_DAYS_PER_YEAR,
+) -> BacktestSummary:
+    """單一權益曲線的完整績效摘要"""
+    metrics = compute_metrics(
+        equity, base_capital, final_value=final_value, periods_per_year=periods_per_year
+    )
+    return build_summary(
+        metrics, pnls, base_capital if total_cost is None else total_cost
+    )
+
+
+def compute_rolling_metrics(
+    equity: np.ndarray,
+    window: int,
+    periods_per_year: int = TRADING_DAYS_PER_YEAR,
+    risk_free_rate: float = RISK_FREE_RATE,
+) -> Dict[str, np.ndarray]:
+    """
+    滾動視窗的夏普比率、年化波動度 (%) 與相對視窗內高點的回撤 (%)
+
+    全部以滾動加總 / 滾動最大值計算 (O(n))，與視窗長度無關；
+    equity 可為 (Days,) 或 (Days, N)，暖機期與含無效報酬的視窗為 NaN。
+    """
+    eq = np.asarray(equity, dtype=float)
+    # 報酬對齊到當日 (第一天沒有報酬)
+    returns = np.concatenate([np.full((1,) + eq.shape[1:], np.nan), _daily_returns(eq)])
+
+    annualizer = np.sqrt(periods_per_year)
+    mean = rolling_mean(returns - risk_free_rate / periods_per_year, window)
+    std = rolling_std(returns, window)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        sharpe = np.where(
+            std > 0, mean / std * annualizer, np.where(np.isnan(std), np.nan, 0.0)
+        )
+        peak = rolling_max(eq, window)
+        drawdown = np.where(
+            peak > 0, (eq - peak) / peak * 100, np.where(np.isnan(peak), np.nan, 0.0)
+        )
+
+    return {
+        "sharpe": sharpe,
+        "volatility": std * annualizer * 100,
+        "drawdown": drawdown,
+    }
+
+
+def build_rolling_series(
+    equity: Sequence[float],
+    windows: Sequence[int],
+    periods_per_year: int = TRADING_DAYS_PER_YEAR,
+) -> List[RollingSeries]:
+    """
+    依視窗長度產生可存放在 equity_data 的精簡滾動指標
+
+    暖機期不儲存，以 start 記錄第一筆數值對應的日期索引。
+    """
+    eq = np.asarray(equity, dtype=float)
+    series = []
+    for window in sorted(set(windows)):
+        if window < 2 or window > len(eq):
+            continue
+        rolling = compute_rolling_metrics(eq, window, periods_per_year)
+        defined = ~np.isnan(rolling["sharpe"])
+        start = int(np.argmax(defined)) if defined.any() else len(eq)
+        series.append(
+            RollingSeries(
+                window=window,
+                start=start,
+                **{
+                    key: [
+                        None if np.isnan(v) else round(float(v), 4)
+                        for v in values[start:]
+                    ]
+                    for key, values in rolling.items()
+                },
+            )
+        )
+    return series
@@ -0,0 +1,475 @@
+"""
+參數最佳化 - 批次網格搜尋與 walk-forward 分析
+
+網格中每組參數是價格矩陣的一欄，所有組合在批次核心中一次模擬，
+再以績效指標核心一次計算每欄的報酬與夏普比率。
+"""
+
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import ExitStack
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+import numpy as np
+
+from app.core.cancellation import CancellationToken
+from app.models.backtest import (
+    BacktestRequest,
+    EquityData,
+    OptimizeRequest,
+    OptimizeResult,
+    OptimizeTarget,
+    StrategyType,
+    WalkForwardFold,
+    WalkForwardRequest,
+    WalkForwardResult,
+)
+from app.services.batch_kernel import simulate_long_only
+from app.services.metrics import _clean_float, compute_metrics, summarize_equity
+from app.services.price_bars import PriceBars, total_invested
+from app.services.stops import StopRules
+from app.services.strategy_dsl import ExpressionEvaluator
+from app.services.strategy_registry import STRATEGIES, build_signal_matrix
+from app.services.timeframes import periods_per_year
+
+WALK_FORWARD_MAX_WORKERS = int(
+    os.getenv("WALK_FORWARD_MAX_WORKERS", str(os.cpu_count() or 1))
+)
+
+# 串流/背景工作分批執行網格時，第一批的組合數與之後每批的目標秒數
+GRID_FIRST_BATCH = int(os.getenv("GRID_FIRST_BATCH", "8"))
+GRID_BATCH_SECONDS = float(os.getenv("GRID_BATCH_SECONDS", "0.25"))
+
+# (heatmap x 索引, y 索引, param1, param2)
+GridCell = Tuple[int, int, int, Optional[int]]
+
+
+def _param_values(value_range: Optional[List[int]], step: Optional[int]) -> List[int]:
+    if not value_range or len(value_range) != 2:
+        return []
+    return list(range(value_range[0], value_range[1] + 1, step or 1))
+
+
+def grid_cells(
+    strategy_type: StrategyType, param1_values: List[int], param2_values: List[int]
+) -> List[GridCell]:
+    """
+    列出有效的參數組合
+
+    網格參數由策略註冊表宣告；ordered_grid 的策略 param2 必須大於 param1。
+    """
+    spec = STRATEGIES.get(strategy_type)
+    if spec is None or spec.grid is None:
+        raise ValueError(f"{strategy_type.value} 策略不支援參數網格最佳化")
+    if not param1_values:
+        raise ValueError("param1_range 需為 [min, max]")
+    if spec.grid[1] is None or (not spec.ordered_grid and not param2_values):
+        return [(i, 0, p1, None) for i, p1 in enumerate(param1_values)]
+    return [
+        (i, j, p1, p2)
+        for i, p1 in enumerate(param1_values)
+        for j, p2 in enumerate(param2_values)
+        if p2 > p1 or not spec.ordered_grid
+    ]
+
+
+def grid_signals(
+    base: BacktestRequest,
+    close: np.ndarray,
+    cells: List[GridCell],
+    evaluator: Optional[ExpressionEvaluator] = None,
+) -> np.ndarray:
+    """
+    每組參數一欄的訊號矩陣 (Days, Cells)
+
+    所有組合共用同一個 evaluator，相同的指標 (例如 MA_CROSS 中相同週期的均線)
+    只計算一次；分批執行時傳入同一個 evaluator 即可跨批次共用。
+    """
+    spec = STRATEGIES[base.strategy_type]
+    field1, field2 = spec.grid
+    evaluator = evaluator or ExpressionEvaluator({"close": close})
+    columns = []
+    for _, _, p1, p2 in cells:
+        values = {field1: p1}
+        if field2 is not None and p2 is not None:
+            values[field2] = p2
+        columns.append(
+            build_signal_matrix(spec.with_params(base, values), close, evaluator)
+        )
+    return np.column_stack(columns)
+
+
+def evaluate_grid(
+    base: BacktestRequest,
+    bars: PriceBars,
+    cells: List[GridCell],
+    injections: Optional[np.ndarray] = None,
+    evaluator: Optional[ExpressionEvaluator] = None,
+):
+    """
+    以批次核心一次模擬所有參數組合 (停損/停利以 bars 的盤中價判斷)
+
+    未傳入 evaluator 時以 bars 建立。
+
+    Returns:
+        (metrics, kernel)，metrics 每個指標為 (Cells,) 陣列
+    """
+    close = bars.close
+    signals = grid_signals(base, close, cells, evaluator or bars.evaluator())
+    prices = np.repeat(close[:, None], len(cells), axis=1)
+    kernel = simulate_long_only(
+        prices,
+        signals,
+        base.initial_capital,
+        injections=injections,
+        sell_ratio=base.sell_ratio,
+        record_trades=False,
+        stops=StopRules.from_request(base),
+        **bars.ohlc(),
+    )
+    metrics = compute_metrics(
+        kernel.equity,
+        total_invested(base.initial_capital, injections),
+        periods_per_year=periods_per_year(base.timeframe),
+    )
+    return metrics, kernel
+
+
+def _best_index(metrics, target: OptimizeTarget) -> int:
+    key = "total_return" if target == OptimizeTarget.ROI else "sharpe_ratio"
+    return int(np.argmax(metrics[key]))
+
+
+def _heatmap_value(value) -> float:
+    # 與 BacktestSummary 相同先取到小數 2 位，再取 1 位
+    return round(round(_clean_float(value), 2), 1)
+
+
+class GridSweep:
+    """
+    可分批執行的參數網格 (供串流進度、背景工作回報進度與取消使用)
+
+    每批取下一段參數組合交給批次核心，所有批次共用同一個 evaluator，
+    指標不會重複計算。未指定批次大小時依已量測的速度調整，使每批約耗時
+    GRID_BATCH_SECONDS；第一批固定為少量組合，讓前端盡快看到部分結果。
+    提供 token 時每批計入 K 棒評估數，token 要求停止後不再執行新的批次。
+    """
+
+    def __init__(
+        self, request: OptimizeRequest, token: Optional[CancellationToken] = None
+    ):
+        self.token = token
+        self.param1_values = _param_values(request.param1_range, request.param1_step)
+        self.param2_values = _param_values(request.param2_range, request.param2_step)
+        self.cells = grid_cells(
+            request.strategy_type, self.param1_values, self.param2_values
+        )
+        if any(cell[3] is None for cell in self.cells):
+            self.param2_values = []
+        if not self.cells:
+            raise ValueError("沒有有效的參數組合 (param2 必須大於 param1)")
+
+        self.base = BacktestRequest(
+            strategy_name="Optimize",
+            stock_symbol=request.stock_symbol,
+            start_date=request.start_date,
+            end_date=request.end_date,
+            strategy_type=request.strategy_type,
+            timeframe=request.timeframe,
+            buy_expression=request.buy_expression,
+            sell_expression=request.sell_expression,
+            expression_params=request.expression_params,
+            stop_loss=request.stop_loss,
+            take_profit=request.take_profit,
+            trailing_stop=request.trailing_stop,
+            stop_intrabar=request.stop_intrabar,
+        )
+        self.bars = PriceBars.fetch(self.base)
+        self.injections = self.bars.injections(self.base)
+        self.evaluator = self.bars.evaluator()
+        self.returns = np.full(len(self.cells), np.nan)
+        self.sharpes = np.full(len(self.cells), np.nan)
+        self.done = 0
+        self.elapsed = 0.0
+
+    @property
+    def total(self) -> int:
+        return len(self.cells)
+
+    @property
+    def finished(self) -> bool:
+        return self.done >= self.total
+
+    @property
+    def stopped(self) -> bool:
+        """token 要求停止 (至少完成一批後才生效，確保有部分結果可回傳)"""
+        return self.done > 0 and self.token is not None and self.token.should_stop()
+
+    def next_batch_size(self) -> int:
+        remaining = self.total - self.done
+        if self.done == 0 or self.elapsed <= 0:
+            size = min(GRID_FIRST_BATCH, remaining)
+        else:
+            rate = self.done / self.elapsed
+            size = int(min(max(rate * GRID_BATCH_SECONDS, 1), remaining))
+        if self.token is not None:
+            size = self.token.batch_limit(size, len(self.bars))
+        return size
+
+    def run_batch(self, size: Optional[int] = None) -> List[List[Any]]:
+        """
+        執行下一批參數組合
+
+        Returns:
+            本批完成的熱力圖格 [[x, y, value], ...]
+        """
+        size = size or self.next_batch_size()
+        start = self.done
+        batch = self.cells[start : start + size]
+        if not batch:
+            return []
+        began = time.perf_counter()
+        metrics, _ = evaluate_grid(
+            self.base, self.bars, batch, self.injections, self.evaluator
+        )
+        self.returns[start : start + len(batch)] = metrics["total_return"]
+        self.sharpes[start : start + len(batch)] = metrics["sharpe_ratio"]
+        self.done += len(batch)
+        self.elapsed += time.perf_counter() - began
+        if self.token is not None:
+            self.token.charge(len(batch) * len(self.bars))
+        return [
+            [i, j, _heatmap_value(v)]
+            for (i, j, _, _), v in zip(batch, metrics["total_return"])
+        ]
+
+    def run(self, progress: Optional[Callable[[float], None]] = None) -> OptimizeResult:
+        """
+        執行剩餘的組合直到完成或 token 要求停止
+
+        沒有 token 時一次執行全部組合；progress 在每批完成後以完成比例呼叫。
+        """
+        while not self.finished and not self.stopped:
+            self.run_batch(None if self.token else self.total - self.done)
+            if progress is not None:
+                progress(self.done / self.total)
+        return self.result()
+
+    def eta(self) -> Optional[float]:
+        """預估剩餘秒數 (尚未完成任何一批時為 None)"""
+        if self.done == 0:
+            return None
+        return self.elapsed / self.done * (self.total - self.done)
+
+    def best(self) -> Optional[Dict[str, Any]]:
+        """目前已完成組合中總報酬率最高者"""
+        if self.done == 0:
+            return None
+        best = int(np.argmax(self.returns[: self.done]))
+        return {
+            "param1": self.cells[best][2],
+            "param2": self.cells[best][3],
+            "return": round(_clean_float(self.returns[best]), 2),
+            "sharpe": round(_clean_float(self.sharpes[best]), 2),
+        }
+
+    def result(self) -> OptimizeResult:
+        """目前已完成組合的最佳化結果 (未完成的組合在熱力圖中為 None，truncated=True)"""
+        if self.done == 0:
+            raise ValueError("尚未完成任何參數組合")
+        values = {
+            (i, j): _heatmap_value(v)
+            for (i, j, _, _), v in zip(self.cells[: self.done], self.returns)
+        }
+        heatmap_data = [
+            [i, j, values.get((i, j))]
+            for i in range(len(self.param1_values))
+            for j in range(max(len(self.param2_values), 1))
+        ]
+        best = self.best()
+        return OptimizeResult(
+            best_param1=best["param1"],
+            best_param2=best["param2"],
+            best_return=best["return"],
+            best_sharpe=best["sharpe"],
+            heatmap_data=heatmap_data,
+            x_labels=self.param1_values,
+            y_labels=self.param2_values or None,
+            truncated=not self.finished,
+        )
+
+
+def optimize_parameter_grid(
+    request: OptimizeRequest, token: Optional[CancellationToken] = None
+) -> OptimizeResult:
+    """
+    技術分析策略的參數網格最佳化 (以總報酬率挑選最佳組合)
+
+    與逐一執行 BacktestEngine 的結果相同 (含預設的定期投入)，但所有組合一次模擬。
+    熱力圖中無效的組合 (param2 <= param1) 以 None 表示。提供 token 時分批執行，
+    取消或超過預算即回傳已完成組合中的最佳結果。
+    """
+    return GridSweep(request, token).run()
+
+
+def walk_forward_folds(
+    n_days: int, train_bars: int, test_bars: int, anchored: bool
+) -> List[Tuple[int, int, int, int]]:
+    """切出 (train_start, train_end, test_start, test_end) 索引 (右端不含)"""
+    folds = []
+    test_start = train_bars
+    while test_start < n_days:
+        test_end = min(test_start + test_bars, n_days)
+        train_start = 0 if anchored else test_start - train_bars
+        folds.append((train_start, test_start, test_start, test_end))
+        test_start = test_end
+    return folds
+
+
+def _run_fold(
+    base: BacktestRequest,
+    bars: PriceBars,
+    cells: List[GridCell],
+    bounds: Tuple[int, int, int, int],
+    target: OptimizeTarget,
+):
+    """
+    單一 fold：訓練窗以批次網格挑參數，再於測試窗樣本外模擬
+
+    測試窗的指標以訓練窗資料暖機，因此訊號在測試窗第一天即可使用。
+    可在子行程中執行 (只依賴傳入的資料)。
+    """
+    train_start, train_end, test_start, test_end = bounds
+    metrics, _ = evaluate_grid(base, bars.slice(train_start, train_end), cells)
+    best = _best_index(metrics, target)
+
+    warmed = bars.slice(train_start, test_end)
+    signals = grid_signals(base, warmed.close, [cells[best]], warmed.evaluator())
+    test = bars.slice(test_start, test_end)
+    kernel = simulate_long_only(
+        test.close[:, None],
+        signals[test_start - train_start :],
+        base.initial_capital,
+        sell_ratio=base.sell_ratio,
+        stops=StopRules.from_request(base),
+        **test.ohlc(),
+    )
+    pnls = [ev["pnl"] for ev in kernel.trades if ev["pnl"] is not None]
+    return (
+        best,
+        float(metrics["total_return"][best]),
+        float(metrics["sharpe_ratio"][best]),
+        kernel.equity[:, 0],
+        pnls,
+    )
+
+
+def run_walk_forward(
+    request: WalkForwardRequest,
+    progress: Optional[Callable[[float], None]] = None,
+    token: Optional[CancellationToken] = None,
+) -> WalkForwardResult:
+    """
+    Walk-forward 最佳化
+
+    各 fold 互不相依，以多行程平行執行；樣本外權益以各測試窗的報酬連乘串接
+    (每個測試窗以 initial_capital 起算後依前一段的期末權益縮放)。不含定期投入。
+    progress 在每個 fold 完成時以完成比例 (0 ~ 1) 呼叫。token 要求停止時
+    取消尚未開始的 fold，以已完成的前幾個 fold 組成結果 (truncated=True)。
+    """
+    param1_values = _param_values(request.param1_range, request.param1_step)
+    param2_values = _param_values(request.param2_range, request.param2_step)
+    cells = grid_cells(request.strategy_type, param1_values, param2_values)
+    if not cells:
+        raise ValueError("沒有有效的參數組合 (param2 必須大於 param1)")
+
+    base = BacktestRequest(
+        strategy_name="WalkForward",
+        stock_symbol=request.stock_symbol,
+        start_date=request.start_date,
+        end_date=request.end_date,
+        strategy_type=request.strategy_type,
+        initial_capital=request.initial_capital,
+        dca_amount=0,
+        buy_expression=request.buy_expression,
+        sell_expression=request.sell_expression,
+        expression_params=request.expression_params,
+        stop_loss=request.stop_loss,
+        take_profit=request.take_profit,
+        trailing_stop=request.trailing_stop,
+        stop_intrabar=request.stop_intrabar,
+    )
+    bars = PriceBars.fetch(base)
+    dates = bars.dates
+    folds = walk_forward_folds(
+        len(bars), request.train_bars, request.test_bars, request.anchored
+    )
+    if not folds:
+        raise ValueError("資料長度不足以切出任何訓練/測試窗")
+
+    args = [
+        (base, bars, cells, bounds, request.optimization_target) for bounds in folds
+    ]
+    workers = min(WALK_FORWARD_MAX_WORKERS, len(folds))
+    outcomes = []
+    with ExitStack() as stack:
+        if workers > 1:
+            executor = stack.enter_context(ProcessPoolExecutor(max_workers=workers))
+            futures = [executor.submit(_run_fold, *a) for a in args]
+            # 提前結束時先取消尚未開始的 fold，再等待執行中的 fold 結束
+            for future in futures:
+                stack.callback(future.cancel)
+            results = (future.result() for future in futures)
+        else:
+            results = (_run_fold(*a) for a in args)
+        for (train_start, train_end, _, test_end), outcome in zip(folds, results):
+            outcomes.append(outcome)
+            if progress is not None:
+                progress(len(outcomes) / len(folds))
+            if token is not None:
+                token.charge(
+                    len(cells) * (train_end - train_start) + test_end - train_start
+                )
+                if token.should_stop():
+                    break
+    truncated = len(outcomes) < len(folds)
+    folds = folds[: len(outcomes)]
+
+    fold_results = []
+    equity_parts = []
+    all_pnls: List[float] = []
+    scale = 1.0
+    for (train_start, train_end, test_start, test_end), outcome in zip(folds, outcomes):
+        best, train_return, train_sharpe, test_equity, pnls = outcome
+        test_metrics = compute_metrics(test_equity, request.initial_capital)
+        equity_parts.append(test_equity * scale)
+        all_pnls.extend(p * scale for p in pnls)
+        scale *= test_equity[-1] / request.initial_capital
+        fold_results.append(
+            WalkForwardFold(
+                train_start=dates[train_start],
+                train_end=dates[train_end - 1],
+                test_start=dates[test_start],
+                test_end=dates[test_end - 1],
+                best_param1=cells[best][2],
+                best_param2=cells[best][3],
+                train_return=round(_clean_float(train_return), 2),
+                train_sharpe=round(_clean_float(train_sharpe), 2),
+                test_return=round(_clean_float(test_metrics["total_return"]), 2),
+                test_sharpe=round(_clean_float(test_metrics["sharpe_ratio"]), 2),
+            )
+        )
+
+    equity = np.concatenate(equity_parts)
+    oos_dates = dates[folds[0][2] : folds[-1][3]]
+    return WalkForwardResult(
+        strategy_type=request.strategy_type.value,
+        stock_symbol=request.stock_symbol,
+        folds=fold_results,
+        equity_data=EquityData(
+            dates=oos_dates, equity=[round(_clean_float(v), 2) for v in equity]
+        ),
+        summary=summarize_equity(equity, request.initial_capital, all_pnls),
+        truncated=truncated,
+    )
@@ -0,0 +1,216 @@
+"""
+配對交易引擎 - 以滾動回歸計算避險比例與價差 z-score，做價差均值回歸
+"""
+
+from datetime import datetime
+from typing import Optional
+
+import numpy as np
+
+from app.core.cancellation import CancellationToken
+from app.models.backtest import (
+    BacktestRequest,
+    BacktestResult,
+    PriceData,
+    EquityData,
+    TradeRecord,
+)
+from app.services.market_data import fetch_aligned_closes
+from app.services.indicators import rolling_mean, rolling_ols, rolling_std
+from app.services.schedule import contribution_mask
+from app.services.metrics import _clean_float, summarize_equity
+from app.services.portfolio_engine import _closing_pnls
+
+
+def spread_zscore(y: np.ndarray, x: np.ndarray, lookback: int):
+    """
+    計算滾動避險比例與價差 z-score (全部為 O(n) 滾動加總)
+
+    Returns:
+        (beta, zscore)
+    """
+    alpha, beta = rolling_ols(y, x, lookback)
+    spread = y - (alpha + beta * x)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        std = rolling_std(spread, lookback)
+        zscore = np.where(
+            std > 0, (spread - rolling_mean(spread, lookback)) / std, np.nan
+        )
+    return beta, zscore
+
+
+def pair_positions(zscore: np.ndarray, entry_z: float, exit_z: float) -> np.ndarray:
+    """
+    由 z-score 推出每日價差部位 (1=做多價差, -1=做空價差, 0=空手)
+
+    進場/出場事件向前填補即為帶遲滯的狀態機，不需逐日判斷。
+    """
+    events = np.full(len(zscore), np.nan)
+    with np.errstate(invalid="ignore"):
+        events[np.abs(zscore) < exit_z] = 0
+        events[zscore < -entry_z] = 1
+        events[zscore > entry_z] = -1
+    if len(events) and np.isnan(events[0]):
+        events[0] = 0
+    last_event = np.maximum.accumulate(
+        np.where(np.isnan(events), 0, np.arange(len(events)))
+    )
+    return events[last_event].astype(np.int8)
+
+
+def run_pairs_backtest(
+    request: BacktestRequest,
+    backtest_id: int,
+    token: Optional[CancellationToken] = None,
+) -> BacktestResult:
+    """
+    配對交易回測
+
+    Y 腿為 stock_symbol，X 腿為 pair_symbol。做多價差 = 買 Y、放空 beta 倍 X，
+    進場時以當時權益為總曝險決定單位數，避險比例在持倉期間固定。
+    token 於每個交易事件前檢查。
+    """
+    if not request.pair_symbol:
+        raise ValueError("配對交易需要提供 pair_symbol")
+    if request.pair_symbol == request.stock_symbol:
+        raise ValueError("pair_symbol 不可與 stock_symbol 相同")
+    if request.pairs_exit_z >= request.pairs_entry_z:
+        raise ValueError("pairs_exit_z 必須小於 pairs_entry_z")
+
+    symbols = [request.stock_symbol, request.pair_symbol]
+    dates, prices = fetch_aligned_closes(symbols, request.start_date, request.end_date)
+    n_days = len(dates)
+    y, x = prices[:, 0], prices[:, 1]
+
+    beta, zscore = spread_zscore(y, x, request.pairs_lookback)
+    positions = pair_positions(zscore, request.pairs_entry_z, request.pairs_exit_z)
+
+    injections = np.zeros(n_days)
+    if request.dca_amount > 0:
+        payday = contribution_mask(
+            dates, request.dca_interval, request.dca_day, request.dca_month
+        )
+        injections = payday * request.dca_amount
+
+    share_deltas = np.zeros((n_days, 2))
+    cash_deltas = injections.copy()
+    cash_deltas[0] += request.initial_capital
+    cash_before = np.cumsum(cash_deltas)
+    traded_cash = 0.0
+
+    holding = np.zeros(2)
+    entry_prices = np.zeros(2)
+    trade_events = []  # (bar, col, action, shares, value, pnl)
+
+    bars = list(np.flatnonzero(np.diff(positions, prepend=0) != 0))
+    if n_days and (n_days - 1) not in bars:
+        bars.append(n_days - 1)  # 期末強制平倉
+
+    for bar in bars:
+        if token is not None:
+            token.check()
+        bar_prices = prices[bar]
+        is_last = bar == n_days - 1
+        target = 0 if is_last else int(positions[bar])
+
+        # 平倉
+        if holding.any():
+            for col in np.flatnonzero(holding):
+                qty = holding[col]
+                trade_events.append(
+                    (
+                        bar,
+                        col,
+                        "SELL" if qty > 0 else "BUY",
+                        abs(qty),
+                        abs(qty) * bar_prices[col],
+                        qty * (bar_prices[col] - entry_prices[col]),
+                    )
+                )
+            share_deltas[bar] -= holding
+            traded_cash += float(np.dot(holding, bar_prices))
+            holding = np.zeros(2)
+
+        # 開倉
+        hedge = beta[bar]
+        if target != 0 and np.isfinite(hedge):
+            equity = cash_before[bar] + traded_cash
+            gross = bar_prices[0] + abs(hedge) * bar_prices[1]
+            units = np.floor(equity / gross) if equity > 0 and gross > 0 else 0
+            new_holding = np.array([target * units, -target * np.round(units * hedge)])
+            if new_holding.any():
+                for col in np.flatnonzero(new_holding):
+                    qty = new_holding[col]
+                    trade_events.append(
+                        (
+                            bar,
+                            col,
+                            "BUY" if qty > 0 else "SELL",
+                            abs(qty),
+                            abs(qty) * bar_prices[col],
+                            None,
+                        )
+                    )
+                share_deltas[bar] += new_holding
+                traded_cash -= float(np.dot(new_holding, bar_prices))
+                holding = new_holding
+                entry_prices = bar_prices.copy()
+
+        cash_deltas[bar] -= float(np.dot(share_deltas[bar], bar_prices))
+
+    holdings = np.cumsum(share_deltas, axis=0)
+    cash_path = np.cumsum(cash_deltas)
+    equity_curve = cash_path + (holdings * prices).sum(axis=1)
+    total_invested = request.initial_capital + float(injections.sum())
+
+    trades = [
+        TradeRecord(
+            date=dates[bar],
+            action=action,
+            price=round(float(prices[bar, col]), 2),
+            shares=int(qty),
+            value=round(float(value), 2),
+            balance=round(float(cash_path[bar]), 2),
+            total_assets=round(float(equity_curve[bar]), 2),
+            pnl=round(_clean_float(pnl), 2) if pnl is not None else None,
+            stock_symbol=symbols[col],
+        )
+        for bar, col, action, qty, value, pnl in trade_events
+    ]
+
+    summary = summarize_equity(equity_curve, total_invested, _closing_pnls(trades))
+    equity_list = [round(_clean_float(v), 2) for v in equity_curve]
+
+    price_data = PriceData(
+        dates=dates,
+        prices=[round(_clean_float(p), 2) for p in y],
+        ma_short=[None] * n_days,
+        ma_long=[None] * n_days,
+        multi_stock_prices={
+            symbol: [round(_clean_float(p), 2) for p in prices[:, i]]
+            for i, symbol in enumerate(symbols)
+        },
+    )
+
+    return BacktestResult(
+        id=backtest_id,
+        strategy_name=request.strategy_name,
+        stock_symbol=f"{request.stock_symbol}/{request.pair_symbol}",
+        strategy_type=request.strategy_type.value,
+        start_date=request.start_date,
+        end_date=request.end_date,
+        initial_capital=request.initial_capital,
+        final_capital=equity_list[-1] if equity_list else request.initial_capital,
+        created_at=datetime.now().strftime("%Y-%m-%d %H:%M"),
+        summary=summary,
+        price_data=price_data,
+        equity_data=EquityData(dates=dates, equity=equity_list),
+        trades=trades,
+        params={
+            "strategy_type": request.strategy_type.value,
+            "pair_symbol": request.pair_symbol,
+            "pairs_lookback": request.pairs_lookback,
+            "pairs_entry_z": request.pairs_entry_z,
+            "pairs_exit_z": request.pairs_exit_z,
+        },
+    )
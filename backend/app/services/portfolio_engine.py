@@ -0,0 +1,364 @@
+"""
+多股票投資組合引擎 - 在對齊後的價格矩陣上執行技術分析與動能輪動策略
+"""
+
+from datetime import datetime
+from typing import List, Optional
+
+import numpy as np
+
+from app.core.cancellation import CancellationToken
+from app.models.backtest import (
+    BacktestRequest,
+    BacktestResult,
+    PriceData,
+    EquityData,
+    TradeRecord,
+    PortfolioAllocationRule,
+    MomentumMetric,
+    RebalanceMode,
+)
+from app.services.market_data import fetch_aligned_closes, fetch_aligned_ohlc
+from app.services.indicators import rolling_mean, rolling_std, rsi, shift
+from app.services.batch_kernel import simulate_long_only
+from app.services.stops import StopRules
+from app.services.strategy_registry import build_signal_matrix
+from app.services.schedule import contribution_mask, period_start_mask
+from app.services.backtest_engine import _rebalance_to_target
+from app.services.metrics import _clean_float, summarize_equity
+
+
+def _allocation_weights(request: BacktestRequest) -> np.ndarray:
+    """依配置規則計算各股票的資金比例"""
+    n = len(request.stock_allocations)
+    if request.allocation_rule == PortfolioAllocationRule.FIXED_RATIO:
+        return np.array([a.allocation_ratio for a in request.stock_allocations])
+    return np.full(n, 1.0 / n)
+
+
+def _closing_pnls(trades: List[TradeRecord]) -> List[float]:
+    """只統計平倉交易 (帶有已實現損益者)"""
+    return [t.pnl for t in trades if t.pnl is not None]
+
+
+def run_portfolio_backtest(
+    request: BacktestRequest,
+    backtest_id: int,
+    token: Optional[CancellationToken] = None,
+) -> BacktestResult:
+    """
+    多股票技術分析策略回測
+
+    1. 批次取得所有股票並以共同交易日對齊成 (Days, Stocks) 矩陣
+    2. 一次計算整個矩陣的指標與訊號
+    3. 依 allocation_rule 分配資金，所有股票同步模擬 (停損停利以各股的開高低價觸價)
+    """
+    if not request.stock_allocations:
+        raise ValueError("多股票回測需要提供stock_allocations")
+
+    symbols = [a.stock_symbol for a in request.stock_allocations]
+    if len(set(symbols)) != len(symbols):
+        raise ValueError("stock_allocations 中的股票代碼不可重複")
+
+    dates, columns = fetch_aligned_ohlc(symbols, request.start_date, request.end_date)
+    prices = columns["Close"]
+    signals = build_signal_matrix(request, prices)
+
+    shared_cash = request.allocation_rule == PortfolioAllocationRule.SHARED_CASH
+    weights = _allocation_weights(request)
+
+    # 定期注資 (與單股票一般策略相同：dca_amount > 0 時每期補充現金)
+    injections = None
+    if request.dca_amount > 0:
+        payday = contribution_mask(
+            dates, request.dca_interval, request.dca_day, request.dca_month
+        )
+        injections = np.outer(payday * request.dca_amount, weights)
+
+    initial_cash = (
+        request.initial_capital if shared_cash else request.initial_capital * weights
+    )
+    kernel = simulate_long_only(
+        prices,
+        signals,
+        initial_cash,
+        injections=injections,
+        sell_ratio=request.sell_ratio,
+        shared_cash=shared_cash,
+        stops=StopRules.from_request(request),
+        token=token,
+        # 盤中觸價 (stop_intrabar) 與單一股票相同，以各股的開高低價判斷
+        open_=columns.get("Open"),
+        high=columns.get("High"),
+        low=columns.get("Low"),
+    )
+
+    cash_total = kernel.cash.sum(axis=1)
+    equity_curve = cash_total + kernel.market_value.sum(axis=1)
+    total_invested = request.initial_capital + (
+        float(injections.sum()) if injections is not None else 0.0
+    )
+
+    trades = [
+        TradeRecord(
+            date=dates[ev["bar"]],
+            action=ev["action"],
+            price=round(ev["price"], 2),
+            shares=ev["shares"],
+            value=round(ev["value"], 2),
+            balance=round(float(cash_total[ev["bar"]]), 2),
+            total_assets=round(float(equity_curve[ev["bar"]]), 2),
+            pnl=round(ev["pnl"], 2) if ev["pnl"] is not None else None,
+            stock_symbol=symbols[ev["col"]],
+            exit_reason=ev.get("exit_reason"),
+        )
+        for ev in kernel.trades
+    ]
+
+    summary = summarize_equity(equity_curve, total_invested, _closing_pnls(trades))
+    equity_list = [round(_clean_float(v), 2) for v in equity_curve]
+
+    price_data = PriceData(
+        dates=dates,
+        prices=[],  # 多股票时不使用单一价格列
+        ma_short=[None] * len(dates),
+        ma_long=[None] * len(dates),
+        multi_stock_prices={
+            symbol: [round(_clean_float(p), 2) for p in prices[:, i]]
+            for i, symbol in enumerate(symbols)
+        },
+    )
+
+    return BacktestResult(
+        id=backtest_id,
+        strategy_name=request.strategy_name,
+        stock_symbol="MULTI_STOCK_PORTFOLIO",
+        strategy_type=request.strategy_type.value,
+        start_date=request.start_date,
+        end_date=request.end_date,
+        initial_capital=request.initial_capital,
+        final_capital=equity_list[-1] if equity_list else request.initial_capital,
+        created_at=datetime.now().strftime("%Y-%m-%d %H:%M"),
+        summary=summary,
+        price_data=price_data,
+        equity_data=EquityData(dates=dates, equity=equity_list),
+        trades=trades,
+        params={
+            "strategy_type": request.strategy_type.value,
+            "allocation_rule": request.allocation_rule.value,
+            "short_period": request.short_period,
+            "long_period": request.long_period,
+            "rsi_period": request.rsi_period,
+            "rsi_buy": request.rsi_buy,
+            "rsi_sell": request.rsi_sell,
+            "macd_fast": request.macd_fast,
+            "macd_slow": request.macd_slow,
+            "macd_signal": request.macd_signal,
+            "bb_period": request.bb_period,
+            "bb_std": request.bb_std,
+            "sma_period": request.sma_period,
+            "stock_allocations": [
+                {"stock_symbol": a.stock_symbol, "allocation_ratio": a.allocation_ratio}
+                for a in request.stock_allocations
+            ],
+        },
+    )
+
+
+def momentum_scores(request: BacktestRequest, prices: np.ndarray) -> np.ndarray:
+    """計算 (Days, Stocks) 的動能分數矩陣，暖機期為 NaN"""
+    lookback = request.momentum_lookback
+    metric = request.momentum_metric
+
+    with np.errstate(divide="ignore", invalid="ignore"):
+        if metric == MomentumMetric.RSI:
+            return rsi(prices, request.rsi_period)
+        if metric == MomentumMetric.SMA_DISTANCE:
+            return prices / rolling_mean(prices, request.sma_period) - 1
+
+        trailing_return = prices / shift(prices, lookback) - 1
+        if metric == MomentumMetric.RISK_ADJUSTED:
+            daily_returns = prices / shift(prices, 1) - 1
+            volatility = rolling_std(daily_returns, lookback) * np.sqrt(lookback)
+            return np.where(volatility > 0, trailing_return / volatility, np.nan)
+        return trailing_return
+
+
+def select_top_n(scores: np.ndarray, top_n: int) -> np.ndarray:
+    """
+    每列挑出分數最高的 top_n 檔 (argpartition，O(Stocks))
+
+    Returns:
+        與 scores 同形狀的布林矩陣；NaN 分數不會被選入
+    """
+    n_rows, n_cols = scores.shape
+    selected = np.zeros(scores.shape, dtype=bool)
+    if n_rows == 0 or n_cols == 0:
+        return selected
+    k = min(top_n, n_cols)
+    ranked = np.where(np.isfinite(scores), scores, -np.inf)
+    top_idx = np.argpartition(-ranked, k - 1, axis=1)[:, :k]
+    np.put_along_axis(selected, top_idx, True, axis=1)
+    return selected & np.isfinite(scores)
+
+
+def run_momentum_rotation(
+    request: BacktestRequest,
+    backtest_id: int,
+    token: Optional[CancellationToken] = None,
+) -> BacktestResult:
+    """
+    橫截面動能輪動回測
+
+    在每個換股日依動能分數對整個股票池排名，等權重持有前 N 檔；
+    分數與排名皆在 (Days, Stocks) 矩陣上一次計算。
+    """
+    symbols = request.universe or [
+        a.stock_symbol for a in (request.stock_allocations or [])
+    ]
+    symbols = list(dict.fromkeys(symbols))
+    if len(symbols) < 2:
+        raise ValueError("動能輪動策略至少需要 2 檔股票 (universe)")
+    if request.rotation_frequency in (RebalanceMode.NONE, RebalanceMode.THRESHOLD):
+        raise ValueError("rotation_frequency 必須為 MONTHLY、QUARTERLY 或 YEARLY")
+
+    dates, prices = fetch_aligned_closes(symbols, request.start_date, request.end_date)
+    n_days, n_stocks = prices.shape
+
+    scores = momentum_scores(request, prices)
+    rebalance_bars = np.flatnonzero(
+        period_start_mask(dates, request.rotation_frequency.value)
+    )
+    selected = select_top_n(scores[rebalance_bars], request.momentum_top_n)
+    counts = selected.sum(axis=1, keepdims=True)
+    target_weights = np.divide(
+        selected, counts, out=np.zeros(selected.shape), where=counts > 0
+    )
+
+    injections = np.zeros(n_days)
+    if request.dca_amount > 0:
+        payday = contribution_mask(
+            dates, request.dca_interval, request.dca_day, request.dca_month
+        )
+        injections = payday * request.dca_amount
+
+    # 持股只在換股日改變：先算出每次換股前的現金，再一次還原每日權益
+    share_deltas = np.zeros((n_days, n_stocks))
+    cash_deltas = injections.copy()
+    cash_deltas[0] += request.initial_capital
+    cash_before = np.cumsum(cash_deltas)
+
+    shares = np.zeros(n_stocks)
+    cost_basis = np.zeros(n_stocks)
+    trade_events = []  # (bar, col, action, shares, value, pnl)
+    traded_cash = 0.0  # 換股交易累積的現金變化
+
+    for bar, weights in zip(rebalance_bars, target_weights):
+        if token is not None:
+            token.check()
+        bar_prices = prices[bar]
+        cash = cash_before[bar] + traded_cash
+        delta = _rebalance_to_target(shares, cash, bar_prices, weights)
+        if not delta.any():
+            continue
+
+        sell_cols = np.flatnonzero(delta < 0)
+        if len(sell_cols):
+            sold = -delta[sell_cols]
+            revenue = sold * bar_prices[sell_cols]
+            sold_cost = cost_basis[sell_cols] / shares[sell_cols] * sold
+            cost_basis[sell_cols] -= sold_cost
+            trade_events.extend(
+                (bar, col, "SELL", qty, value, value - cost_part)
+                for col, qty, value, cost_part in zip(
+                    sell_cols, sold, revenue, sold_cost
+                )
+            )
+        buy_cols = np.flatnonzero(delta > 0)
+        if len(buy_cols):
+            cost = delta[buy_cols] * bar_prices[buy_cols]
+            cost_basis[buy_cols] += cost
+            trade_events.extend(
+                (bar, col, "BUY", qty, value, None)
+                for col, qty, value in zip(buy_cols, delta[buy_cols], cost)
+            )
+
+        shares += delta
+        cost_basis[shares == 0] = 0.0
+        share_deltas[bar] = delta
+        traded_cash -= float(np.dot(delta, bar_prices))
+        cash_deltas[bar] -= float(np.dot(delta, bar_prices))
+
+    # 期末強制平倉
+    last = n_days - 1
+    held = np.flatnonzero(shares > 0)
+    if len(held):
+        revenue = shares[held] * prices[last, held]
+        trade_events.extend(
+            (last, col, "SELL", qty, value, value - cost_part)
+            for col, qty, value, cost_part in zip(
+                held, shares[held], revenue, cost_basis[held]
+            )
+        )
+        share_deltas[last, held] -= shares[held]
+        cash_deltas[last] += float(revenue.sum())
+
+    holdings = np.cumsum(share_deltas, axis=0)
+    cash_path = np.cumsum(cash_deltas)
+    equity_curve = cash_path + (holdings * prices).sum(axis=1)
+    total_invested = request.initial_capital + float(injections.sum())
+
+    trades = [
+        TradeRecord(
+            date=dates[bar],
+            action=action,
+            price=round(float(prices[bar, col]), 2),
+            shares=int(qty),
+            value=round(float(value), 2),
+            balance=round(float(cash_path[bar]), 2),
+            total_assets=round(float(equity_curve[bar]), 2),
+            pnl=round(_clean_float(pnl), 2) if pnl is not None else None,
+            stock_symbol=symbols[col],
+        )
+        for bar, col, action, qty, value, pnl in trade_events
+    ]
+
+    summary = summarize_equity(equity_curve, total_invested, _closing_pnls(trades))
+    equity_list = [round(_clean_float(v), 2) for v in equity_curve]
+
+    price_data = PriceData(
+        dates=dates,
+        prices=[],
+        ma_short=[None] * n_days,
+        ma_long=[None] * n_days,
+        multi_stock_prices={
+            symbol: [round(_clean_float(p), 2) for p in prices[:, i]]
+            for i, symbol in enumerate(symbols)
+        },
+    )
+
+    return BacktestResult(
+        id=backtest_id,
+        strategy_name=request.strategy_name,
+        stock_symbol="MULTI_STOCK_ROTATION",
+        strategy_type=request.strategy_type.value,
+        start_date=request.start_date,
+        end_date=request.end_date,
+        initial_capital=request.initial_capital,
+        final_capital=equity_list[-1] if equity_list else request.initial_capital,
+        created_at=datetime.now().strftime("%Y-%m-%d %H:%M"),
+        summary=summary,
+        price_data=price_data,
+        equity_data=EquityData(dates=dates, equity=equity_list),
+        trades=trades,
+        params={
+            "strategy_type": request.strategy_type.value,
+            "universe": symbols,
+            "momentum_metric": request.momentum_metric.value,
+            "momentum_lookback": request.momentum_lookback,
+            "momentum_top_n": request.momentum_top_n,
+            "rotation_frequency": request.rotation_frequency.value,
+            "rsi_period": request.rsi_period,
+            "sma_period": request.sma_period,
+        },
+    )
@@ -0,0 +1,87 @@
+"""
+批次核心的輸入 - 由 K 線資料建立價格陣列、運算式 evaluator 與定期投入金額
+
+批次回測、篩選、參數最佳化、walk-forward 與穩健性分析都由 PriceBars 建立核心輸入，
+運算式可用的價格欄位、K 棒日期與週期在所有路徑上一致。
+"""
+
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+
+from app.models.backtest import BacktestRequest
+from app.services.market_data import fetch_history
+from app.services.schedule import contribution_mask
+from app.services.strategy_dsl import ExpressionEvaluator, ohlcv_series
+
+# simulate_long_only 的盤中觸價參數 -> 價格欄位
+_OHLC_ARGUMENTS = (("open_", "open"), ("high", "high"), ("low", "low"))
+
+
+@dataclass
+class PriceBars:
+    """一段 K 線：日期與 ohlcv_series 的價格欄位 (小寫名稱)"""
+
+    dates: List[str]
+    series: Dict[str, np.ndarray]
+    _paydays: Dict[Tuple, np.ndarray] = field(default_factory=dict, repr=False)
+
+    @classmethod
+    def from_frame(cls, df: pd.DataFrame) -> "PriceBars":
+        return cls(df["Date"].tolist(), ohlcv_series(df))
+
+    @classmethod
+    def fetch(cls, request: BacktestRequest) -> "PriceBars":
+        """依請求的股票、起訖日與 K 棒週期取得 (經由價格快取)"""
+        return cls.from_frame(
+            fetch_history(
+                request.stock_symbol,
+                request.start_date,
+                request.end_date,
+                request.timeframe,
+            )
+        )
+
+    def __len__(self) -> int:
+        return len(self.dates)
+
+    @property
+    def close(self) -> np.ndarray:
+        return self.series["close"]
+
+    def slice(self, start: int, end: int) -> "PriceBars":
+        return PriceBars(
+            self.dates[start:end],
+            {name: values[start:end] for name, values in self.series.items()},
+        )
+
+    def evaluator(self) -> ExpressionEvaluator:
+        """可使用所有價格欄位與 weekly() / monthly() 的 evaluator"""
+        return ExpressionEvaluator(self.series, self.dates)
+
+    def ohlc(self) -> Dict[str, np.ndarray]:
+        """傳給 simulate_long_only 的 open_ / high / low (缺少的欄位以收盤價判斷)"""
+        return {
+            argument: self.series[name]
+            for argument, name in _OHLC_ARGUMENTS
+            if name in self.series
+        }
+
+    def paydays(self, request: BacktestRequest) -> np.ndarray:
+        """定期投入日 (依投入排程快取)"""
+        key = (request.dca_interval, request.dca_day, request.dca_month)
+        if key not in self._paydays:
+            self._paydays[key] = contribution_mask(self.dates, *key)
+        return self._paydays[key]
+
+    def injections(self, request: BacktestRequest) -> Optional[np.ndarray]:
+        """每根 K 棒的投入金額 (dca_amount 為 0 時為 None)"""
+        if request.dca_amount <= 0:
+            return None
+        return self.paydays(request) * request.dca_amount
+
+
+def total_invested(initial_cash: float, injections: Optional[np.ndarray]) -> float:
+    return initial_cash + (float(injections.sum()) if injections is not None else 0.0)
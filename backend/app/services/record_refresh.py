@@ -0,0 +1,214 @@
+"""
+回測紀錄每日更新 - 將已保存的回測延長到最新交易日並批次寫回
+
+只更新「開放式」紀錄：結束日不早於建立日 (當時即回測到最新資料) 且保存了完整請求。
+紀錄依主股票分組，每組先以最早的起始日一次取得所有相關股票的資料 (價格快取)，
+再以 run_backtest_batch 執行 (同組技術分析策略共用指標並以批次核心模擬；紀錄保存了
+檢查點狀態的單一股票回測，包括技術分析策略，由檢查點接續，只模擬新的 K 棒)，最後以一次 bulk UPDATE
+寫回該組所有紀錄與新的檢查點。
+
+用法見 app/refresh.py；API 行程可設定 RECORD_REFRESH_AT=HH:MM 每日自動執行。
+"""
+
+import logging
+import os
+import threading
+import time
+from collections import defaultdict
+from dataclasses import dataclass, field
+from datetime import date, datetime, timedelta
+from typing import Any, Callable, Dict, List, NamedTuple, Optional, Tuple
+
+from pydantic import ValidationError
+from sqlalchemy import update
+from sqlalchemy.orm import Session
+
+from app.core.database import SessionLocal
+from app.core.models import BacktestRecord
+from app.models.backtest import BacktestRequest, TradeRecord
+from app.services.batch_backtest import run_backtest_batch
+from app.services.checkpoints import EngineCheckpoint, engine_checkpoints
+from app.services.market_data import fetch_history
+from app.services.records import result_columns
+from app.services.result_cache import data_symbols
+
+# 每日自動更新的時間 (本地時間 HH:MM)，未設定則不啟動排程
+RECORD_REFRESH_AT = os.getenv("RECORD_REFRESH_AT", "")
+
+logger = logging.getLogger(__name__)
+
+
+class StaleRecord(NamedTuple):
+    id: int
+    request: BacktestRequest  # 結束日已延長的請求
+    checkpoint: Optional[Dict[str, Any]]  # 紀錄保存的檢查點狀態
+
+
+@dataclass
+class RefreshSummary:
+    end_date: str
+    symbols: int = 0
+    refreshed: int = 0
+    failed: int = 0
+    skipped: int = 0  # 未保存請求的舊紀錄
+    errors: Dict[int, str] = field(default_factory=dict)  # 紀錄 id -> 錯誤訊息
+
+
+def _is_open_ended(end_date: str, created_at: Optional[datetime]) -> bool:
+    return created_at is not None and end_date >= created_at.date().isoformat()
+
+
+def find_stale_records(
+    db: Session,
+    end_date: str,
+    symbols: Optional[List[str]] = None,
+) -> Tuple[Dict[str, List[StaleRecord]], int]:
+    """
+    需要更新的紀錄，依主股票分組
+
+    只查詢 id / 請求等輕量欄位 (不載入價格與權益曲線)。
+
+    Returns:
+        ({股票代碼: [StaleRecord, ...]}, 未保存有效請求而略過的筆數)
+    """
+    query = db.query(
+        BacktestRecord.id,
+        BacktestRecord.end_date,
+        BacktestRecord.created_at,
+        BacktestRecord.request,
+        BacktestRecord.checkpoint,
+    ).filter(BacktestRecord.end_date < end_date)
+    if symbols:
+        query = query.filter(BacktestRecord.stock_symbol.in_(symbols))
+
+    groups: Dict[str, List[StaleRecord]] = defaultdict(list)
+    skipped = 0
+    for record_id, record_end, created_at, payload, checkpoint in query.order_by(
+        BacktestRecord.id
+    ):
+        if not _is_open_ended(record_end, created_at):
+            continue
+        try:
+            request = BacktestRequest.model_validate(payload or {})
+        except ValidationError:
+            skipped += 1
+            continue
+        request = request.model_copy(update={"end_date": end_date})
+        groups[request.stock_symbol].append(StaleRecord(record_id, request, checkpoint))
+    return groups, skipped
+
+
+def _prefetch(requests: List[BacktestRequest], end_date: str) -> None:
+    """每檔相關股票以最早的起始日只下載一次，之後各請求由價格快取切片"""
+    starts: Dict[str, str] = {}
+    for request in requests:
+        for symbol in data_symbols(request):
+            starts[symbol] = min(
+                starts.get(symbol, request.start_date), request.start_date
+            )
+    for symbol, start in starts.items():
+        try:
+            fetch_history(symbol, start, end_date)
+        except ValueError:
+            # 由各請求回報錯誤
+            pass
+
+
+def _restore_checkpoints(db: Session, members: List[StaleRecord]) -> None:
+    """由紀錄保存的檢查點狀態與交易、權益曲線還原檢查點，供回測引擎接續"""
+    states = {m.id: m for m in members if m.checkpoint}
+    if not states:
+        return
+    rows = db.query(
+        BacktestRecord.id, BacktestRecord.trades, BacktestRecord.equity_data
+    ).filter(BacktestRecord.id.in_(list(states)))
+    for record_id, trades, equity_data in rows:
+        member = states[record_id]
+        try:
+            checkpoint = EngineCheckpoint.from_state(
+                member.checkpoint,
+                [TradeRecord(**t) for t in trades],
+                equity_data["equity"],
+            )
+        except (KeyError, TypeError, ValidationError):
+            # 格式不符的舊狀態：從頭執行
+            continue
+        engine_checkpoints.put(member.request, checkpoint)
+
+
+def refresh_records(
+    end_date: Optional[str] = None,
+    symbols: Optional[List[str]] = None,
+    progress: Optional[Callable[[str, int, int], None]] = None,
+) -> RefreshSummary:
+    """
+    將開放式紀錄延長到 end_date (預設今天) 並寫回資料庫
+
+    progress(股票代碼, 已完成組數, 總組數) 於每組寫回後呼叫。
+    """
+    end_date = end_date or date.today().isoformat()
+    summary = RefreshSummary(end_date=end_date)
+    db = SessionLocal()
+    try:
+        groups, summary.skipped = find_stale_records(db, end_date, symbols)
+        summary.symbols = len(groups)
+
+        for done, (symbol, members) in enumerate(groups.items(), start=1):
+            requests = [member.request for member in members]
+            _prefetch(requests, end_date)
+            _restore_checkpoints(db, members)
+            outcomes = run_backtest_batch(requests)
+
+            now = datetime.utcnow()
+            mappings = []
+            for member, (result, error) in zip(members, outcomes):
+                if result is None:
+                    summary.failed += 1
+                    summary.errors[member.id] = error
+                    continue
+                # 沒有產生新檢查點 (批次核心或結果快取) 時保留原本的狀態
+                checkpoint = engine_checkpoints.state_for(member.request)
+                mappings.append(
+                    {
+                        "id": member.id,
+                        "request": member.request.model_dump(mode="json"),
+                        "checkpoint": checkpoint or member.checkpoint,
+                        "refreshed_at": now,
+                        **result_columns(result),
+                    }
+                )
+            if mappings:
+                db.execute(update(BacktestRecord), mappings)
+                db.commit()
+            summary.refreshed += len(mappings)
+            if progress is not None:
+                progress(symbol, done, summary.symbols)
+    finally:
+        db.close()
+    return summary
+
+
+def _seconds_until(at: str) -> float:
+    hour, minute = (int(part) for part in at.split(":"))
+    now = datetime.now()
+    target = now.replace(hour=hour, minute=minute, second=0, microsecond=0)
+    if target <= now:
+        target += timedelta(days=1)
+    return (target - now).total_seconds()
+
+
+def run_refresh_scheduler(at: str, stop_event: threading.Event) -> None:
+    """每日 at (HH:MM) 執行 refresh_records，直到 stop_event 被設定"""
+    while not stop_event.wait(_seconds_until(at)):
+        started = time.monotonic()
+        try:
+            summary = refresh_records()
+            logger.info(
+                "Record refresh: %d refreshed, %d failed, %d symbols in %.1fs",
+                summary.refreshed,
+                summary.failed,
+                summary.symbols,
+                time.monotonic() - started,
+            )
+        except Exception:
+            logger.exception("Record refresh failed")
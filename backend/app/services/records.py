@@ -0,0 +1,160 @@
+"""
+回測紀錄轉換 - BacktestResult 與資料庫 BacktestRecord 之間的對應
+"""
+
+from typing import Any, Dict, List, Optional
+
+from pydantic import ValidationError
+from sqlalchemy.orm import Session
+
+from app.core.models import BacktestRecord
+from app.models.backtest import (
+    BacktestRequest,
+    BacktestResult,
+    BacktestSummary,
+    EquityData,
+    PriceData,
+    Timeframe,
+    TradeRecord,
+)
+from app.services.checkpoints import engine_checkpoints
+from app.services.timeframes import INTRADAY_TIMEFRAMES
+
+# BacktestSummary 與 BacktestRecord 共有的延伸風險指標欄位
+EXTENDED_METRIC_FIELDS = (
+    "sortino_ratio",
+    "calmar_ratio",
+    "ulcer_index",
+    "max_drawdown_duration",
+    "time_under_water",
+    "volatility",
+    "skewness",
+    "tail_ratio",
+)
+
+# 基準比較欄位 (未指定基準時保留 None)
+BENCHMARK_FIELDS = (
+    "benchmark_symbol",
+    "benchmark_return",
+    "alpha",
+    "beta",
+    "tracking_error",
+    "information_ratio",
+)
+
+
+def db_record_to_result(record: BacktestRecord) -> BacktestResult:
+    return BacktestResult(
+        id=record.id,
+        strategy_name=record.strategy_name,
+        stock_symbol=record.stock_symbol,
+        strategy_type=record.strategy_type,
+        start_date=record.start_date,
+        end_date=record.end_date,
+        initial_capital=record.initial_capital,
+        final_capital=record.final_capital,
+        created_at=record.created_at.isoformat() if record.created_at else "",
+        summary=BacktestSummary(
+            total_return=record.total_return,
+            annualized_return=record.annualized_return,
+            sharpe_ratio=record.sharpe_ratio,
+            max_drawdown=record.max_drawdown,
+            win_rate=record.win_rate,
+            total_trades=record.total_trades,
+            profit_trades=record.profit_trades,
+            loss_trades=record.loss_trades,
+            avg_profit=record.avg_profit,
+            avg_loss=record.avg_loss,
+            total_cost=record.total_cost,
+            **{field: getattr(record, field) or 0 for field in EXTENDED_METRIC_FIELDS},
+            **{field: getattr(record, field) for field in BENCHMARK_FIELDS},
+        ),
+        price_data=PriceData(**record.price_data),
+        equity_data=EquityData(**record.equity_data),
+        trades=[TradeRecord(**t) for t in record.trades],
+        params=record.params,
+    )
+
+
+def result_columns(result: BacktestResult) -> Dict[str, Any]:
+    """BacktestResult 對應的 BacktestRecord 欄位值 (不含 user_id 與 request)"""
+    return dict(
+        strategy_name=result.strategy_name,
+        stock_symbol=result.stock_symbol,
+        strategy_type=result.strategy_type,
+        start_date=result.start_date,
+        end_date=result.end_date,
+        initial_capital=result.initial_capital,
+        final_capital=result.final_capital,
+        total_return=result.summary.total_return,
+        annualized_return=result.summary.annualized_return,
+        sharpe_ratio=result.summary.sharpe_ratio,
+        max_drawdown=result.summary.max_drawdown,
+        win_rate=result.summary.win_rate,
+        total_trades=result.summary.total_trades,
+        profit_trades=result.summary.profit_trades,
+        loss_trades=result.summary.loss_trades,
+        avg_profit=result.summary.avg_profit,
+        avg_loss=result.summary.avg_loss,
+        total_cost=result.summary.total_cost or 0.0,
+        **{field: getattr(result.summary, field) for field in EXTENDED_METRIC_FIELDS},
+        **{field: getattr(result.summary, field) for field in BENCHMARK_FIELDS},
+        price_data=result.price_data.model_dump(),
+        equity_data=result.equity_data.model_dump(),
+        trades=[t.model_dump() for t in result.trades],
+        params=result.params,
+    )
+
+
+def result_to_record(
+    result: BacktestResult,
+    user_id: int,
+    request: Optional[BacktestRequest] = None,
+) -> BacktestRecord:
+    """request 有提供時一併保存請求與檢查點狀態，供每日更新重新執行"""
+    if request is None:
+        return BacktestRecord(user_id=user_id, **result_columns(result))
+    return BacktestRecord(
+        user_id=user_id,
+        request=request.model_dump(mode="json"),
+        checkpoint=engine_checkpoints.state_for(request),
+        **result_columns(result),
+    )
+
+
+def equity_timeframe(record: BacktestRecord) -> Timeframe:
+    """
+    紀錄權益曲線的 K 棒週期
+
+    盤中串流回測保存日彙總的權益曲線；未保存有效請求的舊紀錄為日 K。
+    """
+    try:
+        timeframe = BacktestRequest.model_validate(record.request or {}).timeframe
+    except ValidationError:
+        return Timeframe.DAILY
+    return Timeframe.DAILY if timeframe in INTRADAY_TIMEFRAMES else timeframe
+
+
+def next_backtest_id(db: Session) -> int:
+    """下一筆回測紀錄的 id (供結果在寫入前先帶上 id)"""
+    max_id = db.query(BacktestRecord.id).order_by(BacktestRecord.id.desc()).first()
+    return (max_id[0] + 1) if max_id else 1
+
+
+def save_results(
+    db: Session,
+    results: List[BacktestResult],
+    user_id: int,
+    requests: Optional[List[BacktestRequest]] = None,
+) -> List[int]:
+    """在同一個交易中寫入多筆回測結果，回傳與 results 同順序的紀錄 id"""
+    requests = requests or [None] * len(results)
+    records = [
+        result_to_record(result, user_id, request)
+        for result, request in zip(results, requests)
+    ]
+    db.add_all(records)
+    db.flush()
+    ids = [record.id for record in records]
+    db.commit()
+    return ids
@@ -0,0 +1,224 @@
+"""
+回測結果快取 - 以正規化請求的雜湊為鍵 (內容定址)，並合併同時進行的相同請求
+
+鍵為請求 (不含 strategy_name) 的正規化 JSON 之 SHA-256；每筆結果另記錄計算時
+各相關股票的 price_cache 版本，價格快取補入新資料後版本改變，舊結果即失效。
+結束日在計算當日之後的請求 (資料仍會增加) 只保留 RESULT_CACHE_OPEN_TTL_SECONDS 秒。
+多個執行緒同時請求相同內容時只有第一個實際計算，其他等待並共用結果。
+"""
+
+import hashlib
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+from datetime import date, datetime
+from typing import Callable, Dict, List, Optional, Tuple
+
+from app.core.cancellation import CancellationToken, OperationCancelled
+from app.models.backtest import BacktestRequest, BacktestResult
+from app.services.backtest_engine import run_full_backtest
+from app.services.market_data import price_cache
+from app.services.timeframes import INTRADAY_TIMEFRAMES
+
+RESULT_CACHE_MAX_ENTRIES = int(os.getenv("RESULT_CACHE_MAX_ENTRIES", "256"))
+RESULT_CACHE_OPEN_TTL_SECONDS = float(os.getenv("RESULT_CACHE_OPEN_TTL_SECONDS", "900"))
+# 等待其他執行緒計算時檢查自身 token 的間隔 (秒)
+COALESCE_POLL_SECONDS = 0.2
+
+
+def request_key(request: BacktestRequest) -> str:
+    """正規化請求的雜湊 (strategy_name 只影響顯示名稱，不列入)"""
+    payload = request.model_dump(mode="json", exclude={"strategy_name"})
+    text = json.dumps(payload, sort_keys=True, separators=(",", ":"))
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+def data_symbols(request: BacktestRequest) -> List[str]:
+    """請求會讀取價格的所有股票 (主股票、配置、股票池、配對與基準)"""
+    symbols = [request.stock_symbol]
+    symbols += [a.stock_symbol for a in request.stock_allocations or []]
+    symbols += request.universe or []
+    symbols += [s for s in (request.pair_symbol, request.benchmark_symbol) if s]
+    return sorted(set(symbols))
+
+
+def data_versions(request: BacktestRequest) -> Tuple[int, ...]:
+    # 盤中 K 棒直接串流讀取本地檔案，不經價格快取，版本為 0 即不快取
+    if request.timeframe in INTRADAY_TIMEFRAMES:
+        return (0,)
+    return tuple(price_cache.version(symbol) for symbol in data_symbols(request))
+
+
+def _personalize(
+    stored: Dict, request: BacktestRequest, backtest_id: int
+) -> BacktestResult:
+    """由快取內容重建結果 (新的物件)，換上此請求的 id、名稱與建立時間"""
+    return BacktestResult.model_validate(
+        {
+            **stored,
+            "id": backtest_id,
+            "strategy_name": request.strategy_name,
+            "created_at": datetime.now().strftime("%Y-%m-%d %H:%M"),
+        }
+    )
+
+
+class _Flight:
+    """進行中的計算 (其他相同請求等待 done)"""
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result: Optional[Dict] = None
+        self.error: Optional[Exception] = None
+
+
+class ResultCache:
+    """行程內 LRU 結果快取"""
+
+    def __init__(
+        self,
+        max_entries: int = RESULT_CACHE_MAX_ENTRIES,
+        open_ttl: float = RESULT_CACHE_OPEN_TTL_SECONDS,
+    ):
+        self.max_entries = max_entries
+        self.open_ttl = open_ttl
+        self._entries: "OrderedDict[str, Dict]" = OrderedDict()
+        self._inflight: Dict[str, _Flight] = {}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.coalesced = 0
+
+    def _valid_entry(self, key: str, request: BacktestRequest) -> Optional[Dict]:
+        """呼叫端需持有 _lock"""
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        expired = entry["expires"] is not None and time.monotonic() >= entry["expires"]
+        if expired or entry["versions"] != data_versions(request):
+            del self._entries[key]
+            return None
+        self._entries.move_to_end(key)
+        return entry
+
+    def lookup(
+        self, request: BacktestRequest, backtest_id: int = 0
+    ) -> Optional[BacktestResult]:
+        """命中時回傳結果副本，否則 None"""
+        key = request_key(request)
+        with self._lock:
+            entry = self._valid_entry(key, request)
+            if entry is None:
+                return None
+            self.hits += 1
+        return _personalize(entry["result"], request, backtest_id)
+
+    def store(self, request: BacktestRequest, result: BacktestResult) -> None:
+        """
+        寫入計算結果 (計算後呼叫，記錄當下的資料版本)
+
+        價格快取只會在已涵蓋區間之外補入資料，因此計算完成後的版本即對應結果所用的
+        資料；唯一的例外是結束日在今天之後的請求，由 open_ttl 限制其存活時間。
+        """
+        versions = data_versions(request)
+        if self.max_entries <= 0 or not all(versions):
+            return
+        expires = None
+        if request.end_date > date.today().isoformat():
+            expires = time.monotonic() + self.open_ttl
+        key = request_key(request)
+        entry = {
+            # 以 dict 保存 (比深複製模型快)，命中時重新建立模型
+            "result": result.model_dump(),
+            "versions": versions,
+            "expires": expires,
+        }
+        with self._lock:
+            self._entries[key] = entry
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def get_or_compute(
+        self,
+        request: BacktestRequest,
+        backtest_id: int,
+        compute: Callable[[], BacktestResult],
+        token: Optional[CancellationToken] = None,
+    ) -> BacktestResult:
+        """
+        命中則直接回傳；相同請求正在計算時等待其結果；否則呼叫 compute 並寫入快取
+
+        負責計算的請求被取消時，等待中的請求改由其中一個重新計算。
+        """
+        key = request_key(request)
+        while True:
+            with self._lock:
+                entry = self._valid_entry(key, request)
+                if entry is not None:
+                    self.hits += 1
+                    flight, leader = None, False
+                else:
+                    flight = self._inflight.get(key)
+                    leader = flight is None
+                    if leader:
+                        flight = self._inflight[key] = _Flight()
+                        self.misses += 1
+                    else:
+                        self.coalesced += 1
+            if entry is not None:
+                return _personalize(entry["result"], request, backtest_id)
+            if leader:
+                break
+            while not flight.done.wait(COALESCE_POLL_SECONDS):
+                if token is not None:
+                    token.check()
+            if flight.error is None:
+                return _personalize(flight.result, request, backtest_id)
+            if not isinstance(flight.error, OperationCancelled):
+                raise flight.error
+
+        try:
+            result = compute()
+            self.store(request, result)
+            flight.result = result.model_dump()
+            return result
+        except Exception as e:
+            flight.error = e
+            raise
+        finally:
+            with self._lock:
+                self._inflight.pop(key, None)
+            flight.done.set()
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {
+                "entries": len(self._entries),
+                "hits": self.hits,
+                "misses": self.misses,
+                "coalesced": self.coalesced,
+            }
+
+
+result_cache = ResultCache()
+
+
+def cached_backtest(
+    request: BacktestRequest,
+    backtest_id: int,
+    token: Optional[CancellationToken] = None,
+) -> BacktestResult:
+    """經由結果快取執行 run_full_backtest"""
+    return result_cache.get_or_compute(
+        request,
+        backtest_id,
+        lambda: run_full_backtest(request, backtest_id, token),
+        token,
+    )
@@ -0,0 +1,229 @@
+"""
+Monte Carlo 穩健性分析 - 以區塊重抽或 GBM 產生大量價格路徑，批次跑同一組策略參數
+
+所有路徑組成 (Days, Paths) 價格矩陣，分批交給批次核心與績效指標核心計算
+(每批 ROBUSTNESS_BATCH_PATHS 條路徑，批次之間檢查取消與運算預算)，
+模擬本身不需要任何網路存取。
+"""
+
+import os
+from typing import Callable, Optional
+
+import numpy as np
+import pandas as pd
+
+from app.core.cancellation import CancellationToken
+from app.models.backtest import (
+    MetricDistribution,
+    RobustnessMethod,
+    RobustnessRequest,
+    RobustnessResult,
+    StrategyType,
+    Timeframe,
+)
+from app.services.batch_kernel import simulate_long_only
+from app.services.stops import StopRules
+from app.services.strategy_registry import build_signal_matrix
+from app.services.metrics import _clean_float, compute_metrics
+from app.services.price_bars import PriceBars, total_invested
+from app.services.strategy_dsl import ExpressionEvaluator
+from app.services.timeframes import periods_per_year
+
+_UNSUPPORTED = (StrategyType.MOMENTUM_ROTATION, StrategyType.PAIRS_TRADING)
+# 直接提供價格時各週期 K 棒的日期頻率 (週 / 月 K 以期末交易日為日期)
+_PRICE_FREQUENCIES = {
+    Timeframe.DAILY: "B",
+    Timeframe.WEEKLY: "W-FRI",
+    Timeframe.MONTHLY: "BM",
+}
+
+HISTOGRAM_BINS = 20
+ROBUSTNESS_BATCH_PATHS = int(os.getenv("ROBUSTNESS_BATCH_PATHS", "250"))
+
+
+def bootstrap_log_returns(
+    log_returns: np.ndarray,
+    n_paths: int,
+    block_size: int,
+    rng: np.random.Generator,
+) -> np.ndarray:
+    """
+    移動區塊重抽 (moving block bootstrap)
+
+    Returns:
+        (len(log_returns), n_paths) 的重抽日對數報酬
+    """
+    m = len(log_returns)
+    block_size = max(1, min(block_size, m))
+    n_blocks = -(-m // block_size)
+    starts = rng.integers(0, m - block_size + 1, size=(n_blocks, n_paths))
+    index = starts[:, None, :] + np.arange(block_size)[None, :, None]
+    index = index.reshape(n_blocks * block_size, n_paths)[:m]
+    return log_returns[index]
+
+
+def gbm_log_returns(
+    log_returns: np.ndarray,
+    n_paths: int,
+    rng: np.random.Generator,
+) -> np.ndarray:
+    """以歷史日對數報酬的平均與標準差 (即 mu - sigma^2/2 與 sigma) 產生 GBM 報酬"""
+    drift = log_returns.mean()
+    volatility = log_returns.std(ddof=1) if len(log_returns) > 1 else 0.0
+    return rng.normal(drift, volatility, size=(len(log_returns), n_paths))
+
+
+def simulate_price_paths(
+    close: np.ndarray,
+    method: RobustnessMethod,
+    n_paths: int,
+    block_size: int = 20,
+    seed: Optional[int] = None,
+) -> np.ndarray:
+    """
+    由實際收盤價產生模擬價格路徑 (起點與實際價格相同)
+
+    Returns:
+        (Days, n_paths) 價格矩陣
+    """
+    close = np.asarray(close, dtype=float)
+    if len(close) < 3 or not np.all(np.isfinite(close)) or np.any(close <= 0):
+        raise ValueError("模擬需要至少 3 筆有效的正收盤價")
+
+    rng = np.random.default_rng(seed)
+    log_returns = np.diff(np.log(close))
+    if method == RobustnessMethod.GBM:
+        simulated = gbm_log_returns(log_returns, n_paths, rng)
+    else:
+        simulated = bootstrap_log_returns(log_returns, n_paths, block_size, rng)
+
+    paths = np.empty((len(close), n_paths))
+    paths[0] = close[0]
+    paths[1:] = close[0] * np.exp(np.cumsum(simulated, axis=0))
+    return paths
+
+
+def _distribution(values: np.ndarray) -> MetricDistribution:
+    values = values[np.isfinite(values)]
+    if len(values) == 0:
+        values = np.zeros(1)
+    p5, p25, p50, p75, p95 = np.percentile(values, [5, 25, 50, 75, 95])
+    counts, edges = np.histogram(values, bins=HISTOGRAM_BINS)
+    return MetricDistribution(
+        mean=round(float(values.mean()), 4),
+        std=round(float(values.std()), 4),
+        min=round(float(values.min()), 4),
+        max=round(float(values.max()), 4),
+        p5=round(float(p5), 4),
+        p25=round(float(p25), 4),
+        p50=round(float(p50), 4),
+        p75=round(float(p75), 4),
+        p95=round(float(p95), 4),
+        histogram=counts.tolist(),
+        bin_edges=[round(float(e), 4) for e in edges],
+    )
+
+
+def run_robustness(
+    request: RobustnessRequest,
+    token: Optional[CancellationToken] = None,
+    progress: Optional[Callable[[float], None]] = None,
+) -> RobustnessResult:
+    """
+    對模擬價格路徑批次回測並回傳報酬、夏普比率與最大回撤的分佈
+
+    實際價格路徑放在第 0 欄一起計算，作為對照。DCA 以批次核心近似：
+    每個投入日注入 dca_amount 並以全部現金買入，期末不平倉，報酬相對總投入。
+    token 要求停止時以已模擬的路徑計算分佈 (truncated=True)。
+    progress 在每批路徑完成後以完成比例 (0 ~ 1) 呼叫。
+    """
+    template = request.template
+    if template.strategy_type in _UNSUPPORTED or template.stock_allocations:
+        raise ValueError("穩健性分析僅支援單一股票策略")
+
+    if request.prices is not None:
+        if template.timeframe not in _PRICE_FREQUENCIES:
+            raise ValueError("穩健性分析不支援盤中週期")
+        close = np.asarray(request.prices, dtype=float)
+        dates = [
+            d.strftime("%Y-%m-%d")
+            for d in pd.date_range(
+                template.start_date,
+                periods=len(close),
+                freq=_PRICE_FREQUENCIES[template.timeframe],
+            )
+        ]
+        bars = PriceBars(dates, {"close": close})
+    else:
+        bars = PriceBars.fetch(template)
+    close = bars.close
+    dates = bars.dates
+
+    paths = simulate_price_paths(
+        close, request.method, request.n_paths, request.block_size, request.seed
+    )
+    prices = np.column_stack([close, paths])
+    n_days, n_cols = prices.shape
+
+    payday = bars.paydays(template)
+    is_dca = template.strategy_type == StrategyType.DCA
+    initial_cash = 0.0 if is_dca else template.initial_capital
+    injections = bars.injections(template)
+    invested = total_invested(initial_cash, injections)
+
+    # 各欄互相獨立，分批模擬的結果與一次模擬相同
+    equities = []
+    done = 0
+    while done < n_cols:
+        if done and token is not None and token.should_stop():
+            break
+        size = ROBUSTNESS_BATCH_PATHS
+        if token is not None:
+            size = token.batch_limit(size, n_days)
+        # 第一批至少包含實際路徑與一條模擬路徑
+        size = min(max(size, 2 if done == 0 else 1), n_cols - done)
+        batch = prices[:, done : done + size]
+        if is_dca:
+            signals = np.repeat(payday[:, None].astype(np.int8), size, axis=1)
+        else:
+            # 模擬路徑只有收盤價；提供日期讓 weekly() / monthly() 可以使用
+            evaluator = ExpressionEvaluator({"close": batch}, dates)
+            signals = build_signal_matrix(template, batch, evaluator)
+        kernel = simulate_long_only(
+            batch,
+            signals,
+            initial_cash,
+            injections=injections,
+            sell_ratio=template.sell_ratio,
+            liquidate_at_end=not is_dca,
+            record_trades=False,
+            stops=None if is_dca else StopRules.from_request(template),
+        )
+        equities.append(kernel.equity)
+        done += size
+        if token is not None:
+            token.charge(size * n_days)
+        if progress is not None:
+            progress(done / n_cols)
+
+    metrics = compute_metrics(
+        np.concatenate(equities, axis=1),
+        invested,
+        periods_per_year=periods_per_year(template.timeframe),
+    )
+
+    total_return = metrics["total_return"]
+    return RobustnessResult(
+        method=request.method.value,
+        n_paths=done - 1,
+        n_days=n_days,
+        original={
+            key: round(_clean_float(metrics[key][0]), 2)
+            for key in ("total_return", "sharpe_ratio", "max_drawdown")
+        },
+        total_return=_distribution(total_return[1:]),
+        sharpe_ratio=_distribution(metrics["sharpe_ratio"][1:]),
+        max_drawdown=_distribution(metrics["max_drawdown"][1:]),
+        prob_loss=round(float((total_return[1:] < 0).mean() * 100), 2),
+        truncated=done < n_cols,
+    )
@@ -0,0 +1,79 @@
+"""
+交易日曆工具 - 以向量化方式找出定期投入日
+"""
+
+from typing import List
+
+import numpy as np
+import pandas as pd
+
+from app.models.backtest import InvestmentInterval
+
+
+def contribution_mask(
+    dates: List[str],
+    interval: InvestmentInterval,
+    target_day: int,
+    target_month: int = 1,
+) -> np.ndarray:
+    """
+    回傳每個交易日是否為定期投入日的布林陣列
+
+    規則與 BacktestEngine 相同：每個週期 (月 / 年的目標月份) 取第一個
+    日期 >= target_day 的交易日，若整個週期都沒有則取該週期最後一個交易日。
+    """
+    n = len(dates)
+    mask = np.zeros(n, dtype=bool)
+    if n == 0:
+        return mask
+
+    dt = pd.DatetimeIndex(pd.to_datetime(dates))
+    years = dt.year.to_numpy()
+    months = dt.month.to_numpy()
+    days = dt.day.to_numpy()
+
+    if interval == InvestmentInterval.YEARLY:
+        rows = np.flatnonzero(months == target_month)
+        keys = years[rows]
+    else:
+        rows = np.arange(n)
+        keys = years * 12 + months
+
+    if len(rows) == 0:
+        return mask
+
+    # 週期在時間上連續，找出每段的起訖位置
+    starts = np.flatnonzero(np.r_[True, keys[1:] != keys[:-1]])
+    ends = np.r_[starts[1:], len(rows)] - 1
+
+    # 每段第一個符合日期條件的位置，沒有則退回段尾
+    candidates = np.where(days[rows] >= target_day, np.arange(len(rows)), len(rows))
+    first_eligible = np.minimum.reduceat(candidates, starts)
+    chosen = np.where(first_eligible <= ends, first_eligible, ends)
+
+    mask[rows[chosen]] = True
+    return mask
+
+
+def period_start_mask(dates: List[str], frequency: str) -> np.ndarray:
+    """
+    回傳每個交易日是否為新週期 (MONTHLY / QUARTERLY / YEARLY) 的第一個交易日
+
+    第一筆資料不視為週期起點 (回測開始當天不需要再平衡)。
+    """
+    n = len(dates)
+    if n == 0:
+        return np.zeros(0, dtype=bool)
+
+    dt = pd.DatetimeIndex(pd.to_datetime(dates))
+    years = dt.year.to_numpy()
+    months = dt.month.to_numpy()
+
+    if frequency == "YEARLY":
+        keys = years
+    elif frequency == "QUARTERLY":
+        keys = years * 4 + (months - 1) // 3
+    else:
+        keys = years * 12 + months
+
+    return np.r_[False, keys[1:] != keys[:-1]]
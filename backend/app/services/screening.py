@@ -0,0 +1,167 @@
+"""
+全市場篩選 - 同一組策略參數平行套用到大量股票，只回傳精簡的排名摘要
+"""
+
+import os
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Optional, Tuple
+
+import numpy as np
+
+from app.core.cancellation import CancellationToken
+from app.models.backtest import (
+    BacktestRequest,
+    BacktestResult,
+    BacktestSummary,
+    StrategyType,
+    ScreenRequest,
+    ScreenResponse,
+    ScreenResultItem,
+    ScreenFailure,
+    ScreenRankMetric,
+)
+from app.services.backtest_engine import BacktestEngine
+from app.services.strategy_registry import build_signal_matrix
+from app.services.batch_kernel import simulate_long_only
+from app.services.metrics import summarize_equity
+from app.services.price_bars import PriceBars, total_invested
+from app.services.result_cache import cached_backtest
+from app.services.stops import StopRules
+from app.services.timeframes import periods_per_year
+
+SCREEN_MAX_WORKERS = int(os.getenv("SCREEN_MAX_WORKERS", "8"))
+
+_UNSUPPORTED = (StrategyType.MOMENTUM_ROTATION, StrategyType.PAIRS_TRADING)
+
+
+def summarize_symbol(request: BacktestRequest) -> BacktestSummary:
+    """
+    單一股票的績效摘要
+
+    技術分析策略直接走批次核心 (不建立逐筆 DataFrame 欄位與 JSON 結果)，
+    DCA 則沿用 BacktestEngine 的流程。
+    """
+    if request.strategy_type == StrategyType.DCA:
+        engine = BacktestEngine(request)
+        engine.fetch_data()
+        engine.calculate_indicators()
+        engine.generate_signals()
+        engine.run_backtest()
+        return engine.calculate_metrics()
+
+    bars = PriceBars.fetch(request)
+    signals = build_signal_matrix(request, bars.close, bars.evaluator())
+    injections = bars.injections(request)
+    kernel = simulate_long_only(
+        bars.close[:, None],
+        signals[:, None],
+        request.initial_capital,
+        injections=injections,
+        sell_ratio=request.sell_ratio,
+        stops=StopRules.from_request(request),
+        **bars.ohlc(),
+    )
+    equity = kernel.equity[:, 0]
+    pnls = [ev["pnl"] for ev in kernel.trades if ev["pnl"] is not None]
+    return summarize_equity(
+        equity,
+        total_invested(request.initial_capital, injections),
+        pnls,
+        periods_per_year=periods_per_year(request.timeframe),
+    )
+
+
+def _rank_key(summary: BacktestSummary, metric: ScreenRankMetric) -> float:
+    if metric == ScreenRankMetric.TOTAL_RETURN:
+        return summary.total_return
+    if metric == ScreenRankMetric.ANNUALIZED_RETURN:
+        return summary.annualized_return
+    if metric == ScreenRankMetric.MAX_DRAWDOWN:
+        return summary.max_drawdown
+    if metric == ScreenRankMetric.SORTINO:
+        return summary.sortino_ratio
+    if metric == ScreenRankMetric.CALMAR:
+        return summary.calmar_ratio
+    if metric == ScreenRankMetric.ULCER_INDEX:
+        return -summary.ulcer_index
+    return summary.sharpe_ratio
+
+
+def _stock_request(template: BacktestRequest, symbol: str) -> BacktestRequest:
+    return template.model_copy(
+        update={"stock_symbol": symbol, "stock_allocations": None}
+    )
+
+
+def run_screen(
+    request: ScreenRequest, token: Optional[CancellationToken] = None
+) -> ScreenResponse:
+    """
+    對 symbols 平行執行同一策略並依 rank_by 排名
+
+    以執行緒平行處理，所有工作共用同一個行程內價格快取。
+    token 取消或超過預算時尚未開始的股票不再執行，並拋出 OperationCancelled。
+    """
+    template = request.template
+    if template.strategy_type in _UNSUPPORTED:
+        raise ValueError(f"{template.strategy_type.value} 策略不支援逐檔篩選")
+
+    symbols = list(dict.fromkeys(s.strip() for s in request.symbols if s.strip()))
+    if not symbols:
+        raise ValueError("symbols 不可為空")
+
+    def evaluate(symbol: str) -> Tuple[str, BacktestSummary]:
+        if token is not None:
+            token.check()
+        return symbol, summarize_symbol(_stock_request(template, symbol))
+
+    successes: List[Tuple[str, BacktestSummary]] = []
+    failures: List[ScreenFailure] = []
+    workers = max(1, min(SCREEN_MAX_WORKERS, len(symbols)))
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        futures = {symbol: pool.submit(evaluate, symbol) for symbol in symbols}
+        for symbol, future in futures.items():
+            try:
+                successes.append(future.result())
+            except Exception as e:
+                failures.append(ScreenFailure(stock_symbol=symbol, error=str(e)))
+    if token is not None:
+        token.check()
+
+    keys = np.array([_rank_key(s, request.rank_by) for _, s in successes])
+    order = np.argsort(-keys, kind="stable") if len(keys) else []
+
+    results = [
+        ScreenResultItem(
+            rank=rank + 1,
+            stock_symbol=successes[i][0],
+            total_return=successes[i][1].total_return,
+            annualized_return=successes[i][1].annualized_return,
+            sharpe_ratio=successes[i][1].sharpe_ratio,
+            max_drawdown=successes[i][1].max_drawdown,
+            win_rate=successes[i][1].win_rate,
+            total_trades=successes[i][1].total_trades,
+        )
+        for rank, i in enumerate(order)
+    ]
+    return ScreenResponse(
+        rank_by=request.rank_by.value, results=results, failures=failures
+    )
+
+
+def run_top_backtests(
+    request: ScreenRequest,
+    response: ScreenResponse,
+    token: Optional[CancellationToken] = None,
+) -> List[Tuple[ScreenResultItem, BacktestRequest, BacktestResult]]:
+    """排名前 top_k 檔的完整回測 (經由結果快取)，供路由保存"""
+    outcomes = []
+    for item in response.results[: request.top_k]:
+        stock_request = _stock_request(request.template, item.stock_symbol)
+        stock_request = stock_request.model_copy(
+            update={
+                "strategy_name": f"{stock_request.strategy_name}_{item.stock_symbol}"
+            }
+        )
+        outcomes.append((item, stock_request, cached_backtest(stock_request, 0, token)))
+    return outcomes
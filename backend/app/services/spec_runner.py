@@ -0,0 +1,254 @@
+"""
+規格檔批次執行 - 讀取 YAML / JSON 回測與最佳化規格，以多行程執行並輸出欄式結果檔
+
+回測規格依主股票分組，每組交給同一個行程以 run_backtest_batch 執行 (同組共用
+價格快取、指標與批次核心)；最佳化規格各自以 optimize_parameter_grid /
+optimize_dca_allocation 執行。回測與最佳化程式與 API 相同，離線與線上結果一致。
+
+用法見 app/cli.py。
+"""
+
+import importlib.util
+import itertools
+import json
+import os
+from collections import defaultdict
+from concurrent.futures import ProcessPoolExecutor
+from typing import Any, Dict, List, Optional, Tuple
+
+import pandas as pd
+import yaml
+from pydantic import ValidationError
+
+from app.models.backtest import (
+    BacktestRequest,
+    BacktestResult,
+    OptimizeRequest,
+    StrategyType,
+)
+from app.services.backtest_engine import optimize_dca_allocation
+from app.services.batch_backtest import run_backtest_batch
+from app.services.market_data import use_local_data
+from app.services.optimizer import optimize_parameter_grid
+
+OUTPUT_FORMATS = ("parquet", "arrow", "csv")
+_EXTENSIONS = {"parquet": ".parquet", "arrow": ".arrow", "csv": ".csv"}
+
+
+def _expand(spec: Dict[str, Any], defaults: Dict[str, Any]) -> List[Dict[str, Any]]:
+    """套用 defaults 並展開 matrix ({欄位: [值, ...]} 的所有組合)"""
+    spec = {**defaults, **spec}
+    matrix = spec.pop("matrix", None) or {}
+    if not isinstance(matrix, dict):
+        raise ValueError("matrix 必須是 {欄位: [值, ...]}")
+    fields = list(matrix)
+    choices = [v if isinstance(v, list) else [v] for v in matrix.values()]
+    return [
+        {**spec, **dict(zip(fields, values))} for values in itertools.product(*choices)
+    ]
+
+
+def _default_name(spec: Dict[str, Any]) -> str:
+    strategy = spec.get("strategy_type", StrategyType.MA_CROSS.value)
+    return f"{strategy} {spec.get('stock_symbol', '')}"
+
+
+def load_specs(path: str) -> Tuple[List[BacktestRequest], List[OptimizeRequest]]:
+    """
+    讀取規格檔 (.yaml / .yml / .json)
+
+    內容可為回測規格的列表，或含 defaults / backtests / optimizations 的物件。
+    日期可寫成 YAML 日期或 YYYY-MM-DD 字串。
+    """
+    with open(path, encoding="utf-8") as f:
+        if path.endswith(".json"):
+            document = json.load(f)
+        else:
+            document = yaml.safe_load(f)
+    if isinstance(document, list):
+        document = {"backtests": document}
+    if not isinstance(document, dict):
+        raise ValueError("規格檔必須是列表或含 backtests / optimizations 的物件")
+
+    defaults = document.get("defaults") or {}
+    backtests, optimizations = [], []
+    try:
+        for spec in document.get("backtests") or []:
+            for item in _expand(spec, defaults):
+                item = {
+                    k: str(v) if k.endswith("_date") else v for k, v in item.items()
+                }
+                item.setdefault("strategy_name", _default_name(item))
+                backtests.append(BacktestRequest(**item))
+        for spec in document.get("optimizations") or []:
+            for item in _expand(spec, defaults):
+                item = {
+                    k: str(v) if k.endswith("_date") else v for k, v in item.items()
+                }
+                item.pop("strategy_name", None)
+                optimizations.append(OptimizeRequest(**item))
+    except ValidationError as e:
+        raise ValueError(f"規格格式錯誤: {e}")
+    return backtests, optimizations
+
+
+def _summary_row(
+    run: int, request: BacktestRequest, result: Optional[BacktestResult], error
+) -> Dict[str, Any]:
+    row = {
+        "run": run,
+        "strategy_name": request.strategy_name,
+        "stock_symbol": request.stock_symbol,
+        "strategy_type": request.strategy_type.value,
+        "start_date": request.start_date,
+        "end_date": request.end_date,
+        "initial_capital": request.initial_capital,
+        "request": json.dumps(request.model_dump(mode="json"), ensure_ascii=False),
+        "error": error,
+    }
+    if result is not None:
+        row["final_capital"] = result.final_capital
+        row.update(result.summary.model_dump())
+    return row
+
+
+def _run_backtest_group(
+    members: List[Tuple[int, BacktestRequest]],
+) -> List[Tuple[Dict[str, Any], Optional[Tuple[List[str], List[float]]]]]:
+    """同一主股票的回測 (於 worker 行程執行，只回傳摘要列與權益曲線)"""
+    outcomes = run_backtest_batch([request for _, request in members])
+    rows = []
+    for (run, request), (result, error) in zip(members, outcomes):
+        equity = None
+        if result is not None:
+            equity = (result.equity_data.dates, result.equity_data.equity)
+        rows.append((_summary_row(run, request, result, error), equity))
+    return rows
+
+
+def _run_optimization(run: int, request: OptimizeRequest) -> Dict[str, Any]:
+    row: Dict[str, Any] = {
+        "run": run,
+        "stock_symbol": request.stock_symbol,
+        "strategy_type": request.strategy_type.value,
+        "start_date": request.start_date,
+        "end_date": request.end_date,
+        "request": json.dumps(request.model_dump(mode="json"), ensure_ascii=False),
+        "error": None,
+    }
+    try:
+        if request.strategy_type == StrategyType.DCA:
+            result = optimize_dca_allocation(request)
+        else:
+            result = optimize_parameter_grid(request)
+    except Exception as e:
+        row["error"] = str(e) if isinstance(e, ValueError) else f"最佳化失敗: {str(e)}"
+        return row
+    row.update(result.model_dump(exclude={"heatmap_data", "x_labels", "y_labels"}))
+    if row["best_allocation"] is not None:
+        row["best_allocation"] = json.dumps(row["best_allocation"])
+    # 熱力圖座標為索引，換成實際參數值
+    row["grid"] = [
+        (result.x_labels[x], result.y_labels[y], value)
+        for x, y, value in result.heatmap_data or []
+    ]
+    return row
+
+
+def _init_worker(data_dir: Optional[str]) -> None:
+    if data_dir:
+        use_local_data(data_dir)
+
+
+def run_specs(
+    backtests: List[BacktestRequest],
+    optimizations: List[OptimizeRequest],
+    processes: int = 1,
+    data_dir: Optional[str] = None,
+) -> Dict[str, pd.DataFrame]:
+    """
+    執行所有規格
+
+    Returns:
+        {"summaries", "equity", "optimizations", "grid"} 四個表 (列依規格順序)
+    """
+    groups: Dict[str, List[Tuple[int, BacktestRequest]]] = defaultdict(list)
+    for run, request in enumerate(backtests):
+        groups[request.stock_symbol].append((run, request))
+    # 大的分組先送出，行程間負載較平均
+    ordered = sorted(groups.values(), key=len, reverse=True)
+
+    if processes <= 1:
+        _init_worker(data_dir)
+        group_rows = [_run_backtest_group(members) for members in ordered]
+        opt_rows = [_run_optimization(run, r) for run, r in enumerate(optimizations)]
+    else:
+        with ProcessPoolExecutor(
+            max_workers=processes, initializer=_init_worker, initargs=(data_dir,)
+        ) as pool:
+            group_futures = [pool.submit(_run_backtest_group, m) for m in ordered]
+            opt_futures = [
+                pool.submit(_run_optimization, run, r)
+                for run, r in enumerate(optimizations)
+            ]
+            group_rows = [future.result() for future in group_futures]
+            opt_rows = [future.result() for future in opt_futures]
+
+    summaries, equity = [], []
+    for row, curve in itertools.chain.from_iterable(group_rows):
+        summaries.append(row)
+        if curve is not None:
+            dates, values = curve
+            equity.append(
+                pd.DataFrame({"run": row["run"], "date": dates, "equity": values})
+            )
+    grid = [
+        {"run": row["run"], "param1": x, "param2": y, "value": value}
+        for row in opt_rows
+        for x, y, value in row.pop("grid", [])
+    ]
+
+    summary_df = pd.DataFrame(summaries)
+    if not summary_df.empty:
+        summary_df = summary_df.sort_values("run").reset_index(drop=True)
+    return {
+        "summaries": summary_df,
+        "equity": (
+            pd.concat(equity, ignore_index=True).sort_values("run", kind="stable")
+            if equity
+            else pd.DataFrame(columns=["run", "date", "equity"])
+        ),
+        "optimizations": pd.DataFrame(opt_rows),
+        "grid": pd.DataFrame(grid, columns=["run", "param1", "param2", "value"]),
+    }
+
+
+def resolve_format(fmt: str) -> str:
+    """確認輸出格式可用 (parquet / arrow 需要 pyarrow，csv 需明確指定)"""
+    if fmt in ("parquet", "arrow") and importlib.util.find_spec("pyarrow") is None:
+        raise ValueError(
+            f"輸出 {fmt} 需要安裝 pyarrow (pip install pyarrow)，或改用 --format csv"
+        )
+    if fmt not in _EXTENSIONS:
+        raise ValueError(f"不支援的輸出格式: {fmt}")
+    return fmt
+
+
+def write_tables(
+    tables: Dict[str, pd.DataFrame], output_dir: str, fmt: str
+) -> List[str]:
+    """將各表寫入 output_dir/<表名>.<副檔名>，回傳寫入的路徑 (空表略過)"""
+    os.makedirs(output_dir, exist_ok=True)
+    paths = []
+    for name, df in tables.items():
+        if df.empty:
+            continue
+        path = os.path.join(output_dir, name + _EXTENSIONS[fmt])
+        if fmt == "parquet":
+            df.to_parquet(path, index=False)
+        elif fmt == "arrow":
+            df.reset_index(drop=True).to_feather(path)
+        else:
+            df.to_csv(path, index=False)
+        paths.append(path)
+    return paths
@@ -0,0 +1,138 @@
+"""
+停損 / 停利 / 移動停損 - 以向量化方式找出進場後第一個觸價的交易日
+
+每次進場 (或加碼改變平均成本) 時，對「到下一個策略訊號為止」的整段區間一次計算
+各停損價位與觸價條件，回測迴圈只需在排定的出場日處理，不必逐日檢查。
+"""
+
+from typing import NamedTuple, Optional, Tuple
+
+import numpy as np
+
+from app.models.backtest import BacktestRequest
+
+STOP_LOSS = "STOP_LOSS"
+TAKE_PROFIT = "TAKE_PROFIT"
+TRAILING_STOP = "TRAILING_STOP"
+
+
+class StopRules(NamedTuple):
+    stop_loss: Optional[float]  # 相對平均成本的跌幅 (0.1 = -10%)
+    take_profit: Optional[float]  # 相對平均成本的漲幅
+    trailing_stop: Optional[float]  # 相對進場後最高價的回落幅度
+    intrabar: bool  # True 時以 High/Low 判斷觸價，否則以收盤價
+
+    @classmethod
+    def from_request(cls, request: BacktestRequest) -> Optional["StopRules"]:
+        """請求未設定任何出場規則時回傳 None"""
+        if (
+            request.stop_loss is None
+            and request.take_profit is None
+            and request.trailing_stop is None
+        ):
+            return None
+        return cls(
+            request.stop_loss,
+            request.take_profit,
+            request.trailing_stop,
+            request.stop_intrabar,
+        )
+
+
+class StopHit(NamedTuple):
+    bar: int
+    price: float
+    reason: str
+
+
+def first_stop_hit(
+    rules: StopRules,
+    avg_cost: float,
+    peak: float,
+    start: int,
+    end: int,
+    close: np.ndarray,
+    open_: Optional[np.ndarray] = None,
+    high: Optional[np.ndarray] = None,
+    low: Optional[np.ndarray] = None,
+) -> Tuple[Optional[StopHit], float]:
+    """
+    在 [start, end) 區間找出第一個觸發出場的交易日
+
+    移動停損以「前一日為止」的最高價計算當日停損價；同一日同時觸及停損與停利時
+    保守地視為停損。盤中模式若開盤即跳空穿越價位，以開盤價成交。
+
+    Args:
+        avg_cost: 持倉平均成本
+        peak: 區間開始前的最高參考價 (新倉為進場價)
+        start, end: 搜尋區間 (end 不含)
+
+    Returns:
+        (觸價資訊或 None, 區間結束時的最高參考價)
+    """
+    intrabar = rules.intrabar and high is not None and low is not None
+    seg_close = close[start:end]
+    if len(seg_close) == 0:
+        return None, peak
+    seg_high = high[start:end] if intrabar else seg_close
+    seg_low = low[start:end] if intrabar else seg_close
+
+    running_peak = np.maximum.accumulate(np.fmax(seg_high, peak))
+    peak_before = np.concatenate([[peak], running_peak[:-1]])
+
+    down_level = np.full(len(seg_close), -np.inf)
+    if rules.stop_loss is not None:
+        down_level[:] = avg_cost * (1 - rules.stop_loss)
+    if rules.trailing_stop is not None:
+        trail_level = peak_before * (1 - rules.trailing_stop)
+        is_trailing = trail_level > down_level
+        down_level = np.maximum(down_level, trail_level)
+    else:
+        is_trailing = np.zeros(len(seg_close), dtype=bool)
+    up_level = avg_cost * (1 + rules.take_profit) if rules.take_profit else np.inf
+
+    with np.errstate(invalid="ignore"):
+        hit_down = seg_low <= down_level
+        hit_up = seg_high >= up_level
+    hits = hit_down | hit_up
+    if not hits.any():
+        return None, float(running_peak[-1])
+
+    k = int(np.argmax(hits))
+    bar = start + k
+    if hit_down[k]:
+        reason = TRAILING_STOP if is_trailing[k] else STOP_LOSS
+        if intrabar:
+            price = float(down_level[k])
+            if open_ is not None and np.isfinite(open_[bar]):
+                price = min(price, float(open_[bar]))
+        else:
+            price = float(close[bar])
+    else:
+        reason = TAKE_PROFIT
+        if intrabar:
+            price = float(up_level)
+            if open_ is not None and np.isfinite(open_[bar]):
+                price = max(price, float(open_[bar]))
+        else:
+            price = float(close[bar])
+    return StopHit(bar, price, reason), float(running_peak[k])
+
+
+def next_signal_bars(signals: np.ndarray) -> np.ndarray:
+    """
+    每個交易日之後 (不含當日) 第一個非零訊號的索引，沒有則為 Days
+
+    signals 可為 (Days,) 或 (Days, N)。
+    """
+    signals = np.asarray(signals)
+    n_days = signals.shape[0]
+    index = np.where(
+        signals != 0,
+        np.arange(n_days).reshape((-1,) + (1,) * (signals.ndim - 1)),
+        n_days,
+    )
+    upcoming = np.minimum.accumulate(index[::-1], axis=0)[::-1]
+    result = np.full(signals.shape, n_days)
+    result[:-1] = upcoming[1:]
+    return result
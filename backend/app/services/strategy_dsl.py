@@ -0,0 +1,346 @@
+"""
+策略運算式 - 將使用者定義的運算式編譯成共用的指標 DAG，以 numpy 向量化求值
+
+例如 buy_expression="crossover(sma(close, 20), sma(close, 50)) and rsi(close, 14) < 70"。
+運算式只解析一次 (以 Python ast，僅允許白名單內的語法)，每個子運算式正規化成
+可雜湊的節點鍵，相同的子運算式 (包含最佳化網格中不同參數組合共用的指標)
+在同一個 ExpressionEvaluator 內只計算一次。
+weekly(...) / monthly(...) 在週 K / 月 K 上求值內部運算式，再對回原本的 K 棒
+(只使用已完成的高週期 K 棒)，例如 "close > weekly(sma(close, 40))" 為 40 週均線濾網。
+"""
+
+import ast
+from functools import lru_cache
+from typing import Callable, Dict, Mapping, Optional, Sequence, Tuple
+
+import numpy as np
+
+from app.models.backtest import BacktestRequest, Timeframe
+from app.services.indicators import (
+    cross_above,
+    cross_below,
+    ema,
+    rolling_max,
+    rolling_mean,
+    rolling_std,
+    rsi,
+    shift,
+)
+from app.services.timeframes import align_to_dates, resample_series
+
+MAX_EXPRESSION_LENGTH = 1000
+
+# 可在運算式中使用的價格欄位
+SERIES_NAMES = ("open", "high", "low", "close", "volume")
+
+# 節點鍵：("series", name) / ("const", value) / ("param", name) / (op, *children)
+Node = Tuple
+
+
+def _window(value) -> int:
+    if np.ndim(value) != 0 or not float(value).is_integer() or value < 1:
+        raise ValueError(f"指標週期必須為正整數: {value}")
+    return int(value)
+
+
+def _lowest(x, n):
+    return -rolling_max(-np.asarray(x, dtype=float), _window(n))
+
+
+# 函式名稱 -> (參數個數, 實作)；週期參數必須為常數或已綁定的具名參數
+FUNCTIONS: Dict[str, Tuple[int, Callable]] = {
+    "sma": (2, lambda x, n: rolling_mean(x, _window(n))),
+    "ema": (2, lambda x, n: ema(x, _window(n))),
+    "std": (2, lambda x, n: rolling_std(x, _window(n))),
+    "rsi": (2, lambda x, n: rsi(x, _window(n))),
+    "highest": (2, lambda x, n: rolling_max(x, _window(n))),
+    "lowest": (2, _lowest),
+    "shift": (2, lambda x, n: shift(x, _window(n))),
+    "crossover": (2, cross_above),
+    "crossunder": (2, cross_below),
+    "abs": (1, np.abs),
+}
+
+# 高週期函式：內部運算式改在重採樣後的 K 棒上求值
+TIMEFRAME_FUNCTIONS: Dict[str, Timeframe] = {
+    "weekly": Timeframe.WEEKLY,
+    "monthly": Timeframe.MONTHLY,
+}
+
+_BIN_OPS = {
+    ast.Add: "add",
+    ast.Sub: "sub",
+    ast.Mult: "mul",
+    ast.Div: "div",
+}
+_CMP_OPS = {
+    ast.Lt: "lt",
+    ast.LtE: "le",
+    ast.Gt: "gt",
+    ast.GtE: "ge",
+    ast.Eq: "eq",
+    ast.NotEq: "ne",
+}
+# 可交換的運算：子節點排序後 a+b 與 b+a 共用同一個節點
+_COMMUTATIVE = {"add", "mul", "and", "or", "eq", "ne"}
+
+_OPERATORS: Dict[str, Callable] = {
+    "add": np.add,
+    "sub": np.subtract,
+    "mul": np.multiply,
+    "div": np.divide,
+    "lt": np.less,
+    "le": np.less_equal,
+    "gt": np.greater,
+    "ge": np.greater_equal,
+    "eq": np.equal,
+    "ne": np.not_equal,
+    "neg": np.negative,
+}
+
+
+def _truthy(value):
+    """數值轉布林 (NaN 視為 False)"""
+    arr = np.asarray(value)
+    if arr.dtype == bool:
+        return arr
+    with np.errstate(invalid="ignore"):
+        return (arr != 0) & ~np.isnan(arr.astype(float))
+
+
+def _make(op: str, *children: Node) -> Node:
+    if op in _COMMUTATIVE:
+        children = tuple(sorted(children, key=repr))
+    return (op,) + tuple(children)
+
+
+def _to_node(tree: ast.AST) -> Node:
+    if isinstance(tree, ast.Constant):
+        if isinstance(tree.value, bool):
+            return ("const", 1.0 if tree.value else 0.0)
+        if isinstance(tree.value, (int, float)):
+            return ("const", float(tree.value))
+        raise ValueError(f"不支援的常數: {tree.value!r}")
+
+    if isinstance(tree, ast.Name):
+        name = tree.id.lower()
+        if name in SERIES_NAMES:
+            return ("series", name)
+        return ("param", tree.id)
+
+    if isinstance(tree, ast.BinOp) and type(tree.op) in _BIN_OPS:
+        return _make(_BIN_OPS[type(tree.op)], _to_node(tree.left), _to_node(tree.right))
+
+    if isinstance(tree, ast.UnaryOp):
+        operand = _to_node(tree.operand)
+        if isinstance(tree.op, ast.USub):
+            return _make("neg", operand)
+        if isinstance(tree.op, ast.UAdd):
+            return operand
+        if isinstance(tree.op, ast.Not):
+            return _make("not", operand)
+
+    if isinstance(tree, ast.BoolOp):
+        op = "and" if isinstance(tree.op, ast.And) else "or"
+        node = _to_node(tree.values[0])
+        for value in tree.values[1:]:
+            node = _make(op, node, _to_node(value))
+        return node
+
+    if isinstance(tree, ast.Compare):
+        # a < b < c 展開為 (a < b) and (b < c)
+        left = _to_node(tree.left)
+        node = None
+        for op, comparator in zip(tree.ops, tree.comparators):
+            if type(op) not in _CMP_OPS:
+                raise ValueError("不支援的比較運算")
+            right = _to_node(comparator)
+            part = _make(_CMP_OPS[type(op)], left, right)
+            node = part if node is None else _make("and", node, part)
+            left = right
+        return node
+
+    if isinstance(tree, ast.Call) and isinstance(tree.func, ast.Name):
+        name = tree.func.id.lower()
+        known = name in FUNCTIONS or name in TIMEFRAME_FUNCTIONS
+        if not known or tree.keywords:
+            raise ValueError(f"不支援的函式: {tree.func.id}")
+        n_args = FUNCTIONS[name][0] if name in FUNCTIONS else 1
+        if len(tree.args) != n_args:
+            raise ValueError(f"{name}() 需要 {n_args} 個參數")
+        return (name,) + tuple(_to_node(arg) for arg in tree.args)
+
+    raise ValueError(f"不支援的運算式語法: {type(tree).__name__}")
+
+
+@lru_cache(maxsize=256)
+def compile_expression(text: str) -> Node:
+    """
+    解析運算式為節點樹 (結果以字串快取，同一運算式只解析一次)
+
+    Raises:
+        ValueError: 語法錯誤或使用了不支援的函式/語法
+    """
+    if not text or not text.strip():
+        raise ValueError("運算式不可為空")
+    if len(text) > MAX_EXPRESSION_LENGTH:
+        raise ValueError(f"運算式長度不可超過 {MAX_EXPRESSION_LENGTH} 字元")
+    try:
+        tree = ast.parse(text.strip(), mode="eval")
+    except SyntaxError as e:
+        raise ValueError(f"運算式語法錯誤: {e.msg}")
+    return _to_node(tree.body)
+
+
+def bind_params(node: Node, params: Mapping[str, float]) -> Node:
+    """將 ("param", name) 節點替換為常數，綁定後的節點鍵可跨參數組合共用快取"""
+    if node[0] == "param":
+        if node[1] not in params:
+            raise ValueError(f"運算式使用了未定義的參數: {node[1]}")
+        return ("const", float(params[node[1]]))
+    if node[0] in ("series", "const"):
+        return node
+    return _make(node[0], *(bind_params(child, params) for child in node[1:]))
+
+
+def expression_params(node: Node) -> set:
+    """運算式中引用的參數名稱"""
+    if node[0] == "param":
+        return {node[1]}
+    if node[0] in ("series", "const"):
+        return set()
+    names = set()
+    for child in node[1:]:
+        names |= expression_params(child)
+    return names
+
+
+# 視窗函式需要的前置 K 棒數 (週期 n)；ema 以遞迴狀態接續，不需要前置 K 棒
+_LOOKBACK: Dict[str, Callable[[int], int]] = {
+    "sma": lambda n: n - 1,
+    "std": lambda n: n - 1,
+    "highest": lambda n: n - 1,
+    "lowest": lambda n: n - 1,
+    "rsi": lambda n: n,
+    "shift": lambda n: n,
+    "ema": lambda n: 0,
+}
+
+
+def lookback(node: Node) -> int:
+    """
+    綁定後的節點在某根 K 棒的值需要往前多少根 K 棒的資料 (ema 除外)
+
+    分段計算時每段前面保留這麼多根前一段的 K 棒，視窗類指標即與整段計算相同。
+    """
+    op = node[0]
+    if op in ("series", "const"):
+        return 0
+    if op == "param":
+        raise ValueError(f"運算式參數 {node[1]} 尚未綁定")
+    if op in TIMEFRAME_FUNCTIONS:
+        raise ValueError(f"{op}() 不支援分段計算")
+    if op in _LOOKBACK:
+        # 週期為常數運算式 (例如 2 * p1 綁定後的常數)
+        window = _window(ExpressionEvaluator({}).evaluate(node[2]))
+        return lookback(node[1]) + _LOOKBACK[op](window)
+    extra = 1 if op in ("crossover", "crossunder") else 0
+    return max(lookback(child) for child in node[1:]) + extra
+
+
+def ohlcv_series(df) -> Dict[str, np.ndarray]:
+    """由日 K DataFrame 取出運算式可用的價格欄位"""
+    return {
+        name: df[name.capitalize()].to_numpy(dtype=float)
+        for name in SERIES_NAMES
+        if name.capitalize() in df
+    }
+
+
+class ExpressionEvaluator:
+    """
+    以記憶化方式求值綁定後的節點
+
+    同一個 evaluator 對同一份價格資料求值多個運算式 (例如買入/賣出運算式、
+    或最佳化網格中的每組參數) 時，共同的子運算式只會計算一次。
+    提供 dates 時才能使用 weekly() / monthly()，重採樣後的子 evaluator 也會保留共用。
+    """
+
+    def __init__(
+        self,
+        series: Mapping[str, np.ndarray],
+        dates: Optional[Sequence[str]] = None,
+    ):
+        self.series = {k.lower(): np.asarray(v, dtype=float) for k, v in series.items()}
+        self.dates = list(dates) if dates is not None else None
+        self._cache: Dict[Node, np.ndarray] = {}
+        self._frames: Dict[Timeframe, "ExpressionEvaluator"] = {}
+
+    def _higher_timeframe(self, name: str, node: Node) -> np.ndarray:
+        if self.dates is None:
+            raise ValueError(f"{name}() 需要 K 棒日期")
+        timeframe = TIMEFRAME_FUNCTIONS[name]
+        frame = self._frames.get(timeframe)
+        if frame is None:
+            series, period_dates = resample_series(self.series, self.dates, timeframe)
+            frame = self._frames[timeframe] = ExpressionEvaluator(series, period_dates)
+        return align_to_dates(frame.evaluate(node), frame.dates, self.dates)
+
+    def evaluate(self, node: Node):
+        cached = self._cache.get(node)
+        if cached is not None:
+            return cached
+
+        op = node[0]
+        if op == "const":
+            return node[1]
+        if op == "series":
+            if node[1] not in self.series:
+                raise ValueError(f"運算式需要 {node[1]} 欄位的資料")
+            value = self.series[node[1]]
+        elif op == "param":
+            raise ValueError(f"運算式參數 {node[1]} 尚未綁定")
+        elif op in TIMEFRAME_FUNCTIONS:
+            value = self._higher_timeframe(op, node[1])
+        elif op in FUNCTIONS:
+            func = FUNCTIONS[op][1]
+            args = [self.evaluate(child) for child in node[1:]]
+            with np.errstate(invalid="ignore", divide="ignore"):
+                value = func(*args)
+        elif op == "and":
+            value = _truthy(self.evaluate(node[1])) & _truthy(self.evaluate(node[2]))
+        elif op == "or":
+            value = _truthy(self.evaluate(node[1])) | _truthy(self.evaluate(node[2]))
+        elif op == "not":
+            value = ~_truthy(self.evaluate(node[1]))
+        else:
+            args = [self.evaluate(child) for child in node[1:]]
+            with np.errstate(invalid="ignore", divide="ignore"):
+                value = _OPERATORS[op](*args)
+
+        self._cache[node] = value
+        return value
+
+    def signals(
+        self, buy: Node, sell: Optional[Node], params: Mapping[str, float]
+    ) -> np.ndarray:
+        """買入/賣出運算式 -> 訊號陣列 (1=買入, -1=賣出, 同日皆成立時以賣出為準)"""
+        shape = self.series["close"].shape
+        out = np.zeros(shape, dtype=np.int8)
+        buy_mask = _truthy(self.evaluate(bind_params(buy, params)))
+        out[np.broadcast_to(buy_mask, shape)] = 1
+        if sell is not None:
+            sell_mask = _truthy(self.evaluate(bind_params(sell, params)))
+            out[np.broadcast_to(sell_mask, shape)] = -1
+        return out
+
+
+def compile_request(request: BacktestRequest) -> Tuple[Node, Optional[Node]]:
+    """編譯請求中的買入/賣出運算式"""
+    if not request.buy_expression:
+        raise ValueError("EXPRESSION 策略需要提供 buy_expression")
+    buy = compile_expression(request.buy_expression)
+    sell = (
+        compile_expression(request.sell_expression) if request.sell_expression else None
+    )
+    return buy, sell
@@ -0,0 +1,238 @@
+"""
+策略註冊表 - 每個技術分析策略宣告參數、所需指標與向量化訊號函式
+
+指標以運算式宣告 (見 strategy_dsl)，參數名稱即 BacktestRequest 的欄位名稱。
+所有指標經由同一個 ExpressionEvaluator 求值，因此同時計算多個策略或多組參數時
+(例如最佳化網格)，共用的指標只會計算一次。新增策略只需在此註冊，
+回測引擎、批次核心、篩選與參數最佳化都會自動支援。
+"""
+
+from dataclasses import dataclass, field
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+import numpy as np
+
+from app.models.backtest import BacktestRequest, StrategyType
+from app.services.indicators import cross_above, cross_below
+from app.services.strategy_dsl import (
+    ExpressionEvaluator,
+    bind_params,
+    compile_expression,
+    compile_request,
+)
+
+# 訊號函式：(指標值, evaluator, request) -> int8 訊號陣列 (1=買入, -1=賣出, 0=無訊號)
+SignalFunction = Callable[
+    [Dict[str, np.ndarray], ExpressionEvaluator, BacktestRequest], np.ndarray
+]
+
+
+@dataclass(frozen=True)
+class StrategySpec:
+    strategy_type: StrategyType
+    params: Tuple[str, ...]  # 策略使用的 BacktestRequest 欄位
+    indicators: Dict[str, str]  # 指標 (DataFrame 欄位名稱) -> 運算式
+    signal: SignalFunction
+    grid: Optional[Tuple[str, Optional[str]]] = None  # 最佳化網格的 (param1, param2)
+    ordered_grid: bool = True  # True 時網格的 param2 必須大於 param1
+    params_field: Optional[str] = None  # 具名參數存放在 request 的字典欄位
+    description: str = ""
+    compiled: Dict[str, tuple] = field(default_factory=dict, compare=False)
+
+    def param_values(self, request: BacktestRequest) -> Dict[str, float]:
+        if self.params_field is not None:
+            return dict(getattr(request, self.params_field))
+        return {name: getattr(request, name) for name in self.params}
+
+    def with_params(
+        self, request: BacktestRequest, values: Dict[str, Any]
+    ) -> BacktestRequest:
+        """回傳套用指定參數值的請求副本"""
+        if self.params_field is not None:
+            merged = {**getattr(request, self.params_field), **values}
+            return request.model_copy(update={self.params_field: merged})
+        return request.model_copy(update=values)
+
+
+STRATEGIES: Dict[StrategyType, StrategySpec] = {}
+
+
+def register_strategy(
+    strategy_type: StrategyType,
+    params: Tuple[str, ...],
+    indicators: Dict[str, str],
+    **options,
+):
+    """註冊策略的裝飾器 (被裝飾的函式即訊號函式)"""
+
+    def decorator(func: SignalFunction) -> SignalFunction:
+        STRATEGIES[strategy_type] = StrategySpec(
+            strategy_type=strategy_type,
+            params=params,
+            indicators=indicators,
+            signal=func,
+            compiled={
+                name: compile_expression(text) for name, text in indicators.items()
+            },
+            **options,
+        )
+        return func
+
+    return decorator
+
+
+def get_strategy(strategy_type: StrategyType) -> StrategySpec:
+    spec = STRATEGIES.get(strategy_type)
+    if spec is None:
+        raise ValueError(f"{strategy_type.value} 策略不支援向量化訊號計算")
+    return spec
+
+
+def compute_indicators(
+    request: BacktestRequest, evaluator: ExpressionEvaluator
+) -> Dict[str, np.ndarray]:
+    """只計算策略宣告的指標"""
+    spec = get_strategy(request.strategy_type)
+    params = spec.param_values(request)
+    return {
+        name: evaluator.evaluate(bind_params(node, params))
+        for name, node in spec.compiled.items()
+    }
+
+
+def build_signal_matrix(
+    request: BacktestRequest,
+    close: np.ndarray,
+    evaluator: Optional[ExpressionEvaluator] = None,
+) -> np.ndarray:
+    """
+    依策略參數一次計算整個收盤價矩陣的買賣訊號
+
+    可傳入共用的 evaluator (其 close 需與傳入的 close 相同)，重複利用已計算過的指標。
+
+    Returns:
+        與 close 同形狀的 int8 陣列 (1=買入, -1=賣出, 0=無訊號)
+    """
+    spec = get_strategy(request.strategy_type)
+    evaluator = evaluator or ExpressionEvaluator({"close": close})
+    with np.errstate(invalid="ignore"):
+        return spec.signal(compute_indicators(request, evaluator), evaluator, request)
+
+
+def strategy_schema() -> List[Dict[str, Any]]:
+    """各策略的參數 schema (名稱、型別、預設值) 與可最佳化的網格參數"""
+    fields = BacktestRequest.model_fields
+    schema = []
+    for spec in STRATEGIES.values():
+        schema.append(
+            {
+                "strategy_type": spec.strategy_type.value,
+                "description": spec.description,
+                "params": [
+                    {
+                        "name": name,
+                        "type": getattr(fields[name].annotation, "__name__", "float"),
+                        "default": fields[name].default,
+                    }
+                    for name in spec.params
+                ],
+                "indicators": spec.indicators,
+                "grid_params": [p for p in (spec.grid or ()) if p is not None],
+                "ordered_grid": spec.ordered_grid,
+            }
+        )
+    return schema
+
+
+def _cross_signals(fast: np.ndarray, slow) -> np.ndarray:
+    """fast 上穿 slow 買入、下穿賣出"""
+    signals = np.zeros(np.shape(fast), dtype=np.int8)
+    signals[cross_above(fast, slow)] = 1
+    signals[cross_below(fast, slow)] = -1
+    return signals
+
+
+@register_strategy(
+    StrategyType.MA_CROSS,
+    params=("short_period", "long_period"),
+    indicators={
+        "MA_Short": "sma(close, short_period)",
+        "MA_Long": "sma(close, long_period)",
+    },
+    grid=("short_period", "long_period"),
+    description="短均線上穿長均線買入、下穿賣出",
+)
+def _ma_cross(ind, evaluator, request):
+    return _cross_signals(ind["MA_Short"], ind["MA_Long"])
+
+
+@register_strategy(
+    StrategyType.RSI,
+    params=("rsi_period", "rsi_buy", "rsi_sell"),
+    indicators={"RSI": "rsi(close, rsi_period)"},
+    grid=("rsi_buy", "rsi_sell"),
+    description="RSI 跌破超賣線買入、突破超買線賣出",
+)
+def _rsi(ind, evaluator, request):
+    signals = np.zeros(np.shape(ind["RSI"]), dtype=np.int8)
+    signals[cross_below(ind["RSI"], request.rsi_buy)] = 1
+    signals[cross_above(ind["RSI"], request.rsi_sell)] = -1
+    return signals
+
+
+@register_strategy(
+    StrategyType.MACD,
+    params=("macd_fast", "macd_slow", "macd_signal"),
+    indicators={
+        "MACD": "ema(close, macd_fast) - ema(close, macd_slow)",
+        "MACD_Signal": "ema(ema(close, macd_fast) - ema(close, macd_slow), macd_signal)",
+    },
+    grid=("macd_fast", "macd_slow"),
+    description="MACD 線上穿訊號線買入、下穿賣出",
+)
+def _macd(ind, evaluator, request):
+    return _cross_signals(ind["MACD"], ind["MACD_Signal"])
+
+
+@register_strategy(
+    StrategyType.BOLLINGER,
+    params=("bb_period", "bb_std"),
+    indicators={
+        "BB_Mid": "sma(close, bb_period)",
+        "BB_Upper": "sma(close, bb_period) + std(close, bb_period) * bb_std",
+        "BB_Lower": "sma(close, bb_period) - std(close, bb_period) * bb_std",
+    },
+    grid=("bb_period", None),
+    description="收盤價跌破下軌買入、突破上軌賣出",
+)
+def _bollinger(ind, evaluator, request):
+    close = evaluator.series["close"]
+    signals = np.zeros(close.shape, dtype=np.int8)
+    signals[close < ind["BB_Lower"]] = 1
+    signals[close > ind["BB_Upper"]] = -1
+    return signals
+
+
+@register_strategy(
+    StrategyType.SMA_BREAKOUT,
+    params=("sma_period",),
+    indicators={"SMA": "sma(close, sma_period)"},
+    grid=("sma_period", None),
+    description="收盤價上穿 SMA 買入、下穿賣出",
+)
+def _sma_breakout(ind, evaluator, request):
+    return _cross_signals(evaluator.series["close"], ind["SMA"])
+
+
+@register_strategy(
+    StrategyType.EXPRESSION,
+    params=(),
+    indicators={},
+    grid=("p1", "p2"),
+    ordered_grid=False,
+    params_field="expression_params",
+    description="以 buy_expression / sell_expression 自訂的運算式策略",
+)
+def _expression(ind, evaluator, request):
+    buy, sell = compile_request(request)
+    return evaluator.signals(buy, sell, request.expression_params)
@@ -0,0 +1,313 @@
+"""
+盤中串流回測 - 分 K / 小時 K 依固定大小分段處理，記憶體用量與歷史長度無關
+
+本地資料檔以 iter_intraday_bars 每次讀取 STREAM_CHUNK_BARS 列。每段前面接上前一段
+最後 lookback 根 K 棒再計算指標與訊號，視窗類指標即與整段計算相同；EMA 由前一段
+的值遞迴接續。現金、持股與持倉成本以批次核心逐段模擬並帶到下一段。
+定期投入日需要完整的交易日曆，先只讀時間欄掃過一次檔案，於投入日的第一根 K 棒注資。
+
+只輸出彙總結果：價格與權益曲線為每日最後一根 K 棒的數值 (績效指標也以日權益計算，
+可與日 K 回測直接比較)，交易統計逐段累加，逐筆交易只保留最近 STREAM_MAX_TRADES 筆。
+不支援停損停利、基準比較與滾動指標。
+"""
+
+import os
+from collections import deque
+from datetime import datetime
+from typing import Deque, Dict, List, Optional, Set
+
+import numpy as np
+
+from app.core.cancellation import CancellationToken
+from app.models.backtest import (
+    BacktestRequest,
+    BacktestResult,
+    BenchmarkMode,
+    EquityData,
+    PriceData,
+    StrategyType,
+    TradeRecord,
+)
+from app.services.batch_backtest import _replay_trades
+from app.services.batch_kernel import simulate_long_only
+from app.services.indicators import ema
+from app.services.market_data import iter_intraday_bars
+from app.services.metrics import _clean_float, build_summary, compute_metrics
+from app.services.schedule import contribution_mask
+from app.services.stops import StopRules
+from app.services.strategy_dsl import (
+    ExpressionEvaluator,
+    Node,
+    _window,
+    bind_params,
+    compile_request,
+    lookback,
+    ohlcv_series,
+)
+from app.services.strategy_registry import (
+    STRATEGIES,
+    build_signal_matrix,
+    compute_indicators,
+    get_strategy,
+)
+
+STREAM_CHUNK_BARS = int(os.getenv("STREAM_CHUNK_BARS", "100000"))
+STREAM_MAX_TRADES = int(os.getenv("STREAM_MAX_TRADES", "1000"))
+
+
+def _validate(request: BacktestRequest) -> None:
+    if request.strategy_type not in STRATEGIES or request.stock_allocations:
+        raise ValueError(f"{request.strategy_type.value} 策略不支援盤中串流回測")
+    if StopRules.from_request(request) is not None:
+        raise ValueError("盤中串流回測不支援停損 / 停利 / 移動停損")
+    if request.benchmark_mode != BenchmarkMode.NONE or request.rolling_windows:
+        raise ValueError("盤中串流回測不支援基準比較與滾動指標")
+
+
+def signal_lookback(request: BacktestRequest) -> int:
+    """計算一根 K 棒的訊號需要往前保留的 K 棒數"""
+    spec = get_strategy(request.strategy_type)
+    params = spec.param_values(request)
+    nodes = [bind_params(node, params) for node in spec.compiled.values()]
+    if request.strategy_type == StrategyType.EXPRESSION:
+        nodes += [
+            bind_params(node, request.expression_params)
+            for node in compile_request(request)
+            if node is not None
+        ]
+    # 訊號函式另以前一根 K 棒判斷穿越
+    return max((lookback(node) for node in nodes), default=0) + 1
+
+
+def _paydays(request: BacktestRequest, chunk_bars: int) -> Set[str]:
+    """定期投入日 (只讀取時間欄，記憶體與交易日數成正比)"""
+    if request.dca_amount <= 0:
+        return set()
+    days: List[str] = []
+    for chunk in iter_intraday_bars(
+        request.stock_symbol,
+        request.timeframe,
+        request.start_date,
+        request.end_date,
+        chunk_bars,
+        columns=[],
+    ):
+        for day in chunk["Date"].str.slice(0, 10).unique():
+            if not days or days[-1] != day:
+                days.append(day)
+    mask = contribution_mask(
+        days, request.dca_interval, request.dca_day, request.dca_month
+    )
+    return {day for day, paid in zip(days, mask) if paid}
+
+
+class _ChunkEvaluator(ExpressionEvaluator):
+    """
+    一段的 evaluator：序列為前一段最後 n_tail 根 + 本段的 K 棒
+
+    EMA 前 n_tail 根直接沿用前一段算出的值，本段由前一段最後的值接續。
+    """
+
+    def __init__(
+        self,
+        series: Dict[str, np.ndarray],
+        n_tail: int,
+        ema_tails: Dict[Node, np.ndarray],
+    ):
+        super().__init__(series)
+        self.n_tail = n_tail
+        self.ema_tails = ema_tails
+
+    def evaluate(self, node: Node):
+        if node[0] != "ema" or node in self._cache:
+            return super().evaluate(node)
+        values = self.evaluate(node[1])
+        span = _window(self.evaluate(node[2]))
+        tail = self.ema_tails.get(node)
+        if tail is None:
+            result = ema(values, span)
+        else:
+            continued = ema(values[self.n_tail :], span, initial=tail[-1])
+            result = np.concatenate([tail, continued])
+        self._cache[node] = result
+        return result
+
+    def ema_state(self, keep: int) -> Dict[Node, np.ndarray]:
+        """下一段使用的 EMA 尾端數值"""
+        return {
+            node: values[len(values) - keep :]
+            for node, values in self._cache.items()
+            if node[0] == "ema"
+        }
+
+
+class _TradeTally:
+    """逐段累加的賣出交易統計 (同 trade_statistics，不保留每筆損益)"""
+
+    def __init__(self):
+        self.total = 0
+        self.profit_trades = 0
+        self.loss_trades = 0
+        self.profit_sum = 0.0
+        self.loss_sum = 0.0
+
+    def add(self, pnl: Optional[float]) -> None:
+        self.total += 1
+        if pnl is not None and pnl > 0:
+            self.profit_trades += 1
+            self.profit_sum += pnl
+        elif pnl is not None and pnl < 0:
+            self.loss_trades += 1
+            self.loss_sum += pnl
+
+    def statistics(self) -> Dict[str, float]:
+        return {
+            "total_trades": self.total,
+            "profit_trades": self.profit_trades,
+            "loss_trades": self.loss_trades,
+            "win_rate": self.profit_trades / self.total * 100 if self.total else 0.0,
+            "avg_profit": (
+                self.profit_sum / self.profit_trades if self.profit_trades else 0.0
+            ),
+            "avg_loss": self.loss_sum / self.loss_trades if self.loss_trades else 0.0,
+        }
+
+
+def run_streaming_backtest(
+    request: BacktestRequest,
+    backtest_id: int,
+    token: Optional[CancellationToken] = None,
+    chunk_bars: int = STREAM_CHUNK_BARS,
+) -> BacktestResult:
+    """分段執行盤中回測，回傳日彙總的 BacktestResult"""
+    _validate(request)
+    tail_bars = signal_lookback(request)
+    paydays = _paydays(request, chunk_bars)
+
+    cash = float(request.initial_capital)
+    invested = float(request.initial_capital)
+    shares = np.zeros(1)
+    cost = np.zeros(1)
+    tail: Dict[str, np.ndarray] = {}
+    ema_tails: Dict[Node, np.ndarray] = {}
+    n_bars = 0
+    tally = _TradeTally()
+    recent: Deque[TradeRecord] = deque(maxlen=STREAM_MAX_TRADES)
+    # 每日最後一根 K 棒的日期、收盤價、權益與均線
+    daily: Dict[str, List] = {
+        key: [] for key in ("dates", "close", "equity", "MA_Short", "MA_Long")
+    }
+
+    chunks = iter_intraday_bars(
+        request.stock_symbol,
+        request.timeframe,
+        request.start_date,
+        request.end_date,
+        chunk_bars,
+    )
+    current = next(chunks, None)
+    if current is None:
+        raise ValueError(
+            f"本地數據中沒有 {request.stock_symbol} 在 "
+            f"{request.start_date} ~ {request.end_date} 的盤中資料"
+        )
+    while current is not None:
+        # 先讀下一段，才知道本段是否為最後一段 (期末強制平倉)
+        upcoming = next(chunks, None)
+
+        series = ohlcv_series(current)
+        n_tail = len(tail.get("close", ()))
+        extended = {
+            name: np.concatenate([tail[name], values]) if n_tail else values
+            for name, values in series.items()
+        }
+        evaluator = _ChunkEvaluator(extended, n_tail, ema_tails)
+        signals = build_signal_matrix(request, extended["close"], evaluator)[n_tail:]
+        indicators = compute_indicators(request, evaluator)
+        keep = min(tail_bars, len(extended["close"]))
+        tail = {name: values[len(values) - keep :] for name, values in extended.items()}
+        ema_tails = evaluator.ema_state(keep)
+
+        close = series["close"]
+        dates = current["Date"].tolist()
+        days = np.array([d[:10] for d in dates])
+        last_day = daily["dates"][-1] if daily["dates"] else None
+        day_starts = np.r_[days[0] != last_day, days[1:] != days[:-1]]
+        injections = np.where(
+            day_starts & np.isin(days, list(paydays)), request.dca_amount, 0.0
+        )
+        kernel = simulate_long_only(
+            close[:, None],
+            signals[:, None],
+            cash,
+            injections=injections[:, None],
+            sell_ratio=request.sell_ratio,
+            liquidate_at_end=upcoming is None,
+            token=token,
+            initial_shares=shares,
+            initial_cost=cost,
+        )
+        cash_start = np.concatenate([[cash], kernel.cash[:-1, 0]]) + injections
+        for trade in _replay_trades(
+            kernel.trades, dates, close, cash_start, int(shares[0])
+        ):
+            recent.append(trade)
+            if trade.action == "SELL":
+                tally.add(trade.pnl)
+
+        day_ends = np.flatnonzero(np.r_[days[1:] != days[:-1], True])
+        equity = kernel.equity[:, 0]
+        for i in day_ends:
+            # 跨段的日期以後一段的最後一根為準
+            if daily["dates"] and daily["dates"][-1] == days[i]:
+                for values in daily.values():
+                    values.pop()
+            daily["dates"].append(str(days[i]))
+            daily["close"].append(round(_clean_float(close[i]), 2))
+            daily["equity"].append(_clean_float(round(float(equity[i]), 2)))
+            for name in ("MA_Short", "MA_Long"):
+                value = indicators.get(name)
+                daily[name].append(
+                    None
+                    if value is None or not np.isfinite(value[n_tail + i])
+                    else round(float(value[n_tail + i]), 2)
+                )
+
+        cash = float(kernel.cash[-1, 0])
+        shares = kernel.final_shares
+        cost = kernel.final_cost
+        # 與引擎相同的逐次累加
+        for amount in injections[injections > 0]:
+            invested += amount
+        n_bars += len(close)
+        current = upcoming
+
+    metrics = compute_metrics(np.asarray(daily["equity"]), invested)
+    summary = build_summary(metrics, [], invested, stats=tally.statistics())
+    equity_list = daily["equity"]
+    return BacktestResult(
+        id=backtest_id,
+        strategy_name=request.strategy_name,
+        stock_symbol=request.stock_symbol,
+        strategy_type=request.strategy_type.value,
+        start_date=request.start_date,
+        end_date=request.end_date,
+        initial_capital=request.initial_capital,
+        final_capital=equity_list[-1] if equity_list else request.initial_capital,
+        created_at=datetime.now().strftime("%Y-%m-%d %H:%M"),
+        summary=summary,
+        price_data=PriceData(
+            dates=daily["dates"],
+            prices=daily["close"],
+            ma_short=daily["MA_Short"],
+            ma_long=daily["MA_Long"],
+        ),
+        equity_data=EquityData(dates=daily["dates"], equity=equity_list),
+        trades=list(recent),
+        params={
+            "strategy_type": request.strategy_type.value,
+            "timeframe": request.timeframe.value,
+            "bars": n_bars,
+            "trades_kept": len(recent),
+        },
+    )
@@ -0,0 +1,120 @@
+"""
+K 棒週期 - 將日 K 重採樣為週 K / 月 K，並將高週期數值對回日 K
+
+週 K 以週一至週日為一期，月 K 以曆月為一期；開盤取第一天、最高 / 最低取極值、
+收盤取最後一天、成交量加總，日期為該期最後一個交易日 (K 棒完成的日期)。
+只由傳入的日 K 聚合，因此起訖日落在週期中間時頭尾為不完整的 K 棒。
+"""
+
+from typing import Dict, List, Mapping, Sequence, Tuple
+
+import numpy as np
+import pandas as pd
+
+from app.models.backtest import Timeframe
+from app.services.metrics import TRADING_DAYS_PER_YEAR
+
+# 由本地資料檔以串流模式回測的盤中週期
+INTRADAY_TIMEFRAMES = (Timeframe.MINUTE, Timeframe.HOURLY)
+
+PERIODS_PER_YEAR: Dict[Timeframe, int] = {
+    Timeframe.DAILY: TRADING_DAYS_PER_YEAR,
+    Timeframe.WEEKLY: 52,
+    Timeframe.MONTHLY: 12,
+}
+
+# 欄位 (小寫) -> 聚合方式，其他欄位 (例如股利) 重採樣後捨棄
+_AGGREGATES = {
+    "open": "first",
+    "high": "max",
+    "low": "min",
+    "close": "last",
+    "volume": "sum",
+}
+
+
+def periods_per_year(timeframe: Timeframe) -> int:
+    return PERIODS_PER_YEAR[timeframe]
+
+
+def period_bounds(
+    dates: Sequence[str], timeframe: Timeframe
+) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    每個週期在 dates (遞增的 YYYY-MM-DD) 中的第一天與最後一天索引
+
+    Returns:
+        (starts, ends)，長度皆為週期數
+    """
+    days = np.asarray(dates, dtype="datetime64[D]")
+    if timeframe == Timeframe.WEEKLY:
+        # 1970-01-01 為週四，+3 後以 7 整除即為以週一起算的週序號
+        labels = (days.astype(np.int64) + 3) // 7
+    elif timeframe == Timeframe.MONTHLY:
+        labels = days.astype("datetime64[M]").astype(np.int64)
+    else:
+        labels = days.astype(np.int64)
+    n = len(labels)
+    if n == 0:
+        return np.zeros(0, dtype=np.intp), np.zeros(0, dtype=np.intp)
+    starts = np.flatnonzero(np.r_[True, labels[1:] != labels[:-1]])
+    ends = np.r_[starts[1:], n] - 1
+    return starts, ends
+
+
+def _aggregate(values: np.ndarray, how: str, starts, ends) -> np.ndarray:
+    if how == "first":
+        return values[starts]
+    if how == "last":
+        return values[ends]
+    reducer = {"max": np.maximum, "min": np.minimum, "sum": np.add}[how]
+    return reducer.reduceat(values, starts, axis=0)
+
+
+def resample_series(
+    series: Mapping[str, np.ndarray], dates: Sequence[str], timeframe: Timeframe
+) -> Tuple[Dict[str, np.ndarray], List[str]]:
+    """重採樣以小寫欄位名稱為鍵的價格陣列 ((Days,) 或 (Days, N))，回傳 (序列, 週期日期)"""
+    starts, ends = period_bounds(dates, timeframe)
+    resampled = {
+        name: _aggregate(
+            np.asarray(values, dtype=float), _AGGREGATES[name], starts, ends
+        )
+        for name, values in series.items()
+        if name in _AGGREGATES
+    }
+    return resampled, [dates[i] for i in ends]
+
+
+def resample_ohlcv(df: pd.DataFrame, timeframe: Timeframe) -> pd.DataFrame:
+    """重採樣日 K DataFrame (Date 與 Open/High/Low/Close/Volume 欄)"""
+    if timeframe == Timeframe.DAILY:
+        return df
+    columns = [c for c in df.columns if c.lower() in _AGGREGATES]
+    series, period_dates = resample_series(
+        {c.lower(): df[c].to_numpy(dtype=float) for c in columns},
+        df["Date"].tolist(),
+        timeframe,
+    )
+    return pd.DataFrame(
+        {"Date": period_dates, **{c: series[c.lower()] for c in columns}}
+    )
+
+
+def align_to_dates(
+    values, period_dates: Sequence[str], dates: Sequence[str]
+) -> np.ndarray:
+    """
+    將高週期數值對回 dates：每天取最後一根已完成 (週期日期 <= 當天) 的高週期 K 棒
+
+    週期尚未結束的日子使用上一期的數值，避免使用未來資料；第一期完成前為 NaN。
+    """
+    values = np.asarray(values, dtype=float)
+    index = (
+        np.searchsorted(np.asarray(period_dates), np.asarray(dates), side="right") - 1
+    )
+    if values.ndim == 0:
+        values = np.full(len(period_dates), float(values))
+    aligned = values[np.maximum(index, 0)]
+    aligned[index < 0] = np.nan
+    return aligned
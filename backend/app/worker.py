@@ -0,0 +1,61 @@
+"""
+背景工作 worker - 從 jobs 佇列領取並執行回測 / 最佳化工作
+
+用法:
+    python -m app.worker                 # 單一 worker
+    python -m app.worker --processes 4   # 4 個 worker 行程
+
+worker 只需與 API 指向同一個 DATABASE_URL，可部署在不同機器上水平擴充。
+"""
+
+import argparse
+import multiprocessing
+import signal
+import threading
+
+from dotenv import load_dotenv
+
+load_dotenv()
+
+from app.core.database import init_db
+from app.services.job_queue import run_worker
+
+
+def _worker_process(poll_interval: float) -> None:
+    stop_event = threading.Event()
+    signal.signal(signal.SIGTERM, lambda *_: stop_event.set())
+    try:
+        run_worker(poll_interval=poll_interval, stop_event=stop_event)
+    except KeyboardInterrupt:
+        pass
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="回測背景工作 worker")
+    parser.add_argument("--processes", type=int, default=1, help="worker 行程數")
+    parser.add_argument(
+        "--poll-interval", type=float, default=1.0, help="佇列為空時的輪詢間隔 (秒)"
+    )
+    args = parser.parse_args()
+
+    init_db()
+    if args.processes <= 1:
+        _worker_process(args.poll_interval)
+        return
+
+    processes = [
+        multiprocessing.Process(target=_worker_process, args=(args.poll_interval,))
+        for _ in range(args.processes)
+    ]
+    for process in processes:
+        process.start()
+    try:
+        for process in processes:
+            process.join()
+    except KeyboardInterrupt:
+        for process in processes:
+            process.terminate()
+
+
+if __name__ == "__main__":
+    main()
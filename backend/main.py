@@ -1,4 +1,5 @@
 import os
+import threading
 from contextlib import asynccontextmanager
 from typing import List
 
@@ -11,8 +12,13 @@ from fastapi.middleware.cors import CORSMiddleware
 from starlette.middleware.sessions import SessionMiddleware
 from datetime import datetime
 
-from app.routers import backtest, strategy, auth
+from app.routers import backtest, strategy, auth, jobs
 from app.core.database import init_db
+from app.services.job_queue import run_worker
+from app.services.record_refresh import RECORD_REFRESH_AT, run_refresh_scheduler
+
+# 單機部署時可在 API 行程內啟動 worker 執行緒；正式環境建議以 python -m app.worker 分開執行
+JOB_EMBEDDED_WORKERS = int(os.getenv("JOB_EMBEDDED_WORKERS", "0"))
 
 
 def get_cors_origins() -> List[str]:
@@ -32,7 +38,26 @@ def get_cors_origins() -> List[str]:
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     init_db()
+    stop_event = threading.Event()
+    workers = [
+        threading.Thread(
+            target=run_worker, kwargs={"stop_event": stop_event}, daemon=True
+        )
+        for _ in range(JOB_EMBEDDED_WORKERS)
+    ]
+    # 單機部署時可在 API 行程內每日更新回測紀錄；多個 API 行程時建議改以 cron 執行 app.refresh
+    if RECORD_REFRESH_AT:
+        workers.append(
+            threading.Thread(
+                target=run_refresh_scheduler,
+                args=(RECORD_REFRESH_AT, stop_event),
+                daemon=True,
+            )
+        )
+    for worker in workers:
+        worker.start()
     yield
+    stop_event.set()
 
 
 app = FastAPI(
@@ -60,6 +85,7 @@ app.add_middleware(
 app.include_router(auth.router)
 app.include_router(backtest.router)
 app.include_router(strategy.router)
+app.include_router(jobs.router)
 
 
 @app.get("/")
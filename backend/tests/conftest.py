@@ -0,0 +1,64 @@
+"""
+測試共用設定 - 暫存 SQLite 資料庫與決定性的合成行情 (不連線 yfinance)
+"""
+
+import os
+import tempfile
+import zlib
+
+# 需在匯入 app 之前設定：app.core.database 於匯入時建立 engine
+os.environ["DATABASE_URL"] = "sqlite:///" + os.path.join(tempfile.mkdtemp(), "test.db")
+
+import numpy as np  # noqa: E402
+import pandas as pd  # noqa: E402
+import pytest  # noqa: E402
+
+from app.core.database import init_db  # noqa: E402
+from app.services import market_data  # noqa: E402
+from app.services.checkpoints import engine_checkpoints  # noqa: E402
+from app.services.result_cache import result_cache  # noqa: E402
+
+
+def synthetic_history(symbol: str, start_date: str, end_date: str) -> pd.DataFrame:
+    """每檔股票固定亂數種子的日 K (2005 ~ 2021 的工作日)，格式同 _download_history"""
+    rng = np.random.default_rng(zlib.crc32(symbol.encode("utf-8")))
+    dates = pd.bdate_range("2005-01-03", "2021-12-31")
+    n = len(dates)
+    close = 50 * np.exp(np.cumsum(rng.normal(0.0003, 0.015, n)))
+    df = pd.DataFrame(
+        {
+            "Date": dates.strftime("%Y-%m-%d"),
+            "Open": close * (1 + rng.normal(0, 0.003, n)),
+            "High": close * (1 + np.abs(rng.normal(0, 0.01, n))),
+            "Low": close * (1 - np.abs(rng.normal(0, 0.01, n))),
+            "Close": close,
+            "Volume": 1000.0,
+        }
+    )
+    df = df[(df["Date"] >= start_date) & (df["Date"] < end_date)]
+    if df.empty:
+        raise ValueError(f"無法取得 {symbol} 的數據")
+    return df.reset_index(drop=True)
+
+
+@pytest.fixture(scope="session", autouse=True)
+def database():
+    init_db()
+
+
+@pytest.fixture(autouse=True)
+def downloads(monkeypatch):
+    """以合成行情取代 yfinance，回傳下載紀錄 [(股票, 起日, 訖日), ...]"""
+    calls = []
+
+    def download(symbol, start_date, end_date):
+        calls.append((symbol, start_date, end_date))
+        return synthetic_history(symbol, start_date, end_date)
+
+    monkeypatch.setattr(market_data, "_download_history", download)
+    monkeypatch.setattr(market_data, "LOCAL_DATA_DIR", "")
+    market_data.price_cache.clear()
+    market_data.resample_cache.clear()
+    result_cache.clear()
+    engine_checkpoints.clear()
+    return calls
@@ -0,0 +1,125 @@
+import pytest
+
+from app.models.backtest import BacktestRequest
+from app.services import market_data
+from app.services.backtest_engine import BacktestEngine, run_full_backtest
+from app.services.checkpoints import (
+    EngineCheckpoint,
+    checkpoint_key,
+    engine_checkpoints,
+)
+from conftest import synthetic_history
+
+BASE = dict(
+    strategy_name="cp",
+    stock_symbol="AAA",
+    start_date="2014-01-01",
+    end_date="2018-06-01",
+    initial_capital=100000,
+)
+CASES = {
+    "dca": dict(strategy_type="DCA"),
+    "ma_cross_stops": dict(
+        strategy_type="MA_CROSS", dca_amount=0, stop_loss=0.05, trailing_stop=0.08
+    ),
+    "rsi_dca": dict(strategy_type="RSI", dca_amount=5000),
+    "expression": dict(
+        strategy_type="EXPRESSION",
+        buy_expression="crossover(close, sma(close, 20))",
+        sell_expression="crossunder(close, sma(close, 20))",
+    ),
+    "weekly": dict(strategy_type="MA_CROSS", timeframe="WEEKLY", dca_amount=0),
+}
+
+
+@pytest.fixture
+def resumed(monkeypatch):
+    """記錄每次 run_backtest 由檢查點接續的 K 棒數"""
+    bars = []
+    run_backtest = BacktestEngine.run_backtest
+
+    def record(self, resume=None):
+        result = run_backtest(self, resume)
+        bars.append(self.resumed_bars)
+        return result
+
+    monkeypatch.setattr(BacktestEngine, "run_backtest", record)
+    return bars
+
+
+def extended(request: BacktestRequest) -> BacktestRequest:
+    return request.model_copy(update={"end_date": "2019-06-01"})
+
+
+def comparable(result):
+    return result.model_dump(mode="json", exclude={"created_at"})
+
+
+def full_run(request: BacktestRequest):
+    engine_checkpoints.clear()
+    return run_full_backtest(request, 0)
+
+
+@pytest.mark.parametrize("case", CASES)
+def test_resumed_run_equals_full_run(case, resumed):
+    request = BacktestRequest(**BASE, **CASES[case])
+    run_full_backtest(request, 0)
+    result = run_full_backtest(extended(request), 0)
+    assert resumed[-1] > 0
+
+    assert comparable(result) == comparable(full_run(extended(request)))
+
+
+def test_key_ignores_end_date_only():
+    request = BacktestRequest(**BASE, **CASES["dca"])
+    assert checkpoint_key(request) == checkpoint_key(extended(request))
+    changed = request.model_copy(update={"dca_amount": 1})
+    assert checkpoint_key(request) != checkpoint_key(changed)
+
+
+def test_restored_state_resumes_like_the_in_memory_checkpoint(resumed):
+    request = BacktestRequest(**BASE, **CASES["ma_cross_stops"])
+    first = run_full_backtest(request, 0)
+    state = engine_checkpoints.state_for(request)
+
+    # 只由保存的狀態與結果還原 (例如另一個行程每日更新紀錄)
+    engine_checkpoints.clear()
+    engine_checkpoints.put(
+        request,
+        EngineCheckpoint.from_state(state, first.trades, first.equity_data.equity),
+    )
+    result = run_full_backtest(extended(request), 0)
+    assert resumed[-1] == state["n_bars"]
+
+    assert comparable(result) == comparable(full_run(extended(request)))
+
+
+def test_adjusted_history_falls_back_to_full_run(resumed, monkeypatch):
+    request = BacktestRequest(**BASE, **CASES["ma_cross_stops"])
+    run_full_backtest(request, 0)
+
+    # 除權息後還原價格整段改變：前段摘要不符，改為從頭執行
+    def adjusted(symbol, start_date, end_date):
+        df = synthetic_history(symbol, start_date, end_date)
+        df[["Open", "High", "Low", "Close"]] *= 0.97
+        return df
+
+    monkeypatch.setattr(market_data, "_download_history", adjusted)
+    market_data.price_cache.clear()
+    result = run_full_backtest(extended(request), 0)
+    assert resumed[-1] == 0
+
+    assert comparable(result) == comparable(full_run(extended(request)))
+
+
+def test_unsupported_engines_do_not_store_checkpoints():
+    request = BacktestRequest(
+        **BASE,
+        strategy_type="DCA",
+        stock_allocations=[
+            {"stock_symbol": "AAA", "allocation_ratio": 0.5},
+            {"stock_symbol": "BBB", "allocation_ratio": 0.5},
+        ],
+    )
+    run_full_backtest(request, 0)
+    assert engine_checkpoints.get(request) is None
@@ -0,0 +1,111 @@
+import threading
+from datetime import datetime, timedelta
+
+import pytest
+
+from app.core.database import SessionLocal
+from app.core.models import Job
+from app.models.backtest import JobKind, JobStatus
+from app.services import job_queue
+
+BACKTEST = dict(
+    strategy_name="job",
+    stock_symbol="AAA",
+    strategy_type="MA_CROSS",
+    start_date="2015-01-01",
+    end_date="2017-01-01",
+)
+
+
+@pytest.fixture
+def db():
+    session = SessionLocal()
+    session.query(Job).delete()
+    session.commit()
+    yield session
+    session.close()
+
+
+def submit(db, **kwargs) -> Job:
+    return job_queue.submit_job(db, 1, JobKind.BACKTEST, BACKTEST, **kwargs)
+
+
+def expire_heartbeat(db, job_id: int) -> None:
+    stale = datetime.utcnow() - timedelta(seconds=job_queue.JOB_STALE_SECONDS + 1)
+    db.query(Job).filter(Job.id == job_id).update({"heartbeat_at": stale})
+    db.commit()
+
+
+def test_submit_rejects_invalid_payload(db):
+    with pytest.raises(ValueError):
+        job_queue.submit_job(db, 1, JobKind.BACKTEST, {"stock_symbol": "AAA"})
+    assert db.query(Job).count() == 0
+
+
+def test_job_is_claimed_by_one_worker_only(db):
+    job = submit(db)
+    claimed = job_queue.claim_next_job(db, "w1")
+    assert claimed.id == job.id
+    assert (claimed.status, claimed.worker_id, claimed.attempts) == (
+        JobStatus.RUNNING.value,
+        "w1",
+        1,
+    )
+    assert job_queue.claim_next_job(db, "w2") is None
+
+
+def test_expired_heartbeat_requeues_exactly_once(db):
+    job = submit(db)
+    job_queue.claim_next_job(db, "w1")
+    expire_heartbeat(db, job.id)
+
+    assert job_queue.requeue_stale_jobs(db) == 1
+    assert job_queue.requeue_stale_jobs(db) == 0
+    db.refresh(job)
+    assert (job.status, job.worker_id) == (JobStatus.QUEUED.value, None)
+
+    # 重新分派後，原本的 worker 不能再覆寫工作狀態
+    assert job_queue.claim_next_job(db, "w2").attempts == 2
+    assert not job_queue._update_owned(job.id, "w1", {"progress": 0.5})
+    assert job_queue._update_owned(job.id, "w2", {"progress": 0.5})
+
+
+def test_expired_heartbeat_fails_after_max_attempts(db):
+    job = submit(db, max_attempts=1)
+    job_queue.claim_next_job(db, "w1")
+    expire_heartbeat(db, job.id)
+
+    assert job_queue.requeue_stale_jobs(db) == 1
+    db.refresh(job)
+    assert job.status == JobStatus.FAILED.value
+    assert job.error
+    assert job_queue.claim_next_job(db, "w2") is None
+
+
+def test_heartbeat_keeps_running_after_a_failed_write(monkeypatch):
+    monkeypatch.setattr(job_queue, "JOB_HEARTBEAT_SECONDS", 0.01)
+    writes = []
+    written = threading.Event()
+
+    def update(job_id, worker_id, values):
+        writes.append(values)
+        if len(writes) == 1:
+            raise RuntimeError("database is locked")
+        written.set()
+        return True
+
+    monkeypatch.setattr(job_queue, "_update_owned", update)
+    with job_queue._Heartbeat(1, "w1") as heartbeat:
+        heartbeat.report(0.25)
+        assert written.wait(5)
+    assert writes[-1]["progress"] == 0.25
+
+
+def test_execute_job_stores_result(db):
+    job = submit(db)
+    claimed = job_queue.claim_next_job(db, "w1")
+    assert job_queue.execute_job(claimed, "w1") == JobStatus.SUCCEEDED
+    db.refresh(job)
+    assert job.status == JobStatus.SUCCEEDED.value
+    assert job.progress == 1.0
+    assert job.result["backtest_id"]
@@ -0,0 +1,123 @@
+import threading
+import time
+
+import pytest
+
+from app.core.cancellation import OperationCancelled
+from app.models.backtest import BacktestRequest
+from app.services.backtest_engine import run_full_backtest
+from app.services.market_data import fetch_history
+from app.services.result_cache import ResultCache, request_key
+
+REQUEST = BacktestRequest(
+    strategy_name="first",
+    stock_symbol="AAA",
+    strategy_type="MA_CROSS",
+    start_date="2015-01-01",
+    end_date="2018-01-01",
+)
+
+
+def renamed(name: str) -> BacktestRequest:
+    return REQUEST.model_copy(update={"strategy_name": name})
+
+
+def test_key_ignores_display_name_only():
+    assert request_key(REQUEST) == request_key(renamed("other"))
+    changed = REQUEST.model_copy(update={"short_period": 7})
+    assert request_key(REQUEST) != request_key(changed)
+
+
+def test_concurrent_identical_requests_compute_once():
+    cache = ResultCache()
+    calls = []
+    release = threading.Event()
+
+    def compute():
+        calls.append(1)
+        release.wait(5)
+        return run_full_backtest(REQUEST, 0)
+
+    results = {}
+
+    def request(name: str, backtest_id: int) -> None:
+        results[name] = cache.get_or_compute(renamed(name), backtest_id, compute)
+
+    leader = threading.Thread(target=request, args=("leader", 1))
+    leader.start()
+    while cache.stats()["misses"] == 0:
+        time.sleep(0.01)
+    follower = threading.Thread(target=request, args=("follower", 2))
+    follower.start()
+    while cache.stats()["coalesced"] == 0:
+        time.sleep(0.01)
+    release.set()
+    leader.join(5)
+    follower.join(5)
+
+    assert len(calls) == 1
+    assert (results["follower"].id, results["follower"].strategy_name) == (
+        2,
+        "follower",
+    )
+    assert results["follower"].summary == results["leader"].summary
+
+
+def test_hit_returns_a_personalized_copy():
+    cache = ResultCache()
+    first = cache.get_or_compute(REQUEST, 1, lambda: run_full_backtest(REQUEST, 1))
+    hit = cache.get_or_compute(renamed("again"), 2, pytest.fail)
+    assert (hit.id, hit.strategy_name) == (2, "again")
+    assert hit.summary == first.summary
+    hit.trades.clear()
+    assert cache.lookup(REQUEST).trades == first.trades
+
+
+def test_new_price_data_invalidates_entry():
+    cache = ResultCache()
+    cache.get_or_compute(REQUEST, 1, lambda: run_full_backtest(REQUEST, 1))
+    assert cache.lookup(REQUEST) is not None
+    # 價格快取補入更早的資料 -> 版本改變
+    fetch_history("AAA", "2010-01-01", "2018-01-01")
+    assert cache.lookup(REQUEST) is None
+
+
+def test_waiter_recomputes_when_leader_is_cancelled():
+    cache = ResultCache()
+    release = threading.Event()
+    calls = []
+
+    def cancelled():
+        calls.append("leader")
+        release.wait(5)
+        raise OperationCancelled("運算已取消")
+
+    def compute():
+        calls.append("follower")
+        return run_full_backtest(REQUEST, 0)
+
+    errors = []
+
+    def lead() -> None:
+        try:
+            cache.get_or_compute(REQUEST, 1, cancelled)
+        except OperationCancelled as e:
+            errors.append(e)
+
+    leader = threading.Thread(target=lead)
+    leader.start()
+    while cache.stats()["misses"] == 0:
+        time.sleep(0.01)
+    results = []
+    follower = threading.Thread(
+        target=lambda: results.append(cache.get_or_compute(REQUEST, 2, compute))
+    )
+    follower.start()
+    while cache.stats()["coalesced"] == 0:
+        time.sleep(0.01)
+    release.set()
+    leader.join(5)
+    follower.join(5)
+
+    assert calls == ["leader", "follower"]
+    assert len(errors) == 1 and len(results) == 1
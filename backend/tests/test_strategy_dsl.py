@@ -0,0 +1,137 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from app.models.backtest import BacktestRequest, OptimizeRequest, WalkForwardRequest
+from app.services.backtest_engine import run_full_backtest
+from app.services.optimizer import optimize_parameter_grid, run_walk_forward
+from app.services.strategy_dsl import (
+    ExpressionEvaluator,
+    bind_params,
+    compile_expression,
+    expression_params,
+    lookback,
+)
+
+CLOSE = np.array([10.0, 11.0, 12.0, 11.0, 10.0, 9.0, 10.0, 12.0, 13.0, 12.0])
+
+
+def evaluate(text, series=None, params=None, dates=None):
+    node = bind_params(compile_expression(text), params or {})
+    return ExpressionEvaluator(series or {"close": CLOSE}, dates).evaluate(node)
+
+
+def test_sma_matches_pandas_rolling_mean():
+    expected = pd.Series(CLOSE).rolling(3).mean().to_numpy()
+    np.testing.assert_allclose(evaluate("sma(close, 3)"), expected, equal_nan=True)
+
+
+def test_arithmetic_and_comparison():
+    result = evaluate("(close - 10) * 2 >= 4")
+    np.testing.assert_array_equal(result, (CLOSE - 10) * 2 >= 4)
+
+
+def test_crossover_only_on_the_crossing_bar():
+    result = evaluate("crossover(close, 11.5)")
+    assert np.flatnonzero(result).tolist() == [2, 7]
+
+
+def test_parameters_are_bound_before_evaluation():
+    node = compile_expression("sma(close, p1) > sma(close, p2)")
+    assert expression_params(node) == {"p1", "p2"}
+    bound = bind_params(node, {"p1": 2, "p2": 4})
+    assert bound == bind_params(compile_expression("sma(close, 2) > sma(close, 4)"), {})
+    with pytest.raises(ValueError):
+        bind_params(node, {"p1": 2})
+
+
+def test_equivalent_subexpressions_are_computed_once():
+    evaluator = ExpressionEvaluator({"close": CLOSE})
+    evaluator.evaluate(
+        bind_params(compile_expression("sma(close, 3) > 1 and 1 < sma(close, 3)"), {})
+    )
+    sma_nodes = [node for node in evaluator._cache if node[0] == "sma"]
+    assert len(sma_nodes) == 1
+
+
+@pytest.mark.parametrize(
+    "text",
+    [
+        "",
+        "__import__('os').system('true')",
+        "close.real > 1",
+        "[close][0] > 1",
+        "lambda: 1",
+        "unknown(close)",
+        "sma(close)",
+        "sma(close, 3",
+        "x" * 1001,
+    ],
+)
+def test_rejects_invalid_expressions(text):
+    with pytest.raises(ValueError):
+        compile_expression(text)
+
+
+def test_missing_price_column_is_a_value_error():
+    with pytest.raises(ValueError):
+        evaluate("high > close")
+
+
+def test_lookback_covers_window_and_crossover():
+    node = bind_params(compile_expression("crossover(sma(close, 20), close)"), {})
+    assert lookback(node) == 20
+
+
+def test_higher_timeframe_needs_dates():
+    with pytest.raises(ValueError):
+        evaluate("close > weekly(sma(close, 2))")
+    dates = pd.bdate_range("2020-01-06", periods=len(CLOSE)).strftime("%Y-%m-%d")
+    result = evaluate("weekly(close)", dates=list(dates))
+    # 週 K 在該週最後一個交易日完成，之前沒有值，之後為最近完成週的收盤價
+    assert np.isnan(result[:4]).all()
+    assert result[4:].tolist() == [CLOSE[4]] * 5 + [CLOSE[9]]
+
+
+EXPRESSION = dict(
+    strategy_type="EXPRESSION",
+    buy_expression="close > highest(high, p1) * 0.99",
+    sell_expression="close < sma(low, p2)",
+)
+GRID = dict(
+    stock_symbol="AAA",
+    start_date="2012-01-01",
+    end_date="2020-01-01",
+    param1_range=[5, 30],
+    param1_step=5,
+    param2_range=[10, 50],
+    param2_step=10,
+)
+
+
+def test_grid_best_cell_matches_engine_for_ohlc_expression():
+    result = optimize_parameter_grid(OptimizeRequest(**GRID, **EXPRESSION))
+    engine = run_full_backtest(
+        BacktestRequest(
+            strategy_name="best",
+            stock_symbol="AAA",
+            start_date="2012-01-01",
+            end_date="2020-01-01",
+            expression_params={"p1": result.best_param1, "p2": result.best_param2},
+            **EXPRESSION,
+        ),
+        0,
+    )
+    assert result.best_return == engine.summary.total_return
+
+
+def test_walk_forward_evaluates_ohlc_and_higher_timeframe_expressions():
+    result = run_walk_forward(
+        WalkForwardRequest(
+            **GRID,
+            strategy_type="EXPRESSION",
+            buy_expression="close > highest(high, p1) * 0.99 and close > weekly(sma(close, 10))",
+            sell_expression="close < sma(low, p2)",
+        )
+    )
+    assert result.folds